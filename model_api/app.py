@@ -1,30 +1,52 @@
+import time
+# Cold-start clock for STARTUP_BUDGET_SECONDS, started before the imports below
+IMPORT_STARTED = time.perf_counter()
+import logging
 import os
 from typing import Dict, List, Optional, Union
-from fastapi import FastAPI, HTTPException, Depends, File, Query, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Depends, File, Query, Request, Response, UploadFile, Form
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-import joblib
 from pydantic import BaseModel, Field
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.linear_model import LinearRegression, LogisticRegression
-from sklearn.svm import SVC
-from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
-from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
 import pickle
 import json
 import numpy as np
 from io import BytesIO
 import bcrypt
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
 from config import Config
-from database import get_db, User, MLModel, Dataset, Prediction
+from database import get_db, get_async_db, dispose_async_engine, init_db, User, MLModel, Dataset, Prediction, TrainingJob
+from artifacts import artifact_store
+from model_cache import model_cache
+from caching import TTLCache
+from auth_cache import CurrentUser, lookup_user, invalidate_user
+from prediction_log import prediction_writer, log_predictions
+from inference import encode_features
+from prediction_cache import prediction_cache, predict_memoized
+from compiled_trees import PREDICTORS, COMPILABLE_TYPES
+from evaluation import EVALUATIONS, SEARCH_MODES
+from executors import io_pool, run_blocking, pool_stats, shutdown_pools
+from metrics import CONTENT_TYPE, MetricsMiddleware, record_startup, render_metrics, stage_timer
+from downloads import DOWNLOAD_FORMATS, MEDIA_TYPES, RangeNotSatisfiable, iter_encoded, iter_file, negotiate_encoding, open_download, open_stored_encoded, parse_range
+from cleaning import find_version, materialize_version, normalize_operations, pipeline_hash, preview_operations
+from training import TrainingError, validate_against_profile, verify_compiled_predictor
+from model_types import MODEL_TYPES, warm_up
+from streaming import TRAINING_MODES, STREAMING_MODEL_TYPES
+from columnar import ColumnarWriter, ensure_columnar, read_columns, iter_chunks, link_columnar, remove_columnar
+from profiling import DatasetProfiler, profile_chunks, profile_summary
+from storage import TeeReader, blob_store
+from blobs import acquire_blob
+from jobs import submit_job, cancel_job, fail_abandoned_jobs, resume_jobs, serialize_job
 from fastapi.middleware.cors import CORSMiddleware
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 app.add_middleware(
@@ -33,7 +55,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Total-Count"],
 )
+# Outermost, so latency covers every other middleware
+app.add_middleware(MetricsMiddleware)
 
 SECRET_KEY = Config.JWT_SECRET_KEY
 ALGORITHM = Config.ALGORITHM
@@ -41,6 +66,37 @@ ACCESS_TOKEN_EXPIRE_MINUTES = Config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+@app.on_event("startup")
+def upgrade_database():
+    # Before anything queries columns or tables that earlier versions did not have
+    for change in init_db():
+        logger.info("Database schema upgraded: %s", change)
+
+@app.on_event("startup")
+def resume_training_jobs():
+    resume_jobs()
+
+@app.on_event("startup")
+def warm_up_model_types():
+    # In the background, so the worker serves requests while estimator modules import
+    if Config.MODEL_WARM_UP:
+        io_pool.submit(warm_up)
+
+@app.on_event("startup")
+def check_startup_budget():
+    # Registered last, so it covers imports and every other startup hook
+    record_startup(time.perf_counter() - IMPORT_STARTED, Config.STARTUP_BUDGET_SECONDS)
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await dispose_async_engine()
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    # Drain buffered prediction rows before the pools they may depend on go away
+    prediction_writer.stop(timeout=Config.PREDICTION_LOG_SHUTDOWN_TIMEOUT_S)
+    shutdown_pools()
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -56,7 +112,7 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -69,40 +125,11 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
+    user = await lookup_user(db, username, payload.get("exp"))
     if user is None:
         raise credentials_exception
     return user
 
-def handle_missing_data(df, strategy='drop', fill_value=None):
-    if strategy == 'drop':
-        df = df.dropna()
-    elif strategy == 'fill':
-        df = df.fillna(fill_value)
-    return df
-
-def remove_duplicates(df):
-    df = df.drop_duplicates()
-    return df
-
-def convert_column_type(df, column, new_type):
-    try:
-        df[column] = df[column].astype(new_type)
-    except Exception as e:
-        raise ValueError(f"Failed to convert column {column} to {new_type}: {str(e)}")
-    return df
-
-def remove_outliers(df, column, method='zscore', threshold=3):
-    if method == 'zscore':
-        z_scores = np.abs((df[column] - df[column].mean()) / df[column].std())
-        df = df[z_scores < threshold]
-    elif method == 'iqr':
-        Q1 = df[column].quantile(0.25)
-        Q3 = df[column].quantile(0.75)
-        IQR = Q3 - Q1
-        df = df[(df[column] >= Q1 - 1.5 * IQR) & (df[column] <= Q3 + 1.5 * IQR)]
-    return df
-
 class ColumnInfo(BaseModel):
     name: str
     dtype: str
@@ -139,12 +166,16 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+# Parse progress of in-flight uploads, keyed by (user_id, client-chosen upload_id)
+upload_progress = {}
+
 @app.post("/dataset")
 def upload_dataset(
     file: UploadFile = File(...),
     name: str = Form(...),
     description: str = Form(None),
-    current_user: User = Depends(get_current_user),
+    upload_id: Optional[str] = Form(None),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     print(f"Received file: {file.filename}, Name: {name}, Description: {description}")
@@ -152,107 +183,187 @@ def upload_dataset(
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a CSV file.")
 
+    progress = {"bytes_total": file.size, "bytes_read": 0, "rows_parsed": 0}
+    if upload_id:
+        upload_progress[(current_user.id, upload_id)] = progress
+
+    # One pass over the upload: bytes are hashed and compressed into the blob store as pandas
+    # reads them, and each parsed chunk feeds validation, profiling and the columnar writer
+    sink = blob_store.new_upload()
+    reader = TeeReader(file.file, sink, on_read=lambda n: progress.update(bytes_read=n))
+    writer = ColumnarWriter()
+    profiler = DatasetProfiler()
+    preview = None
     try:
-        # Attempt to read the CSV
-        df = pd.read_csv(file.file)
-        if df.empty or df.shape[1] == 0:
+        try:
+            with stage_timer("upload", "parse"):
+                for chunk in pd.read_csv(reader, chunksize=Config.UPLOAD_CHUNK_ROWS):
+                    if preview is None:
+                        if chunk.shape[1] == 0:
+                            raise HTTPException(status_code=400, detail="Uploaded CSV is empty or has no columns.")
+                        # Generate preview, with missing values as null so it stays valid JSON
+                        head = chunk.head(10).astype(object)
+                        preview = head.where(head.notnull(), None).to_dict(orient="records")
+                    writer.append(chunk)
+                    profiler.update(chunk)
+                    progress["rows_parsed"] += len(chunk)
+                reader.drain()
+        except pd.errors.EmptyDataError:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+        except pd.errors.ParserError:
+            raise HTTPException(status_code=400, detail="Error parsing CSV file. Ensure the file is properly formatted.")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred while reading the file: {str(e)}")
+
+        if writer.row_count == 0:
             raise HTTPException(status_code=400, detail="Uploaded CSV is empty or has no columns.")
-    except pd.errors.EmptyDataError:
-        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
-    except pd.errors.ParserError:
-        raise HTTPException(status_code=400, detail="Error parsing CSV file. Ensure the file is properly formatted.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred while reading the file: {str(e)}")
 
-    # Reset file pointer for database storage
-    file.file.seek(0)
+        blob_id = sink.finish()
+    except BaseException:
+        sink.abort()
+        writer.abort()
+        if upload_id:
+            upload_progress.pop((current_user.id, upload_id), None)
+        raise
+
+    profile = profiler.result()
 
     # Save dataset to the database
     dataset = Dataset(
         user_id=current_user.id,
         name=name,
         description=description,
-        file_data=file.file.read(),
-        columns=json.dumps(df.columns.tolist()),
-        row_count=len(df)
+        blob_id=blob_id,
+        columns=[column["name"] for column in profile["columns"]],
+        row_count=writer.row_count,
+        profile=profile
     )
 
+    stored = None
     try:
-        db.add(dataset)
-        db.commit()
-        db.refresh(dataset)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred while saving the dataset: {str(e)}")
-
-    # Generate preview
-    preview = df.head(10).to_dict(orient="records")
+        # Blob row and file change together, under the lock release_blob takes to delete them
+        with blob_store.locked(blob_id):
+            try:
+                with stage_timer("upload", "store"):
+                    db.add(dataset)
+                    db.flush()
+                    stored = acquire_blob(db, blob_id, sink.size, sink.stored_size)
+                    # An identical upload already has its file, columnar copy and profile; share them
+                    source = None
+                    if stored:
+                        source = db.query(Dataset).filter(Dataset.blob_id == blob_id, Dataset.id != dataset.id).order_by(Dataset.id).first()
+                    if source is not None and link_columnar(source.id, dataset.id):
+                        writer.abort()
+                        dataset.profile = source.profile
+                    else:
+                        writer.close(dataset.id)
+                    if stored:
+                        sink.abort()
+                    else:
+                        sink.commit()
+                    db.commit()
+                    db.refresh(dataset)
+            except Exception as e:
+                db.rollback()
+                writer.abort()
+                sink.abort()
+                if dataset.id is not None:
+                    remove_columnar(dataset.id)
+                if stored is False:
+                    blob_store.delete(blob_id)
+                raise HTTPException(status_code=500, detail=f"An error occurred while saving the dataset: {str(e)}")
+    finally:
+        if upload_id:
+            upload_progress.pop((current_user.id, upload_id), None)
 
     return {
         "message": "Dataset uploaded successfully.",
         "dataset_id": dataset.id,
-        "preview": preview
+        "preview": preview,
+        "deduplicated": stored
     }
 
 
+@app.get("/dataset/upload_progress/{upload_id}")
+def get_upload_progress(upload_id: str, current_user: CurrentUser = Depends(get_current_user)):
+    progress = upload_progress.get((current_user.id, upload_id))
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No upload in progress with this id")
+    return progress
+
+
 @app.post("/clean_dataset/{dataset_id}")
 def clean_dataset(
     dataset_id: int,
     operations: List[dict]= "handle_missing",
-    current_user: User = Depends(get_current_user),
+    materialize: bool = Query(False),  # Store the cleaned result as a new dataset version that /train accepts
+    name: Optional[str] = Query(None),  # Name of the pipeline and of the version it produces
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     dataset = db.query(Dataset).filter_by(id=dataset_id, user_id=current_user.id).first()
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
-    
-    try:
-        df = pd.read_csv(BytesIO(dataset.file_data))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading dataset: {str(e)}")
 
-    for operation in operations:
-        op_type = operation.get('type')
-        
-        if op_type == 'handle_missing':
-            strategy = operation.get('strategy', 'drop')
-            fill_value = operation.get('fill_value', None)
-            df = handle_missing_data(df, strategy, fill_value)
-        
-        elif op_type == 'remove_duplicates':
-            df = remove_duplicates(df)
-        
-        elif op_type == 'convert_type':
-            column = operation.get('column')
-            new_type = operation.get('new_type')
-            if column and new_type:
-                df = convert_column_type(df, column, new_type)
-            else:
-                raise HTTPException(status_code=400, detail="Column or new type missing for conversion")
-        
-        elif op_type == 'remove_outliers':
-            column = operation.get('column')
-            method = operation.get('method', 'zscore')
-            threshold = operation.get('threshold', 3)
-            if column:
-                df = remove_outliers(df, column, method, threshold)
-            else:
-                raise HTTPException(status_code=400, detail="Column missing for outlier removal")
+    try:
+        operations = normalize_operations(operations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    # Identical pipelines reuse the version they already produced
+    version = find_version(db, dataset.id, pipeline_hash(operations))
+    try:
+        if materialize and version is None:
+            version, _ = materialize_version(db, dataset, operations, name)
+        if version is not None:
+            df = read_columns(version.id, ensure_columnar(version), None, 0, 10)
+            row_count, column_count = version.row_count, len(version.columns)
         else:
-            raise HTTPException(status_code=400, detail=f"Unknown operation type: {op_type}")
-
-    preview = df.head(10).to_dict(orient="records")
-    row_count = df.shape[0]
-    column_count = df.shape[1]
+            # Without a stored version, only the leading rows are cleaned for the preview
+            df = preview_operations(dataset, operations, Config.CLEAN_PREVIEW_ROWS)
+            row_count, column_count = df.shape
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error cleaning dataset: {str(e)}")
 
+    head = df.head(10).astype(object)
     return {
         "message": "Dataset cleaned successfully",
-        "preview": preview,
+        "preview": head.where(head.notnull(), None).to_dict(orient="records"),
         "row_count": row_count,
-        "column_count": column_count
+        "column_count": column_count,
+        # row_count only covers the previewed rows until the pipeline is materialized
+        "sampled": version is None,
+        "dataset_id": version.id if version is not None else None,
+        "pipeline_hash": pipeline_hash(operations)
     }
 
 
+@app.get("/datasets/{dataset_id}/versions")
+def list_dataset_versions(
+    dataset_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    dataset = db.query(Dataset.id).filter_by(id=dataset_id, user_id=current_user.id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    versions = db.query(
+        Dataset.id, Dataset.name, Dataset.row_count, Dataset.pipeline, Dataset.pipeline_hash, Dataset.created_at
+    ).filter_by(parent_id=dataset_id, user_id=current_user.id).order_by(Dataset.id).all()
+    return [{
+        'id': version.id,
+        'name': version.name,
+        'row_count': version.row_count,
+        'pipeline': version.pipeline,
+        'pipeline_hash': version.pipeline_hash,
+        'created_at': version.created_at.isoformat()
+    } for version in versions]
+
+
 class TrainModelRequest(BaseModel):
     dataset_id: int
     target_column: str
@@ -261,7 +372,13 @@ class TrainModelRequest(BaseModel):
     description: Optional[str] = None
     drop_columns: Optional[List[str]] = None
 
-@app.post("/train")
+def validate_predictor(ml_model_type, predictor):
+    if predictor not in PREDICTORS:
+        raise HTTPException(status_code=400, detail="Invalid predictor")
+    if predictor == 'compiled' and ml_model_type not in COMPILABLE_TYPES:
+        raise HTTPException(status_code=400, detail="The compiled predictor only supports decision_tree and random_forest models")
+
+@app.post("/train", status_code=202)
 async def train(
     dataset_id: int = Form(...),
     target_column: str = Form(...),
@@ -269,7 +386,15 @@ async def train(
     name: str = Form("Unnamed Model"),
     description: Optional[str] = Form(None),
     drop_columns: Optional[str] = Form(None),  # Accept as comma-separated string
-    current_user: User = Depends(get_current_user),
+    predictor: str = Form("sklearn"),  # 'compiled' serves tree models through compiled_trees
+    evaluation: str = Form("holdout"),  # 'holdout', 'kfold' or 'none'; results land in the model's metrics
+    search: str = Form("none"),  # 'grid' or 'random' hyperparameter search before the final fit
+    search_budget_seconds: int = Form(Config.TRAINING_SEARCH_BUDGET_SECONDS),
+    search_candidates: int = Form(20),  # Candidates sampled by a 'random' search
+    memoize: bool = Form(False),  # Serve repeated inputs from the prediction cache
+    mode: str = Form("memory"),  # 'streaming' fits sgd/naive_bayes chunk by chunk; 'sample' fits on a stratified sample
+    sample_rows: int = Form(Config.TRAINING_SAMPLE_ROWS),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     # Convert drop_columns string to list
@@ -284,102 +409,166 @@ async def train(
         "drop_columns": drop_columns_list
     })
 
+    if ml_model_type not in MODEL_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid model type")
+    validate_predictor(ml_model_type, predictor)
+    if evaluation not in EVALUATIONS:
+        raise HTTPException(status_code=400, detail="Invalid evaluation")
+    if search not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail="Invalid search mode")
+    if search_budget_seconds < 1 or search_candidates < 1:
+        raise HTTPException(status_code=400, detail="Search budget and candidates must be positive")
+    if mode not in TRAINING_MODES:
+        raise HTTPException(status_code=400, detail="Invalid training mode")
+    if mode == 'streaming':
+        if ml_model_type not in STREAMING_MODEL_TYPES:
+            raise HTTPException(status_code=400, detail="Streaming training only supports sgd and naive_bayes models")
+        if search != 'none' or evaluation == 'kfold':
+            raise HTTPException(status_code=400, detail="Streaming training supports neither search nor kfold evaluation")
+    if sample_rows < 1:
+        raise HTTPException(status_code=400, detail="sample_rows must be positive")
+
     # Fetch dataset
-    dataset = db.query(Dataset).filter_by(id=dataset_id, user_id=current_user.id).first()
+    dataset = await run_blocking(
+        lambda: db.query(Dataset.id, Dataset.profile).filter_by(id=dataset_id, user_id=current_user.id).first()
+    )
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    # Read dataset
-    try:
-        df = pd.read_csv(BytesIO(dataset.file_data))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading dataset: {str(e)}")
-
-    # Check target column
-    if target_column not in df.columns:
-        raise HTTPException(status_code=400, detail="Target column not found in dataset")
-
-    # Drop specified columns
-    for col in drop_columns_list:
-        if col in df.columns and col != target_column:
-            df = df.drop(columns=[col])
-        else:
-            raise HTTPException(status_code=400, detail=f"Column '{col}' cannot be dropped")
-
-    # Identify feature columns
-    feature_columns = [col for col in df.columns if col != target_column]
-
-    # Encode categorical variables
-    label_encoders = {}
-    for column in df.select_dtypes(include=['object']).columns:
-        if column != target_column:
-            le = LabelEncoder()
-            df[column] = le.fit_transform(df[column])
-            label_encoders[column] = list(le.classes_)
-
-    # Split dataset
-    X = df[feature_columns]
-    y = df[target_column]
-
-    # Model selection
-    if ml_model_type == 'linear_regression':
-        model = LinearRegression()
-    elif ml_model_type == 'logistic_regression':
-        model = LogisticRegression(random_state=42)
-    elif ml_model_type == 'svm':
-        model = SVC(random_state=42)
-    elif ml_model_type == 'decision_tree':
-        model = DecisionTreeClassifier(random_state=42) if y.dtype == 'object' else DecisionTreeRegressor(random_state=42)
-    elif ml_model_type == 'random_forest':
-        model = RandomForestClassifier(n_estimators=100, random_state=42) if y.dtype == 'object' else RandomForestRegressor(n_estimators=100, random_state=42)
-    else:
-        raise HTTPException(status_code=400, detail="Invalid model type")
-
-    # Train model
-    model.fit(X, y)
-
-    # Serialize model
-    model_binary = pickle.dumps(model)
+    # Reject bad column choices up front, from the stored profile, before a job is queued
+    if dataset.profile is not None:
+        try:
+            validate_against_profile(dataset.profile, target_column, drop_columns_list)
+        except TrainingError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-    # Save model details
-    ml_model = MLModel(
+    job = TrainingJob(
         user_id=current_user.id,
         dataset_id=dataset_id,
-        name=name,
-        description=description,
-        model_type=ml_model_type,
-        feature_columns=feature_columns,
-        target_column=target_column,
-        model_data=model_binary,
-        config_data={"feature_columns": feature_columns, "target_column": target_column, "preprocessing": {"label_encoders": label_encoders}}
+        params={
+            "target_column": target_column,
+            "ml_model_type": ml_model_type,
+            "name": name,
+            "description": description,
+            "drop_columns": drop_columns_list,
+            "predictor": predictor,
+            "evaluation": evaluation,
+            "search": search,
+            "search_budget_seconds": search_budget_seconds,
+            "search_candidates": search_candidates,
+            "mode": mode,
+            "sample_rows": sample_rows,
+            "memoize": memoize
+        }
     )
 
-    db.add(ml_model)
-    db.commit()
-    db.refresh(ml_model)
+    def save_job():
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+
+    await run_blocking(save_job)
+
+    # Fitting happens in the training process pool; clients poll /jobs/{job_id}
+    submit_job(job.id)
 
     return {
-        "message": "Model trained successfully",
-        "model_id": ml_model.id,
+        "message": "Training job queued",
+        "job_id": job.id,
+        "state": job.state,
         "received_data": {
             "dataset_id": dataset_id,
             "target_column": target_column,
             "ml_model_type": ml_model_type,
             "name": name,
             "description": description,
-            "drop_columns": drop_columns_list
+            "drop_columns": drop_columns_list,
+            "predictor": predictor,
+            "evaluation": evaluation,
+            "search": search,
+            "mode": mode
         }
     }
 
 
+@app.post("/models/{model_id}/score/{dataset_id}", status_code=202)
+def score_dataset_with_model(
+    model_id: int,
+    dataset_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    ml_model = db.query(MLModel.id, MLModel.name, MLModel.feature_columns).filter_by(id=model_id, user_id=current_user.id).first()
+    if not ml_model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    dataset = db.query(Dataset.id, Dataset.columns).filter_by(id=dataset_id, user_id=current_user.id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    # Rows written before the JSON column type hold the column list as a JSON string
+    columns = json.loads(dataset.columns) if isinstance(dataset.columns, str) else dataset.columns
+    missing = [col for col in ml_model.feature_columns if col not in (columns or [])]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Dataset is missing feature columns: {', '.join(missing)}")
+
+    job = TrainingJob(
+        user_id=current_user.id,
+        kind='score',
+        model_id=model_id,
+        dataset_id=dataset_id,
+        params={"model_name": ml_model.name}
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    # Scored rows land in a new version of the dataset; clients poll /jobs/{job_id} for progress
+    submit_job(job.id, 'score')
+
+    return {
+        "message": "Scoring job queued",
+        "job_id": job.id,
+        "state": job.state
+    }
+
+
+@app.get("/jobs")
+def list_jobs(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    jobs = db.query(TrainingJob).filter_by(user_id=current_user.id).order_by(TrainingJob.created_at.desc()).all()
+    fail_abandoned_jobs(db, jobs)
+    return [serialize_job(job) for job in jobs]
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    job = db.query(TrainingJob).filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Polling is what notices a job whose worker died after startup
+    fail_abandoned_jobs(db, [job])
+    return serialize_job(job)
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_training_job(job_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    job = db.query(TrainingJob).filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.state not in ('queued', 'running'):
+        raise HTTPException(status_code=409, detail=f"Job is already {job.state}")
+    return serialize_job(cancel_job(db, job))
+
+
 @app.api_route("/predict/{model_id}", methods = ["GET", "POST"])
 async def predict(
     model_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db),
-    feature_values: Optional[str] = Form(None)  # Accepts feature values as a comma-separated string
+    feature_values: Optional[str] = Form(None),  # Accepts feature values as a comma-separated string
+    durable: bool = Query(False)  # Commit the prediction log row before responding
 ):
-    ml_model = db.query(MLModel).filter_by(id = model_id, user_id = current_user.id).first()
+    # The artifact (or a legacy model_data blob) is only loaded if the cache misses
+    with stage_timer("predict", "db_fetch"):
+        ml_model = await run_blocking(
+            lambda: db.query(MLModel).filter_by(id = model_id, user_id = current_user.id).first()
+        )
     if not ml_model:
         raise HTTPException(status_code = 404, detail = "Model not found")
 
@@ -400,9 +589,9 @@ async def predict(
 
     # ✅ Handle POST request: Perform Prediction
     try:
-        model = pickle.loads(ml_model.model_data)  # Load trained model
-        config = ml_model.config_data
-        feature_columns = config['feature_columns']
+        with stage_timer("predict", "model_load"):
+            cached = await run_blocking(model_cache.get, ml_model)  # Load trained model
+        feature_columns = cached.feature_columns
 
         # Convert the input form-data into a dictionary
         feature_values_list = feature_values.split(",")
@@ -414,44 +603,26 @@ async def predict(
         df = pd.DataFrame([input_data])
 
         # Encode categorical variables if necessary
-        for column, unique_values in config.get('preprocessing', {}).get('label_encoders', {}).items():
-            if column in df.columns:
-                df[column] = df[column].map({val: idx for idx, val in enumerate(unique_values)})
-                if df[column].isnull().any():
-                    raise HTTPException(status_code = 400, detail = f"Invalid categorical value in column {column}")
-
-        # Perform prediction
-        predictions = model.predict(df[feature_columns]).tolist()
-
-        # Get confidence score if available
-        confidence_score = None
-        if hasattr(model, 'predict_proba'):
-            # Extract NumPy value and convert to Python float
-            proba_values = model.predict_proba(df[feature_columns])
-            max_proba = proba_values[0].max()
-
-            # Convert NumPy type to native Python float
-            if hasattr(max_proba, 'item'):
-                confidence_score = max_proba.item()
-            else:
-                confidence_score = float(max_proba)
-
-        # Ensure input_data is serializable to JSON
-        json_input_data = json.dumps(input_data)
-
-        # Ensure predictions are serializable to JSON
-        json_predictions = json.dumps(predictions)
-
-        # Store prediction result in the database
-        prediction = Prediction(
-            model_id = model_id,
-            input_data = json_input_data,
-            prediction_result = json_predictions,
-            confidence_score = confidence_score,
-            created_at = datetime.utcnow()
-        )
-        db.add(prediction)
-        db.commit()
+        with stage_timer("predict", "encode"):
+            X, errors = encode_features(df, cached)
+        if errors:
+            raise HTTPException(status_code = 400, detail = errors[0])
+
+        # Perform prediction, unless the model memoizes and has seen this input; the
+        # confidence score comes from the same predict_proba call
+        with stage_timer("predict", "predict"):
+            predictions, confidence_scores = await run_blocking(predict_memoized, cached, X)
+        confidence_score = confidence_scores[0]
+
+        # Log the prediction; input_data and the result are stored as native JSON
+        with stage_timer("predict", "log_write"):
+            await log_predictions(db, [{
+                "model_id": model_id,
+                "input_data": input_data,
+                "prediction_result": predictions,
+                "confidence_score": confidence_score,
+                "created_at": datetime.utcnow()
+            }], durable=durable)
 
         return {
             "predictions": predictions,
@@ -463,9 +634,193 @@ async def predict(
         raise HTTPException(status_code = 500, detail = f"Model loading or prediction error: {str(e)}")
 
 
+async def read_batch_rows(request: Request, feature_columns: List[str]):
+    """Parse a batch prediction body into a DataFrame of raw feature values.
+
+    Accepts a JSON array (or ``{"rows": [...]}``), NDJSON, or CSV, either as the
+    request body or as an uploaded ``file``. Rows may be objects keyed by feature
+    name or arrays in feature order. Returns the frame, the original row number of
+    each frame row, and a dict of errors for rows that could not be parsed.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or not hasattr(upload, "read"):
+            raise HTTPException(status_code=400, detail="Upload the batch as a 'file' form field")
+        body = await upload.read()
+        filename = upload.filename or ""
+        body_format = "ndjson" if filename.endswith((".ndjson", ".jsonl")) else "json" if filename.endswith(".json") else "csv"
+    else:
+        body = await request.body()
+        if "csv" in content_type:
+            body_format = "csv"
+        elif "ndjson" in content_type or "jsonl" in content_type:
+            body_format = "ndjson"
+        else:
+            body_format = "json"
+
+    if body_format == "csv":
+        try:
+            # Keep raw strings so categorical values match the encoder classes
+            df = pd.read_csv(BytesIO(body), dtype=str)
+        except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+            raise HTTPException(status_code=400, detail=f"Error parsing CSV batch: {str(e)}")
+        missing = [col for col in feature_columns if col not in df.columns]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Missing feature columns: {', '.join(missing)}")
+        if len(df) > Config.BATCH_PREDICT_MAX_ROWS:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {Config.BATCH_PREDICT_MAX_ROWS} rows")
+        return df[feature_columns].reset_index(drop=True), list(range(len(df))), {}
+
+    errors = {}
+    if body_format == "ndjson":
+        rows = []
+        for line in body.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                errors[len(rows)] = f"Invalid JSON: {str(e)}"
+                rows.append(None)
+    else:
+        try:
+            rows = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {str(e)}")
+        if isinstance(rows, dict):
+            rows = rows.get("rows")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of rows")
+
+    if len(rows) > Config.BATCH_PREDICT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {Config.BATCH_PREDICT_MAX_ROWS} rows")
+
+    records = []
+    row_numbers = []
+    for row_number, row in enumerate(rows):
+        if row_number in errors:
+            continue
+        if isinstance(row, list):
+            if len(row) != len(feature_columns):
+                errors[row_number] = "Feature count mismatch"
+                continue
+            records.append(dict(zip(feature_columns, row)))
+        elif isinstance(row, dict):
+            missing = [col for col in feature_columns if col not in row]
+            if missing:
+                errors[row_number] = f"Missing feature columns: {', '.join(missing)}"
+                continue
+            records.append({col: row[col] for col in feature_columns})
+        else:
+            errors[row_number] = "Row must be a JSON object or array"
+            continue
+        row_numbers.append(row_number)
+
+    return pd.DataFrame(records, columns=feature_columns), row_numbers, errors
+
+
+@app.post("/predict/{model_id}/batch")
+async def predict_batch(
+    model_id: int,
+    request: Request,
+    durable: bool = Query(False),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    with stage_timer("predict_batch", "db_fetch"):
+        ml_model = await run_blocking(
+            lambda: db.query(MLModel).filter_by(id=model_id, user_id=current_user.id).first()
+        )
+    if not ml_model:
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    try:
+        with stage_timer("predict_batch", "model_load"):
+            cached = await run_blocking(model_cache.get, ml_model)
+    except (pickle.UnpicklingError, KeyError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Model loading error: {str(e)}")
+
+    with stage_timer("predict_batch", "parse"):
+        df, row_numbers, errors = await read_batch_rows(request, cached.feature_columns)
+
+    # Encode every categorical column once for the whole batch
+    with stage_timer("predict_batch", "encode"):
+        X, encode_errors = encode_features(df, cached)
+    for position, message in encode_errors.items():
+        errors[row_numbers[position]] = message
+    valid_positions = [position for position in range(len(df)) if position not in encode_errors]
+
+    results = {row_number: {"row": row_number, "error": message} for row_number, message in errors.items()}
+    if valid_positions:
+        try:
+            with stage_timer("predict_batch", "predict"):
+                predictions, confidence_scores = await run_blocking(predict_memoized, cached, X.iloc[valid_positions])
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+        created_at = datetime.utcnow()
+        prediction_rows = []
+        input_records = df.iloc[valid_positions].to_dict(orient="records")
+        for position, input_data, prediction, confidence_score in zip(valid_positions, input_records, predictions, confidence_scores):
+            row_number = row_numbers[position]
+            results[row_number] = {"row": row_number, "prediction": prediction, "confidence_score": confidence_score}
+            prediction_rows.append({
+                "model_id": model_id,
+                "input_data": input_data,
+                "prediction_result": [prediction],
+                "confidence_score": confidence_score,
+                "created_at": created_at
+            })
+
+        # Logged as one multi-row INSERT, through the write-behind buffer unless durable
+        with stage_timer("predict_batch", "log_write"):
+            await log_predictions(db, prediction_rows, durable=durable)
+
+    return {
+        "results": [results[row_number] for row_number in sorted(results)],
+        "succeeded": len(valid_positions),
+        "failed": len(errors)
+    }
+
+
+@app.get("/model_cache/stats")
+def get_model_cache_stats(current_user: CurrentUser = Depends(get_current_user)):
+    return model_cache.stats()
+
+@app.get("/prediction_cache/stats")
+def get_prediction_cache_stats(current_user: CurrentUser = Depends(get_current_user)):
+    return prediction_cache.stats()
+
+@app.get("/prediction_log/stats")
+def get_prediction_log_stats(current_user: CurrentUser = Depends(get_current_user)):
+    return prediction_writer.stats()
+
+@app.get("/metrics")
+def get_metrics():
+    # Unauthenticated like any Prometheus target; only aggregate, per-route figures are exposed
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+@app.get("/executors/stats")
+def get_executor_stats(current_user: CurrentUser = Depends(get_current_user)):
+    return pool_stats()
+
 @app.get("/models")
-def list_models(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    models = db.query(MLModel).filter_by(user_id=current_user.id).all()
+async def list_models(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    query = select(
+        MLModel.id, MLModel.name, MLModel.description, MLModel.model_type,
+        MLModel.feature_columns, MLModel.target_column, MLModel.metrics, MLModel.created_at, MLModel.dataset_id
+    ).filter_by(user_id=current_user.id)
+    total = await db.scalar(select(func.count()).select_from(query.subquery()))
+    response.headers["X-Total-Count"] = str(total)
+    models = (await db.execute(query.order_by(MLModel.id).offset(skip).limit(limit))).all()
     return [{
         'id': model.id,
         'name': model.name,
@@ -473,71 +828,122 @@ def list_models(current_user: User = Depends(get_current_user), db: Session = De
         'model_type': model.model_type,
         'feature_columns': model.feature_columns,
         'target_column': model.target_column,
+        'metrics': model.metrics,
         'created_at': model.created_at.isoformat(),
         'dataset_id': model.dataset_id
     } for model in models]
 
 @app.get("/datasets")
-def list_datasets(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    datasets = db.query(Dataset).filter_by(user_id=current_user.id).all()
+async def list_datasets(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    query = select(
+        Dataset.id, Dataset.name, Dataset.description, Dataset.columns, Dataset.row_count, Dataset.parent_id, Dataset.created_at
+    ).filter_by(user_id=current_user.id)
+    total = await db.scalar(select(func.count()).select_from(query.subquery()))
+    response.headers["X-Total-Count"] = str(total)
+    datasets = (await db.execute(query.order_by(Dataset.id).offset(skip).limit(limit))).all()
     return [{
         'id': dataset.id,
         'name': dataset.name,
         'description': dataset.description,
-        'columns': json.loads(dataset.columns),
+        # Rows uploaded before columns was stored natively hold a JSON-encoded string
+        'columns': json.loads(dataset.columns) if isinstance(dataset.columns, str) else dataset.columns,
         'row_count': dataset.row_count,
+        'parent_id': dataset.parent_id,
         'created_at': dataset.created_at.isoformat()
     } for dataset in datasets]
 
+# Prediction counts per (model_id, start, end), reused across pages instead of a COUNT(*) per request
+prediction_counts = TTLCache(maxsize=Config.PREDICTION_COUNT_CACHE_SIZE, ttl=Config.PREDICTION_COUNT_TTL_SECONDS)
+
+def parse_prediction_cursor(after: str):
+    try:
+        created_at, prediction_id = after.rsplit(",", 1)
+        return datetime.fromisoformat(created_at), int(prediction_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor; expected '<created_at>,<id>'")
+
 @app.get("/predictions/{model_id}")
-def get_predictions(
+async def get_predictions(
     model_id: int,
-    page: int = 1,
-    per_page: int = 10,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    page: int = Query(1, ge=1),
+    per_page: int = Query(10, ge=1, le=1000),
+    after: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    model = db.query(MLModel).filter_by(id=model_id, user_id=current_user.id).first()
+    model = (await db.execute(select(MLModel.id).filter_by(id=model_id, user_id=current_user.id))).first()
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
 
-    total = db.query(Prediction).filter_by(model_id=model_id).count()
-    predictions = db.query(Prediction).filter_by(model_id=model_id) \
-        .order_by(Prediction.created_at.desc()) \
-        .offset((page - 1) * per_page) \
-        .limit(per_page) \
-        .all()
+    # Every filter here is served by the (model_id, created_at, id) index
+    query = select(Prediction).where(Prediction.model_id == model_id)
+    if start is not None:
+        query = query.where(Prediction.created_at >= start)
+    if end is not None:
+        query = query.where(Prediction.created_at < end)
+
+    count_key = (model_id, start, end)
+    total = prediction_counts.get(count_key)
+    if total is None:
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
+        prediction_counts.set(count_key, total)
+
+    query = query.order_by(Prediction.created_at.desc(), Prediction.id.desc())
+    if after is not None:
+        # Keyset mode: seek past the cursor instead of scanning OFFSET rows
+        query = query.where(tuple_(Prediction.created_at, Prediction.id) < parse_prediction_cursor(after))
+    else:
+        query = query.offset((page - 1) * per_page)
+    predictions = (await db.scalars(query.limit(per_page))).all()
 
-    return {
+    next_cursor = None
+    if len(predictions) == per_page:
+        last = predictions[-1]
+        next_cursor = f"{last.created_at.isoformat()},{last.id}"
+
+    result = {
         'predictions': [{
             'id': pred.id,
-            'input_data': pred.input_data,
-            'prediction_result': pred.prediction_result,
+            # Rows logged before native JSON storage hold JSON-encoded strings
+            'input_data': json.loads(pred.input_data) if isinstance(pred.input_data, str) else pred.input_data,
+            'prediction_result': json.loads(pred.prediction_result) if isinstance(pred.prediction_result, str) else pred.prediction_result,
             'confidence_score': pred.confidence_score,
             'created_at': pred.created_at.isoformat()
         } for pred in predictions],
         'total': total,
         'pages': (total + per_page - 1) // per_page,
-        'current_page': page
+        'next_cursor': next_cursor
     }
+    if after is None:
+        result['current_page'] = page
+    return result
 
 @app.get("/visualize_dataset/{dataset_id}")
 def visualize_dataset(
     dataset_id: int, 
+    refresh: bool = False,
     db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     dataset = db.query(Dataset).filter_by(id=dataset_id, user_id=current_user.id).first()
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
     
-    df = pd.read_csv(BytesIO(dataset.file_data))
-    summary = {
-        "shape": df.shape,
-        "columns": df.columns.tolist(),
-        "missing_values": df.isnull().sum().to_dict(),
-        "dtypes": df.dtypes.astype(str).to_dict()
-    }
+    if dataset.profile is None or refresh:
+        meta = ensure_columnar(dataset)
+        dataset.profile = profile_chunks(iter_chunks(dataset.id, meta, Config.PROFILE_CHUNK_ROWS))
+        db.commit()
+
+    summary = profile_summary(dataset.profile)
+    summary["profile"] = dataset.profile
     return summary
 
 @app.put("/update_dataset/{dataset_id}")
@@ -546,7 +952,7 @@ def update_dataset(
     name: str = Form(...),
     description: str = Form(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     dataset = db.query(Dataset).filter_by(id=dataset_id, user_id=current_user.id).first()
     if not dataset:
@@ -561,31 +967,45 @@ def update_dataset(
 def export_model(
     model_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     model = db.query(MLModel).filter_by(id=model_id, user_id=current_user.id).first()
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
-    
-    model_file_path = model.model_data
-    if not os.path.exists(model_file_path):
-        raise HTTPException(status_code=404, detail="Model file does not exist")
 
-    return FileResponse(path=model_file_path, filename=os.path.basename(model_file_path), media_type='application/octet-stream')
+    if model.artifact_key:
+        if not artifact_store.exists(model.artifact_key):
+            raise HTTPException(status_code=404, detail="Model file does not exist")
+        # Streamed from disk in blocks rather than read into memory
+        return FileResponse(
+            path=artifact_store.path(model.artifact_key),
+            filename=f"model_{model.id}.joblib",
+            media_type='application/octet-stream'
+        )
+
+    # Models trained before the artifact store only have their pickle in the row
+    if not model.model_data:
+        raise HTTPException(status_code=404, detail="Model file does not exist")
+    return Response(
+        content=model.model_data,
+        media_type='application/octet-stream',
+        headers={"Content-Disposition": f'attachment; filename="model_{model.id}.pkl"'}
+    )
 
 @app.get("/profile")
-def get_profile(current_user: User = Depends(get_current_user)):
+async def get_profile(current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(User.username, User.email, User.created_at).filter_by(id=current_user.id))).one()
     return {
-        "username": current_user.username,
-        "email": current_user.email,
-        "created_at": current_user.created_at
+        "username": user.username,
+        "email": user.email,
+        "created_at": user.created_at
     }
 
 @app.delete("/delete_dataset/{dataset_id}")
 def delete_dataset(
     dataset_id: int, 
     db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     dataset = db.query(Dataset).filter_by(id=dataset_id, user_id=current_user.id).first()
     if not dataset:
@@ -600,7 +1020,7 @@ def attach_dataset_to_model(
     model_id: int, 
     dataset_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     model = db.query(MLModel).filter_by(id=model_id, user_id=current_user.id).first()
     dataset = db.query(Dataset).filter_by(id=dataset_id, user_id=current_user.id).first()
@@ -611,34 +1031,130 @@ def attach_dataset_to_model(
     db.commit()
     return {"message": "Dataset attached to model successfully"}
 
+@app.put("/models/{model_id}/predictor")
+def set_model_predictor(
+    model_id: int,
+    predictor: str = Form(...),
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    model = db.query(MLModel).filter_by(id=model_id, user_id=current_user.id).first()
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    validate_predictor(model.model_type, predictor)
+    if predictor == 'compiled' and model.config_data.get('predictor') != 'compiled':
+        try:
+            verify_compiled_predictor(model, model.dataset)
+        except TrainingError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    # Reassigned rather than mutated so the JSON change is flushed; the new
+    # updated_at also retires the cached copy built for the old predictor
+    model.config_data = {**model.config_data, "predictor": predictor}
+    db.commit()
+    return {"message": "Model predictor updated", "predictor": predictor}
+
+@app.put("/models/{model_id}/memoize")
+def set_model_memoize(
+    model_id: int,
+    enabled: bool = Form(...),
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    model = db.query(MLModel).filter_by(id=model_id, user_id=current_user.id).first()
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    # As with the predictor, the new updated_at retires cached models and memoized results
+    model.config_data = {**model.config_data, "memoize": enabled}
+    db.commit()
+    return {"message": "Model memoization updated", "memoize": enabled}
+
+@app.get("/models/{model_id}/prediction_cache")
+def get_model_prediction_cache_stats(
+    model_id: int,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    model = db.query(MLModel.id, MLModel.config_data).filter_by(id=model_id, user_id=current_user.id).first()
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return {"memoize": model.config_data.get("memoize", False), **prediction_cache.model_stats(model_id)}
+
 @app.get("/dataset_stats")
-def get_dataset_stats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    datasets = db.query(Dataset).filter_by(user_id=current_user.id).all()
+def get_dataset_stats(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    total_datasets, total_rows = db.query(
+        func.count(Dataset.id), func.coalesce(func.sum(Dataset.row_count), 0)
+    ).filter_by(user_id=current_user.id).one()
     stats = {
-        "total_datasets": len(datasets),
-        "total_rows": sum([dataset.row_count for dataset in datasets])
+        "total_datasets": total_datasets,
+        "total_rows": total_rows
     }
     return stats
 
 @app.get("/download_dataset/{dataset_id}")
 def download_dataset(
-    dataset_id: int, 
-    db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    dataset_id: int,
+    request: Request,
+    format: str = Query("csv"),  # 'parquet' exports the columnar copy
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     dataset = db.query(Dataset).filter_by(id=dataset_id, user_id=current_user.id).first()
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
+    if format not in DOWNLOAD_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid download format")
 
-    df = pd.read_csv(BytesIO(dataset.file_data))
-    return {
-        "csv_data": df.to_csv(index=False)
+    headers = {
+        "Content-Disposition": f'attachment; filename="dataset_{dataset.id}.{format}"',
+        "Accept-Ranges": "bytes"
     }
+    range_header = request.headers.get("range")
+    encoding = None
+    # Parquet pages are compressed already, and a range is always served unencoded
+    if format == 'csv':
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        headers["Vary"] = "Accept-Encoding"
+
+    try:
+        # Blobs are stored zstd-compressed, so zstd clients get the stored bytes as they are
+        stored = open_stored_encoded(dataset, format, encoding) if not range_header else None
+        f, size = stored if stored is not None else open_download(dataset, format)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading dataset: {str(e)}")
+    if stored is not None:
+        headers["Content-Encoding"] = encoding
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file(f, 0, size, Config.DOWNLOAD_CHUNK_BYTES), media_type=MEDIA_TYPES[format], headers=headers)
+
+    # Bytes go out as read, a chunk at a time
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        f.close()
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    if byte_range is not None:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_file(f, start, end - start + 1, Config.DOWNLOAD_CHUNK_BYTES),
+            status_code=206, media_type=MEDIA_TYPES[format], headers=headers
+        )
+
+    chunks = iter_file(f, 0, size, Config.DOWNLOAD_CHUNK_BYTES)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+        return StreamingResponse(iter_encoded(chunks, encoding), media_type=MEDIA_TYPES[format], headers=headers)
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[format], headers=headers)
 
 @app.delete("/delete_account")
-def delete_account(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db.delete(current_user)
+def delete_account(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    db.delete(db.get(User, current_user.id))
     db.commit()
+    invalidate_user(current_user.username)
     return {"message": "Account deleted successfully"}
 
 
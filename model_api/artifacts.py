@@ -0,0 +1,124 @@
+import fcntl
+import hashlib
+import os
+import pickle
+import uuid
+from contextlib import contextmanager
+
+import joblib
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from config import Config
+from database import SessionLocal, MLModel, on_commit
+
+HASH_BLOCK_SIZE = 1024 * 1024
+# Lock files shared by artifacts whose keys start with the same two hex digits
+LOCK_DIR = ".locks"
+
+
+class LocalArtifactStore:
+    """Model artifacts as joblib files on local disk, named by the SHA-256 of their contents."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.joblib")
+
+    def save(self, obj):
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = os.path.join(self.root, f".{uuid.uuid4().hex}.part")
+        try:
+            joblib.dump(obj, temp_path)
+            digest = hashlib.sha256()
+            with open(temp_path, "rb") as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                    digest.update(block)
+            key = digest.hexdigest()
+            # Identical artifacts share one file
+            os.replace(temp_path, self.path(key))
+            return key
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @contextmanager
+    def locked(self, key):
+        """Exclusive lock, across processes, on deciding whether an artifact file stays."""
+        lock_dir = os.path.join(self.root, LOCK_DIR)
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"{key[:2]}.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self, key):
+        # NumPy arrays inside the model are memory-mapped read-only, so every
+        # worker process maps the same page-cached file instead of copying it
+        return joblib.load(self.path(key), mmap_mode="r")
+
+    def open(self, key):
+        return open(self.path(key), "rb")
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+ARTIFACT_STORES = {
+    'local': lambda: LocalArtifactStore(Config.MODEL_ARTIFACT_DIR)
+}
+
+artifact_store = ARTIFACT_STORES[Config.MODEL_ARTIFACT_STORE]()
+
+
+def load_model(ml_model):
+    """Return (estimator, artifact size in bytes) for an MLModel row."""
+    if ml_model.artifact_key:
+        return artifact_store.load(ml_model.artifact_key), artifact_store.size(ml_model.artifact_key)
+    # Models trained before the artifact store keep a pickle in the row
+    model_data = ml_model.model_data
+    return pickle.loads(model_data), len(model_data)
+
+
+def release_artifact(key):
+    """Delete an artifact file once no model row refers to it any more."""
+    with artifact_store.locked(key):
+        db = SessionLocal()
+        try:
+            in_use = db.query(MLModel.id).filter(MLModel.artifact_key == key).first()
+        finally:
+            db.close()
+        if in_use is None:
+            artifact_store.delete(key)
+
+
+def keep_artifact(key, obj):
+    """Make sure the artifact of a just-committed model row still exists.
+
+    An identical artifact released between saving ``obj`` and committing the row
+    found no row referring to it and deleted the file, so it is saved again.
+    Under the lock release_artifact checks in, any later release sees the row.
+    """
+    with artifact_store.locked(key):
+        if not artifact_store.exists(key):
+            artifact_store.save(obj)
+
+
+# Deleted models, directly or through the user cascade, release their artifact
+@event.listens_for(MLModel, "after_delete")
+def _release_deleted_artifact(mapper, connection, target):
+    if target.artifact_key:
+        on_commit(object_session(target), lambda key=target.artifact_key: release_artifact(key))
@@ -0,0 +1,58 @@
+import time
+from typing import NamedTuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+
+from caching import TTLCache
+from config import Config
+from database import User, on_commit
+
+
+class CurrentUser(NamedTuple):
+    """What authenticated endpoints need of the caller; load the User row for anything else."""
+    id: int
+    username: str
+    is_active: bool
+
+
+# Keyed by (token subject, token exp) so a re-issued token never sees another token's entry
+user_cache = TTLCache(maxsize=Config.AUTH_USER_CACHE_SIZE, ttl=Config.AUTH_USER_CACHE_TTL_SECONDS)
+
+
+async def lookup_user(db, username, exp=None):
+    """Snapshot of the active user ``username``, from the cache or else the (async) database; None if there is none."""
+    key = (username, exp)
+    user = user_cache.get(key)
+    if user is not None:
+        return user
+
+    row = (await db.execute(
+        select(User.id, User.username, User.is_active).where(
+            User.username == username,
+            User.is_active.is_(True)
+        )
+    )).first()
+    if row is None:
+        return None
+
+    user = CurrentUser(row.id, row.username, row.is_active)
+    ttl = Config.AUTH_USER_CACHE_TTL_SECONDS
+    if exp is not None:
+        # Never outlive the token itself
+        ttl = min(ttl, exp - time.time())
+    if ttl > 0:
+        user_cache.set(key, user, ttl=ttl)
+    return user
+
+
+def invalidate_user(username):
+    user_cache.discard_where(lambda key: key[0] == username)
+
+
+# Updated (e.g. deactivated) or deleted users drop out of the cache after the commit,
+# so a concurrent miss cannot re-cache the old row
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    on_commit(object_session(target), lambda username=target.username: invalidate_user(username))
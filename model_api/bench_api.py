@@ -0,0 +1,281 @@
+"""Throughput and latency percentiles of the API's hot paths, against a throwaway database.
+
+Boots the app in-process on a temporary SQLite database (or --database-url, e.g. an
+ephemeral Postgres), uploads synthetic datasets and times upload, training per model
+type, single and batch predict, prediction-history paging, visualize and download, plus
+the cold start of a fresh interpreter importing the app.
+
+Usage: python bench_api.py [--rows 5000] [--columns 8] [--cardinality 20] [--output results.json]
+                           [--baseline baseline.json] [--threshold 0.2]
+
+Results are written as JSON; with --baseline, any operation whose p50/p95 latency grew
+or whose throughput fell by more than --threshold is reported and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+LATENCY_METRICS = ('p50_ms', 'p95_ms')
+POLL_SECONDS = 0.05
+
+
+def synthetic_csv(rows, columns, cardinality, seed):
+    """A CSV with numeric and categorical features, a categorical 'label' and a numeric 'value' target."""
+    rng = np.random.default_rng(seed)
+    n_categorical = columns // 2
+    n_numeric = max(1, columns - n_categorical)
+    data = {f"num_{i}": rng.normal(size=rows).round(4) for i in range(n_numeric)}
+    categories = np.array([f"c{j}" for j in range(cardinality)])
+    codes = [rng.integers(0, cardinality, rows) for _ in range(n_categorical)]
+    for i, column_codes in enumerate(codes):
+        data[f"cat_{i}"] = categories.take(column_codes)
+    signal = data["num_0"] + (codes[0] % 2 if codes else 0)
+    data["value"] = (signal * 3 + rng.normal(size=rows)).round(4)
+    data["label"] = np.where(signal > 0.5, "pos", "neg")
+    return pd.DataFrame(data).to_csv(index=False)
+
+
+def summarize(latencies, elapsed):
+    milliseconds = np.array(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "throughput_per_s": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "mean_ms": round(float(milliseconds.mean()), 3),
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 3),
+        "p95_ms": round(float(np.percentile(milliseconds, 95)), 3),
+        "p99_ms": round(float(np.percentile(milliseconds, 99)), 3)
+    }
+
+
+def measure(operation, iterations):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url.path} -> {response.status_code}: {response.text[:300]}")
+    return response
+
+
+def wait_for_job(client, headers, job_id, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = check(client.get(f"/jobs/{job_id}", headers=headers)).json()
+        if job["state"] in ("succeeded", "failed", "cancelled"):
+            if job["state"] != "succeeded":
+                raise RuntimeError(f"Job {job_id} {job['state']}: {job['error']}")
+            return job
+        time.sleep(POLL_SECONDS)
+    raise RuntimeError(f"Job {job_id} did not finish within {timeout}s")
+
+
+def measure_cold_start(iterations):
+    """Wall time of a fresh interpreter importing the app, as a worker does on (re)start."""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    stats = measure(
+        lambda i: subprocess.run([sys.executable, "-c", "import app"], cwd=app_dir, check=True, capture_output=True),
+        iterations
+    )
+    # ru_maxrss is in kilobytes on Linux: the largest of the children
+    stats["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    return stats
+
+
+def run_benchmarks(client, args, model_types, prediction_writer):
+    results = {}
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    check(client.post("/register", data={"username": username, "password": "bench"}))
+    token = check(client.post("/token", data={"username": username, "password": "bench"})).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Distinct contents per upload, so none is answered by deduplication; generated up front
+    uploads = [synthetic_csv(args.rows, args.columns, args.cardinality, seed) for seed in range(args.upload_iterations)]
+    dataset_ids = []
+
+    def upload(i):
+        response = check(client.post(
+            "/dataset", files={"file": (f"bench-{i}.csv", uploads[i], "text/csv")}, data={"name": f"bench-{i}"}, headers=headers
+        ))
+        dataset_ids.append(response.json()["dataset_id"])
+
+    results["upload"] = measure(upload, args.upload_iterations)
+    dataset_id = dataset_ids[0]
+    frame = pd.read_csv(StringIO(uploads[0]))
+
+    model_ids = {}
+    for model_type in model_types:
+        target, dropped = ("value", "label") if model_type == "linear_regression" else ("label", "value")
+
+        def train(i):
+            response = check(client.post("/train", data={
+                "dataset_id": dataset_id, "target_column": target, "drop_columns": dropped,
+                "ml_model_type": model_type, "name": f"bench-{model_type}-{i}"
+            }, headers=headers))
+            model_ids[model_type] = wait_for_job(client, headers, response.json()["job_id"], args.job_timeout)["model_id"]
+
+        results[f"train_{model_type}"] = measure(train, args.train_iterations)
+
+    model_type = "random_forest" if "random_forest" in model_ids else next(iter(model_ids))
+    model_id = model_ids[model_type]
+    features = frame.drop(columns=["value", "label"])
+    rows = features.astype(str).agg(",".join, axis=1).tolist()
+
+    def predict(i):
+        check(client.post(f"/predict/{model_id}", data={"feature_values": rows[i % len(rows)]}, headers=headers))
+
+    results["predict"] = measure(predict, args.predict_iterations)
+
+    records = features.to_numpy().tolist()
+
+    def predict_batch(i):
+        start = (i * args.batch_size) % max(1, len(records) - args.batch_size)
+        check(client.post(f"/predict/{model_id}/batch", json=records[start:start + args.batch_size], headers=headers))
+
+    results["predict_batch"] = measure(predict_batch, args.batch_iterations)
+    results["predict_batch"]["rows_per_s"] = round(results["predict_batch"]["throughput_per_s"] * args.batch_size, 3)
+
+    # Logged predictions go through the write-behind buffer; page only once they are stored
+    prediction_writer.flush(args.job_timeout)
+    cursor = {"after": None}
+
+    def page_history(i):
+        params = {"per_page": args.page_size}
+        if cursor["after"]:
+            params["after"] = cursor["after"]
+        cursor["after"] = check(client.get(f"/predictions/{model_id}", params=params, headers=headers)).json()["next_cursor"]
+
+    results["prediction_history"] = measure(page_history, args.page_iterations)
+
+    results["visualize"] = measure(
+        lambda i: check(client.get(f"/visualize_dataset/{dataset_id}", headers=headers)), args.read_iterations
+    )
+    results["visualize_refresh"] = measure(
+        lambda i: check(client.get(f"/visualize_dataset/{dataset_id}", params={"refresh": "true"}, headers=headers)),
+        args.read_iterations
+    )
+    for download_format in ("csv", "parquet"):
+        results[f"download_{download_format}"] = measure(
+            lambda i: check(client.get(
+                f"/download_dataset/{dataset_id}", params={"format": download_format},
+                headers={**headers, "Accept-Encoding": "identity"}
+            )),
+            args.read_iterations
+        )
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Human-readable regressions of ``results`` against a previous run's JSON."""
+    regressions = []
+    for operation, current in results.items():
+        previous = baseline.get("results", {}).get(operation)
+        if previous is None:
+            continue
+        for metric in LATENCY_METRICS:
+            if previous[metric] and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f"{operation}: {metric} {previous[metric]:.3f} -> {current[metric]:.3f}")
+        if previous["throughput_per_s"] and current["throughput_per_s"] < previous["throughput_per_s"] * (1 - threshold):
+            regressions.append(f"{operation}: throughput_per_s {previous['throughput_per_s']:.3f} -> {current['throughput_per_s']:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--columns', type=int, default=8, help="feature columns, half of them categorical")
+    parser.add_argument('--cardinality', type=int, default=20, help="distinct values per categorical column")
+    parser.add_argument('--model-types', default=None, help="comma-separated; all supported types by default")
+    parser.add_argument('--upload-iterations', type=int, default=5)
+    parser.add_argument('--train-iterations', type=int, default=1)
+    parser.add_argument('--predict-iterations', type=int, default=200)
+    parser.add_argument('--batch-iterations', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--page-iterations', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--read-iterations', type=int, default=20)
+    parser.add_argument('--cold-start-iterations', type=int, default=3)
+    parser.add_argument('--job-timeout', type=float, default=600)
+    parser.add_argument('--database-url', default=None, help="defaults to a temporary SQLite database")
+    parser.add_argument('--output', default=None, help="write the JSON results here instead of stdout")
+    parser.add_argument('--baseline', default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed relative slowdown before a regression is reported")
+    args = parser.parse_args()
+
+    # Config is read at import time, so the throwaway locations must be set before the app loads
+    workdir = tempfile.mkdtemp(prefix="bench_api-")
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.pop('ASYNC_DATABASE_URL', None)
+    os.environ.setdefault('JWT_SECRET_KEY', uuid.uuid4().hex)
+    os.environ.setdefault('ALGORITHM', 'HS256')
+    for name, directory in (
+        ('MODEL_ARTIFACT_DIR', 'models'), ('COLUMNAR_STORE_DIR', 'columnar'),
+        ('DATASET_STORAGE_DIR', 'datasets'), ('SHARED_MODEL_DIR', 'shared_models')
+    ):
+        os.environ[name] = os.path.join(workdir, directory)
+        os.makedirs(os.environ[name])
+    try:
+        from fastapi.testclient import TestClient
+
+        import database
+        from model_types import MODEL_TYPES
+        database.init_db()
+        cold_start = measure_cold_start(args.cold_start_iterations)
+        import app
+
+        model_types = args.model_types.split(",") if args.model_types else list(MODEL_TYPES)
+        with TestClient(app.app) as client:
+            results = {"cold_start": cold_start, **run_benchmarks(client, args, model_types, app.prediction_writer)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "database": "postgresql" if args.database_url and args.database_url.startswith("postgres") else "sqlite"
+        },
+        "parameters": {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'database_url')},
+        "results": results
+    }
+
+    print(f"{'operation':<28}{'count':>7}{'ops/s':>11}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}", file=sys.stderr)
+    for operation, stats in results.items():
+        print(f"{operation:<28}{stats['count']:>7}{stats['throughput_per_s']:>11.2f}{stats['p50_ms']:>11.2f}"
+              f"{stats['p95_ms']:>11.2f}{stats['p99_ms']:>11.2f}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
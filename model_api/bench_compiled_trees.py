@@ -0,0 +1,63 @@
+"""Latency of the compiled tree predictor against sklearn, per model type and batch size.
+
+Usage: python bench_compiled_trees.py [--rows 5000] [--features 10] [--trees 100] [--repeat 200]
+"""
+import argparse
+import time
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
+
+from compiled_trees import compile_trees, verify_compiled
+
+BATCH_SIZES = (1, 16, 128, 1024)
+
+
+def median_seconds(fn, X, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(X)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--features', type=int, default=10)
+    parser.add_argument('--trees', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(args.rows, args.features))
+    y_class = np.array(['a', 'b', 'c']).take((X[:, 0] + X[:, 1] > 0) + (X[:, 2] > 1))
+    y_value = X[:, 0] * 3 + rng.normal(size=args.rows)
+    X_test = rng.normal(size=(max(BATCH_SIZES), args.features))
+
+    models = [
+        (DecisionTreeClassifier(random_state=42), y_class),
+        (DecisionTreeRegressor(random_state=42), y_value),
+        (RandomForestClassifier(n_estimators=args.trees, random_state=42), y_class),
+        (RandomForestRegressor(n_estimators=args.trees, random_state=42), y_value),
+    ]
+    print(f"{'model':<24}{'rows':>6}{'sklearn ms':>12}{'compiled ms':>13}{'speedup':>9}  identical")
+    for model, y in models:
+        model.fit(X, y)
+        compiled = compile_trees(model)
+        # Classifiers are served through predict_proba, regressors through predict
+        method = 'predict_proba' if hasattr(compiled, 'predict_proba') else 'predict'
+        for batch_size in BATCH_SIZES:
+            batch = X_test[:batch_size]
+            repeat = max(5, args.repeat // batch_size)
+            sklearn_seconds = median_seconds(getattr(model, method), batch, repeat)
+            compiled_seconds = median_seconds(getattr(compiled, method), batch, repeat)
+            print(f"{type(model).__name__:<24}{batch_size:>6}{sklearn_seconds * 1000:>12.3f}"
+                  f"{compiled_seconds * 1000:>13.3f}{sklearn_seconds / compiled_seconds:>8.1f}x"
+                  f"  {verify_compiled(model, compiled, batch)}")
+
+
+if __name__ == "__main__":
+    main()
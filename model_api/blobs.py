@@ -0,0 +1,54 @@
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+
+from database import SessionLocal, Dataset, DatasetBlob, on_commit
+from storage import blob_store
+
+
+def acquire_blob(db, blob_id, size, stored_size):
+    """Count one more dataset referring to a blob, adding its row on first use.
+
+    Returns whether the blob was already stored. Callers hold
+    ``blob_store.locked(blob_id)`` until the blob's file is in place and the
+    row committed.
+    """
+    while True:
+        updated = db.query(DatasetBlob).filter_by(id=blob_id) \
+            .update({DatasetBlob.ref_count: DatasetBlob.ref_count + 1}, synchronize_session=False)
+        if updated:
+            return True
+        try:
+            with db.begin_nested():
+                db.add(DatasetBlob(id=blob_id, size=size, stored_size=stored_size, ref_count=1))
+            return False
+        except IntegrityError:
+            # Another process added the row first; count this reference on it instead
+            continue
+
+
+def release_blob(blob_id):
+    """Delete a blob once no dataset refers to it any more."""
+    # The file goes in the same lock as the row, so an identical upload either
+    # finds the row first or stores its file after this one is deleted
+    with blob_store.locked(blob_id):
+        db = SessionLocal()
+        try:
+            deleted = db.query(DatasetBlob).filter_by(id=blob_id, ref_count=0).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        if deleted:
+            blob_store.delete(blob_id)
+
+
+# The reference goes away in the same transaction that deletes the dataset,
+# whether directly, through the user cascade or through a parent dataset
+@event.listens_for(Dataset, "after_delete")
+def _dereference_blob(mapper, connection, target):
+    if target.blob_id:
+        connection.execute(
+            update(DatasetBlob).where(DatasetBlob.id == target.blob_id)
+            .values(ref_count=DatasetBlob.ref_count - 1)
+        )
+        on_commit(object_session(target), lambda blob_id=target.blob_id: release_blob(blob_id))
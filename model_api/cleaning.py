@@ -0,0 +1,188 @@
+import hashlib
+import json
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+
+from columnar import ensure_columnar, read_columns, remove_columnar, write_frame
+from database import Dataset
+from profiling import profile_chunks
+
+
+def normalize_operations(operations):
+    """Validate cleaning operations and fill in their defaults, so equal pipelines compare equal.
+
+    Raises ValueError for an operation that cannot run.
+    """
+    normalized = []
+    for operation in operations:
+        op_type = operation.get('type')
+
+        if op_type == 'handle_missing':
+            normalized.append({
+                'type': op_type,
+                'strategy': operation.get('strategy', 'drop'),
+                'fill_value': operation.get('fill_value', None)
+            })
+
+        elif op_type == 'remove_duplicates':
+            normalized.append({'type': op_type})
+
+        elif op_type == 'convert_type':
+            column = operation.get('column')
+            new_type = operation.get('new_type')
+            if not column or not new_type:
+                raise ValueError("Column or new type missing for conversion")
+            normalized.append({'type': op_type, 'column': column, 'new_type': new_type})
+
+        elif op_type == 'remove_outliers':
+            column = operation.get('column')
+            if not column:
+                raise ValueError("Column missing for outlier removal")
+            method = operation.get('method', 'zscore')
+            normalized_op = {'type': op_type, 'column': column, 'method': method}
+            # The IQR fences are always 1.5 IQR, so only z-scores take a threshold
+            if method == 'zscore':
+                normalized_op['threshold'] = float(operation.get('threshold', 3))
+            normalized.append(normalized_op)
+
+        else:
+            raise ValueError(f"Unknown operation type: {op_type}")
+    return normalized
+
+
+def pipeline_hash(operations):
+    return hashlib.sha256(json.dumps(operations, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _require_column(df, column):
+    if column not in df.columns:
+        raise ValueError(f"Column '{column}' not found in dataset")
+
+
+def outlier_mask(df, keep, operations):
+    """Rows of ``df`` that pass every remove_outliers operation, with statistics taken over the rows in ``keep``.
+
+    The statistics of all the operations' columns come from one aggregation over
+    the kept rows rather than one per operation.
+    """
+    columns = list(dict.fromkeys(operation['column'] for operation in operations))
+    for column in columns:
+        _require_column(df, column)
+        if not np.issubdtype(df[column].dtype, np.number):
+            raise ValueError(f"Column '{column}' is not numeric")
+    kept = df.loc[keep, columns]
+    moments = kept.agg(['mean', 'std'])
+    iqr_columns = list(dict.fromkeys(op['column'] for op in operations if op['method'] == 'iqr'))
+    quartiles = kept[iqr_columns].quantile([0.25, 0.75]) if iqr_columns else None
+
+    passed = np.ones(len(df), dtype=bool)
+    for operation in operations:
+        values = df[operation['column']]
+        if operation['method'] == 'zscore':
+            mean, std = moments.at['mean', operation['column']], moments.at['std', operation['column']]
+            passed &= (np.abs((values - mean) / std) < operation['threshold']).to_numpy()
+        elif operation['method'] == 'iqr':
+            q1, q3 = quartiles.at[0.25, operation['column']], quartiles.at[0.75, operation['column']]
+            iqr = q3 - q1
+            passed &= ((values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)).to_numpy()
+    return passed
+
+
+def apply_operations(df, operations):
+    """Run normalized cleaning operations over ``df``.
+
+    Row filters narrow a boolean mask instead of copying the frame at every step;
+    the frame is only compacted before an operation that needs the surviving rows
+    themselves. Consecutive remove_outliers operations are all judged against the
+    same rows, so their order among themselves does not matter.
+    """
+    keep = np.ones(len(df), dtype=bool)
+
+    def compact():
+        return df if keep.all() else df[keep].reset_index(drop=True)
+
+    i = 0
+    while i < len(operations):
+        operation = operations[i]
+        op_type = operation['type']
+
+        if op_type == 'handle_missing':
+            if operation['strategy'] == 'drop':
+                keep &= df.notna().all(axis=1).to_numpy()
+            elif operation['strategy'] == 'fill':
+                df = df.fillna(operation['fill_value'])
+
+        elif op_type == 'remove_duplicates':
+            df = compact()
+            keep = ~df.duplicated().to_numpy()
+
+        elif op_type == 'convert_type':
+            _require_column(df, operation['column'])
+            df = compact()
+            keep = np.ones(len(df), dtype=bool)
+            try:
+                df[operation['column']] = df[operation['column']].astype(operation['new_type'])
+            except Exception as e:
+                raise ValueError(f"Failed to convert column {operation['column']} to {operation['new_type']}: {str(e)}")
+
+        elif op_type == 'remove_outliers':
+            run = [operation]
+            while i + 1 < len(operations) and operations[i + 1]['type'] == 'remove_outliers':
+                i += 1
+                run.append(operations[i])
+            keep &= outlier_mask(df, keep, run)
+
+        i += 1
+    return compact()
+
+
+def preview_operations(dataset, operations, rows):
+    """Apply ``operations`` to the first ``rows`` rows of ``dataset`` only."""
+    return apply_operations(read_columns(dataset.id, ensure_columnar(dataset), None, 0, rows), operations)
+
+
+def find_version(db, parent_id, digest):
+    return db.query(Dataset).filter_by(parent_id=parent_id, pipeline_hash=digest).first()
+
+
+def materialize_version(db, parent, operations, name=None):
+    """The dataset version ``operations`` derive from ``parent``, created and stored in columnar form on first use.
+
+    ``operations`` must already be normalized. Returns (dataset, created).
+    """
+    digest = pipeline_hash(operations)
+    existing = find_version(db, parent.id, digest)
+    if existing is not None:
+        return existing, False
+
+    df = apply_operations(read_columns(parent.id, ensure_columnar(parent)), operations)
+    version = Dataset(
+        user_id=parent.user_id,
+        name=name or f"{parent.name} (cleaned)",
+        description=parent.description,
+        columns=[str(column) for column in df.columns],
+        row_count=len(df),
+        profile=profile_chunks([df]),
+        parent_id=parent.id,
+        pipeline={"name": name, "operations": operations},
+        pipeline_hash=digest
+    )
+    try:
+        db.add(version)
+        db.flush()
+    except IntegrityError:
+        # Another request materialized the same pipeline first
+        db.rollback()
+        return find_version(db, parent.id, digest), False
+
+    version_id = version.id
+    try:
+        write_frame(version_id, df)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        remove_columnar(version_id)
+        raise
+    db.refresh(version)
+    return version, True
@@ -0,0 +1,223 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from config import Config
+from database import Dataset, on_commit
+from storage import file_store, open_dataset_file
+
+# On-disk layout, one directory per dataset:
+#   meta.json   row count plus, per column, its name, file, kind and dtype
+#   c<i>.bin    raw little-endian values; 'category' columns hold int32 codes
+#               into meta["columns"][i]["categories"], with -1 for missing
+META_FILE = "meta.json"
+CODE_DTYPE = np.dtype("<i4")
+
+
+def dataset_dir(dataset_id):
+    return os.path.join(Config.COLUMNAR_STORE_DIR, str(dataset_id))
+
+
+class ColumnarWriter:
+    """Appends DataFrame chunks to a new columnar directory, widening column types as later chunks require."""
+
+    def __init__(self):
+        # The dataset id may not exist yet while an upload streams in; it is only needed by close()
+        self.path = os.path.join(Config.COLUMNAR_STORE_DIR, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(self.path)
+        self.columns = None
+        self.row_count = 0
+        self._category_index = []
+
+    def append(self, df):
+        if self.columns is None:
+            self.columns = [
+                {"name": str(name), "file": f"c{i}.bin", "kind": None, "dtype": None}
+                for i, name in enumerate(df.columns)
+            ]
+            self._category_index = [None] * len(self.columns)
+        elif [column["name"] for column in self.columns] != [str(name) for name in df.columns]:
+            raise ValueError("Chunk columns do not match the columns already written")
+
+        for i, column in enumerate(self.columns):
+            self._append_column(i, column, df.iloc[:, i])
+        self.row_count += len(df)
+
+    def _append_column(self, i, column, series):
+        path = os.path.join(self.path, column["file"])
+        is_numeric = pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype)
+
+        if column["kind"] is None:
+            column["kind"] = "numeric" if is_numeric else "category"
+            if is_numeric:
+                column["dtype"] = np.dtype(series.dtype).newbyteorder("<").str
+            else:
+                column["dtype"] = CODE_DTYPE.str
+                column["categories"] = []
+                self._category_index[i] = {}
+        elif column["kind"] == "numeric" and is_numeric:
+            promoted = np.result_type(np.dtype(column["dtype"]), series.dtype).newbyteorder("<")
+            if promoted.str != column["dtype"]:
+                self._rewrite(path, np.fromfile(path, dtype=column["dtype"]).astype(promoted))
+                column["dtype"] = promoted.str
+        elif column["kind"] == "numeric":
+            # A later chunk holds text, so the whole column becomes categorical
+            existing = pd.Series(np.fromfile(path, dtype=column["dtype"]))
+            column["kind"] = "category"
+            column["dtype"] = CODE_DTYPE.str
+            column["categories"] = []
+            self._category_index[i] = {}
+            self._rewrite(path, self._encode(i, column, existing))
+
+        if column["kind"] == "numeric":
+            values = series.to_numpy(dtype=np.dtype(column["dtype"]))
+        else:
+            values = self._encode(i, column, series)
+        with open(path, "ab") as f:
+            values.tofile(f)
+
+    def _encode(self, i, column, series):
+        missing = series.isnull().to_numpy()
+        as_text = series.where(series.isnull(), series.astype(str))
+        index = self._category_index[i]
+        for value in pd.unique(as_text[~missing]):
+            if value not in index:
+                index[value] = len(column["categories"])
+                column["categories"].append(value)
+        codes = as_text.map(index).to_numpy(dtype=float, na_value=-1)
+        return codes.astype(CODE_DTYPE)
+
+    @staticmethod
+    def _rewrite(path, values):
+        with open(path, "wb") as f:
+            values.tofile(f)
+
+    def close(self, dataset_id):
+        meta = {"row_count": self.row_count, "columns": self.columns or []}
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump(meta, f)
+        target = dataset_dir(dataset_id)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(self.path, target)
+        return meta
+
+    def abort(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def write_frame(dataset_id, df):
+    writer = ColumnarWriter()
+    try:
+        writer.append(df)
+        return writer.close(dataset_id)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def read_meta(dataset_id):
+    try:
+        with open(os.path.join(dataset_dir(dataset_id), META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def ensure_columnar(dataset):
+    """Return the columnar metadata for ``dataset``, converting its CSV blob on first access."""
+    meta = read_meta(dataset.id)
+    if meta is None:
+        with open_dataset_file(dataset) as f:
+            meta = write_frame(dataset.id, pd.read_csv(f))
+    return meta
+
+
+def column_array(dataset_id, meta, name):
+    """Memory-map one column's stored values (codes, for categorical columns)."""
+    for column in meta["columns"]:
+        if column["name"] == name:
+            break
+    else:
+        raise KeyError(name)
+    dtype = np.dtype(column["dtype"])
+    if meta["row_count"] == 0:
+        return column, np.empty(0, dtype=dtype)
+    path = os.path.join(dataset_dir(dataset_id), column["file"])
+    return column, np.memmap(path, dtype=dtype, mode="r", shape=(meta["row_count"],))
+
+
+def decode_column(column, values):
+    if column["kind"] == "category":
+        categorical = pd.Categorical.from_codes(np.asarray(values), categories=pd.Index(column["categories"], dtype=object))
+        return pd.Series(categorical).astype(object)
+    return pd.Series(values)
+
+
+def read_columns(dataset_id, meta, columns=None, start=0, stop=None):
+    """Materialize only the requested columns (all by default), optionally for a row range."""
+    names = columns if columns is not None else [column["name"] for column in meta["columns"]]
+    data = {}
+    for name in names:
+        column, values = column_array(dataset_id, meta, name)
+        data[name] = decode_column(column, values[start:stop])
+    return pd.DataFrame(data, columns=names)
+
+
+def read_rows(dataset_id, meta, columns, rows):
+    """Materialize the given columns for a sorted array of row numbers."""
+    data = {}
+    for name in columns:
+        column, values = column_array(dataset_id, meta, name)
+        data[name] = decode_column(column, values[rows])
+    return pd.DataFrame(data, columns=columns)
+
+
+def iter_chunks(dataset_id, meta, chunk_rows, columns=None):
+    for start in range(0, meta["row_count"], chunk_rows):
+        yield read_columns(dataset_id, meta, columns, start, start + chunk_rows)
+
+
+def link_columnar(source_id, dataset_id):
+    """Give ``dataset_id`` the columnar data of ``source_id`` by hard-linking its files; False if there is none."""
+    source = dataset_dir(source_id)
+    if read_meta(source_id) is None:
+        return False
+    temp_path = os.path.join(Config.COLUMNAR_STORE_DIR, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(temp_path)
+    try:
+        for name in os.listdir(source):
+            # Export files are derived on demand and stay with their own dataset
+            if name == META_FILE or name.endswith(".bin"):
+                try:
+                    os.link(os.path.join(source, name), os.path.join(temp_path, name))
+                except OSError:
+                    shutil.copyfile(os.path.join(source, name), os.path.join(temp_path, name))
+        target = dataset_dir(dataset_id)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(temp_path, target)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    return True
+
+
+def remove_columnar(dataset_id):
+    shutil.rmtree(dataset_dir(dataset_id), ignore_errors=True)
+
+
+def _remove_dataset_files(dataset_id, storage_key):
+    remove_columnar(dataset_id)
+    if storage_key:
+        file_store.delete(storage_key)
+
+
+# Deleted datasets, directly or through the user cascade, lose their files on disk
+@event.listens_for(Dataset, "after_delete")
+def _remove_deleted_dataset(mapper, connection, target):
+    on_commit(object_session(target), lambda dataset_id=target.id, storage_key=target.storage_key: _remove_dataset_files(dataset_id, storage_key))
@@ -0,0 +1,136 @@
+import numpy as np
+
+PREDICTORS = ('sklearn', 'compiled')
+COMPILABLE_TYPES = ('decision_tree', 'random_forest')
+# Below this many (row, tree) pairs, traversal runs as a Python loop instead of array operations
+SCALAR_WALK_MAX_PAIRS = 16
+# Training rows a freshly compiled model is checked against before it is used
+VERIFY_ROWS = 1000
+
+
+class CompiledTreeEnsemble:
+    """Fitted decision trees flattened into contiguous node arrays and evaluated for all rows and trees at once.
+
+    Matches the fitted estimator's ``predict``/``predict_proba`` bit for bit: inputs
+    are rounded to float32 as sklearn's input validation does, each tree's leaf
+    values are the ones sklearn reads, and a forest sums its trees in estimator
+    order before dividing by their number, as sklearn does with n_jobs=1.
+    """
+
+    def __init__(self, trees, classes=None, average=False):
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+        self.roots = offsets.astype(np.intp)
+        self.average = average
+        self.classes_ = classes
+        self.n_features_in_ = trees[0].n_features
+        self._nodes = None
+
+        leaf = np.concatenate([tree.children_left == -1 for tree in trees])
+        # children[2 * node + went_right] is the next node, as a global index
+        self.children = np.stack([
+            np.concatenate([tree.children_left + offset for tree, offset in zip(trees, offsets)]),
+            np.concatenate([tree.children_right + offset for tree, offset in zip(trees, offsets)])
+        ], axis=1).astype(np.intp).ravel()
+        self.feature = np.where(leaf, 0, np.concatenate([tree.feature for tree in trees])).astype(np.intp)
+        self.threshold = np.concatenate([tree.threshold for tree in trees])
+        self.leaf = leaf
+        self.missing_go_to_left = np.concatenate([
+            getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=np.uint8)) for tree in trees
+        ]).astype(bool)
+        if classes is not None:
+            self.value = np.concatenate([tree.value[:, 0, :len(classes)] for tree in trees])
+        else:
+            self.value = np.concatenate([tree.value[:, 0, 0] for tree in trees])
+
+    def apply(self, X):
+        """Leaf index of every (row, tree) pair."""
+        # sklearn validates tree inputs to float32; comparisons then happen in float64
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        if n_rows * len(self.roots) <= SCALAR_WALK_MAX_PAIRS:
+            return self._walk(X)
+        flat = X.ravel()
+        has_missing = bool(np.isnan(flat).any())
+        nodes = np.tile(self.roots, n_rows)
+        row_offsets = np.repeat(np.arange(n_rows, dtype=np.intp) * n_features, len(self.roots))
+        # Only (row, tree) pairs that have not reached a leaf take another step
+        active = np.flatnonzero(~self.leaf.take(nodes))
+        while len(active):
+            current = nodes.take(active)
+            values = flat.take(row_offsets.take(active) + self.feature.take(current))
+            go_right = ~(values <= self.threshold.take(current))
+            if has_missing:
+                missing = np.isnan(values)
+                go_right[missing] = ~self.missing_go_to_left.take(current[missing])
+            current = self.children.take(2 * current + go_right)
+            nodes.put(active, current)
+            active = active.compress(~self.leaf.take(current))
+        return nodes.reshape(n_rows, len(self.roots))
+
+    def _walk(self, X):
+        # A handful of (row, tree) pairs is cheaper to walk in plain Python than with array ops per level
+        if self._nodes is None:
+            self._nodes = (self.feature.tolist(), self.threshold.tolist(), self.children.tolist(),
+                           self.leaf.tolist(), self.missing_go_to_left.tolist())
+        feature, threshold, children, leaf, missing_go_to_left = self._nodes
+        leaves = []
+        for row in X.tolist():
+            for node in self.roots.tolist():
+                while not leaf[node]:
+                    value = row[feature[node]]
+                    if value != value:
+                        go_right = not missing_go_to_left[node]
+                    else:
+                        go_right = not value <= threshold[node]
+                    node = children[2 * node + go_right]
+                leaves.append(node)
+        return np.array(leaves, dtype=np.intp).reshape(X.shape[0], len(self.roots))
+
+    def _accumulate(self, X):
+        leaf_values = self.value[self.apply(X)]
+        if not self.average:
+            return leaf_values[:, 0]
+        total = np.zeros(leaf_values.shape[:1] + leaf_values.shape[2:])
+        for tree in range(leaf_values.shape[1]):
+            total += leaf_values[:, tree]
+        total /= leaf_values.shape[1]
+        return total
+
+
+class CompiledTreeClassifier(CompiledTreeEnsemble):
+    def predict_proba(self, X):
+        return self._accumulate(X)
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self._accumulate(X), axis=1), axis=0)
+
+
+class CompiledTreeRegressor(CompiledTreeEnsemble):
+    def predict(self, X):
+        return self._accumulate(X)
+
+
+def compile_trees(model):
+    """Compile a fitted single-output tree or forest, or return None if the estimator is not supported."""
+    # Imported here so loading this module does not pull in sklearn; a fitted model means it is loaded already
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+    from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
+
+    if isinstance(model, (RandomForestClassifier, RandomForestRegressor)):
+        trees, average = [estimator.tree_ for estimator in model.estimators_], True
+    elif isinstance(model, (DecisionTreeClassifier, DecisionTreeRegressor)):
+        trees, average = [model.tree_], False
+    else:
+        return None
+    if model.n_outputs_ != 1:
+        return None
+    if hasattr(model, 'classes_'):
+        return CompiledTreeClassifier(trees, model.classes_, average)
+    return CompiledTreeRegressor(trees, average=average)
+
+
+def verify_compiled(model, compiled, X):
+    """Whether ``compiled`` reproduces ``model`` exactly on ``X``."""
+    if hasattr(compiled, 'predict_proba') and not np.array_equal(compiled.predict_proba(X), model.predict_proba(X)):
+        return False
+    return np.array_equal(compiled.predict(X), model.predict(X))
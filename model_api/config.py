@@ -5,9 +5,107 @@ load_dotenv()
 
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    # Defaults to DATABASE_URL with its asyncio driver (asyncpg / aiosqlite). sslmode becomes asyncpg's ssl;
+    # other libpq-only parameters (sslrootcert, connect_timeout, ...) are dropped, so set it when DATABASE_URL needs them
+    ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL')
+
+    # Connection pool per engine (ignored for SQLite); size it for the I/O pool plus the request threads
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 20))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    # Server-side statement timeout on PostgreSQL; 0 disables it
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
 
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES = 60
     ALGORITHM = os.getenv('ALGORITHM')
 
-    DEBUG = os.getenv('FAST_ENV') == 'development'
\ No newline at end of file
+    DEBUG = os.getenv('FAST_ENV') == 'development'
+
+    # Memory budget for deserialized models kept by the /predict cache
+    MODEL_CACHE_MAX_BYTES = int(os.getenv('MODEL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    # Serving copies of models mapped by every worker process on this host, and the disk budget they share
+    SHARED_MODEL_STORE = os.getenv('SHARED_MODEL_STORE', 'true').lower() == 'true'
+    SHARED_MODEL_DIR = os.getenv('SHARED_MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'shared_models'))
+    SHARED_MODEL_MAX_BYTES = int(os.getenv('SHARED_MODEL_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+    # Memoized prediction results, for models that opt in, across all such models
+    PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', 100000))
+    PREDICTION_CACHE_TTL_SECONDS = int(os.getenv('PREDICTION_CACHE_TTL_SECONDS', 3600))
+
+    # Upper bound on rows accepted by a single /predict/{model_id}/batch call
+    BATCH_PREDICT_MAX_ROWS = int(os.getenv('BATCH_PREDICT_MAX_ROWS', 10000))
+
+    # Largest request the compiled tree predictor serves; bigger batches go through sklearn
+    COMPILED_PREDICTOR_MAX_ROWS = int(os.getenv('COMPILED_PREDICTOR_MAX_ROWS', 64))
+
+    # Thread pool used to keep blocking work off the event loop; training and scoring have their own processes
+    IO_POOL_WORKERS = int(os.getenv('IO_POOL_WORKERS', 32))
+
+    # Number of training jobs allowed to run at the same time
+    TRAINING_MAX_CONCURRENT_JOBS = int(os.getenv('TRAINING_MAX_CONCURRENT_JOBS', 2))
+    # Running jobs record a heartbeat this often; one silent for the timeout is taken as abandoned
+    JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', 10))
+    JOB_HEARTBEAT_TIMEOUT_SECONDS = int(os.getenv('JOB_HEARTBEAT_TIMEOUT_SECONDS', 60))
+    # Cores each training job may use for fitting, cross-validation and search; defaults to an even share
+    TRAINING_CORES_PER_JOB = int(os.getenv('TRAINING_CORES_PER_JOB', max(1, (os.cpu_count() or 1) // TRAINING_MAX_CONCURRENT_JOBS)))
+    # Default wall-clock budget of a hyperparameter search
+    TRAINING_SEARCH_BUDGET_SECONDS = int(os.getenv('TRAINING_SEARCH_BUDGET_SECONDS', 300))
+    # Rows read per chunk by streaming training and sampling, and the default sample size of mode=sample
+    TRAINING_CHUNK_ROWS = int(os.getenv('TRAINING_CHUNK_ROWS', 100000))
+    TRAINING_SAMPLE_ROWS = int(os.getenv('TRAINING_SAMPLE_ROWS', 100000))
+    # Passes over the data and held-out rows kept for evaluation in streaming training
+    STREAMING_EPOCHS = int(os.getenv('STREAMING_EPOCHS', 5))
+    STREAMING_EVAL_ROWS = int(os.getenv('STREAMING_EVAL_ROWS', 100000))
+    # Rows per chunk handed to a scoring process by batch scoring jobs
+    SCORING_CHUNK_ROWS = int(os.getenv('SCORING_CHUNK_ROWS', 50000))
+
+    # Backend and local directory for trained model artifacts
+    MODEL_ARTIFACT_STORE = os.getenv('MODEL_ARTIFACT_STORE', 'local')
+    MODEL_ARTIFACT_DIR = os.getenv('MODEL_ARTIFACT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'models'))
+
+    # Local directory holding the typed, memory-mappable copy of each uploaded dataset
+    COLUMNAR_STORE_DIR = os.getenv('COLUMNAR_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'columnar'))
+
+    # Leading rows a cleaning preview is computed on
+    CLEAN_PREVIEW_ROWS = int(os.getenv('CLEAN_PREVIEW_ROWS', 10000))
+
+    # Rows per chunk when a dataset profile is recomputed from the columnar store
+    PROFILE_CHUNK_ROWS = int(os.getenv('PROFILE_CHUNK_ROWS', 100000))
+
+    # Local directory holding the uploaded CSV files
+    DATASET_STORAGE_DIR = os.getenv('DATASET_STORAGE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'datasets'))
+    # zstd level uploaded files are stored at; higher levels trade upload CPU for disk
+    DATASET_BLOB_ZSTD_LEVEL = int(os.getenv('DATASET_BLOB_ZSTD_LEVEL', 3))
+
+    # Rows parsed per chunk during upload; bounds upload memory independently of file size
+    UPLOAD_CHUNK_ROWS = int(os.getenv('UPLOAD_CHUNK_ROWS', 50000))
+
+    # Bytes per chunk of a streamed dataset download, and rows per chunk when an export file is written
+    DOWNLOAD_CHUNK_BYTES = int(os.getenv('DOWNLOAD_CHUNK_BYTES', 1024 * 1024))
+    DOWNLOAD_EXPORT_CHUNK_ROWS = int(os.getenv('DOWNLOAD_EXPORT_CHUNK_ROWS', 100000))
+
+    # Prediction history totals are cached per model/time range for this long
+    PREDICTION_COUNT_TTL_SECONDS = int(os.getenv('PREDICTION_COUNT_TTL_SECONDS', 30))
+    PREDICTION_COUNT_CACHE_SIZE = int(os.getenv('PREDICTION_COUNT_CACHE_SIZE', 10000))
+
+    # Write-behind buffering of Prediction rows (see prediction_log.py)
+    PREDICTION_LOG_BATCH_SIZE = int(os.getenv('PREDICTION_LOG_BATCH_SIZE', 500))
+    PREDICTION_LOG_FLUSH_MS = int(os.getenv('PREDICTION_LOG_FLUSH_MS', 200))
+    PREDICTION_LOG_MAX_QUEUE = int(os.getenv('PREDICTION_LOG_MAX_QUEUE', 100000))
+    PREDICTION_LOG_OVERFLOW_POLICY = os.getenv('PREDICTION_LOG_OVERFLOW_POLICY', 'block')
+    PREDICTION_LOG_BLOCK_TIMEOUT_MS = int(os.getenv('PREDICTION_LOG_BLOCK_TIMEOUT_MS', 1000))
+    PREDICTION_LOG_SHUTDOWN_TIMEOUT_S = int(os.getenv('PREDICTION_LOG_SHUTDOWN_TIMEOUT_S', 30))
+    # Retries of a failed batch before it is written row by row and the rows still failing are rejected
+    PREDICTION_LOG_MAX_RETRIES = int(os.getenv('PREDICTION_LOG_MAX_RETRIES', 3))
+
+    # Authenticated-user snapshots are cached per token for at most this long
+    AUTH_USER_CACHE_TTL_SECONDS = int(os.getenv('AUTH_USER_CACHE_TTL_SECONDS', 60))
+    AUTH_USER_CACHE_SIZE = int(os.getenv('AUTH_USER_CACHE_SIZE', 10000))
+
+    # Import the estimator modules of the model types stored in ml_models, in the background at startup
+    MODEL_WARM_UP = os.getenv('MODEL_WARM_UP', 'false').lower() == 'true'
+    # Seconds a worker may take from importing the app to finishing startup before it warns
+    STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', 2.0))
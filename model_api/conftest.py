@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# Config is read at import time, so every location the app writes to points into a
+# throwaway directory before any test module imports it
+WORKDIR = tempfile.mkdtemp(prefix="model_api-tests-")
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'test.db')}"
+os.environ.pop('ASYNC_DATABASE_URL', None)
+os.environ.setdefault('JWT_SECRET_KEY', 'test-secret')
+os.environ.setdefault('ALGORITHM', 'HS256')
+for name, directory in (
+    ('MODEL_ARTIFACT_DIR', 'models'), ('COLUMNAR_STORE_DIR', 'columnar'),
+    ('DATASET_STORAGE_DIR', 'datasets'), ('SHARED_MODEL_DIR', 'shared_models')
+):
+    os.environ[name] = os.path.join(WORKDIR, directory)
+
+
+@pytest.fixture
+def db():
+    """A session on freshly created tables."""
+    import database
+    database.Base.metadata.drop_all(bind=database.engine)
+    database.init_db()
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def user(db):
+    from database import User
+    user = User(username="tester", password="x")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
@@ -1,16 +1,79 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey, Float, LargeBinary
+from sqlalchemy import create_engine, event, inspect, literal, text, Column, Integer, String, DateTime, Boolean, ForeignKey, Float, LargeBinary, Index, UniqueConstraint
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, relationship, deferred
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import JSON
 from datetime import datetime
+from functools import lru_cache
 from config import Config
 
 SQLALCHEMY_DATABASE_URL = Config.SQLALCHEMY_DATABASE_URI
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Async drivers for the sync drivers DATABASE_URL may name
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+# libpq query parameters asyncpg takes under another name
+ASYNCPG_PARAMETERS = {'sslmode': 'ssl'}
+# libpq query parameters asyncpg rejects; a URL that needs them has to set ASYNC_DATABASE_URL
+LIBPQ_ONLY_PARAMETERS = (
+    'sslrootcert', 'sslcert', 'sslkey', 'sslcrl', 'sslpassword', 'sslcompression', 'sslsni', 'gssencmode',
+    'channel_binding', 'connect_timeout', 'application_name', 'options', 'client_encoding', 'target_session_attrs',
+    'keepalives', 'keepalives_idle', 'keepalives_interval', 'keepalives_count', 'tcp_user_timeout'
+)
+
+def engine_options(url):
+    url = make_url(url)
+    options = {'pool_pre_ping': Config.DB_POOL_PRE_PING}
+    if url.get_backend_name() == 'sqlite':
+        # SQLite picks its own pool class; sizing arguments do not apply to it
+        return options
+    options.update(
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+        pool_recycle=Config.DB_POOL_RECYCLE
+    )
+    if Config.DB_STATEMENT_TIMEOUT_MS and url.get_backend_name() == 'postgresql':
+        if url.get_driver_name() == 'asyncpg':
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(Config.DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options['connect_args'] = {'options': f'-c statement_timeout={Config.DB_STATEMENT_TIMEOUT_MS}'}
+    return options
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def to_async_url(url):
+    """``url`` with its asyncio driver, and its libpq query parameters translated for asyncpg."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    url = url.set(drivername=ASYNC_DRIVERS.get(backend, url.drivername))
+    if backend != 'postgresql':
+        return url
+    dropped = [name for name in url.query if name in LIBPQ_ONLY_PARAMETERS]
+    if dropped:
+        print(f"Ignoring {', '.join(dropped)} in DATABASE_URL for asyncpg; set ASYNC_DATABASE_URL to configure them")
+    query = {ASYNCPG_PARAMETERS.get(name, name): value for name, value in url.query.items() if name not in LIBPQ_ONLY_PARAMETERS}
+    return url.set(query=query)
+
+def async_database_url():
+    if Config.ASYNC_DATABASE_URL:
+        return Config.ASYNC_DATABASE_URL
+    return to_async_url(SQLALCHEMY_DATABASE_URL)
+
+# The asyncio engine is only built (and its driver only imported) on first use
+@lru_cache(maxsize=None)
+def get_async_engine():
+    url = async_database_url()
+    return create_async_engine(url, **engine_options(url))
+
+@lru_cache(maxsize=None)
+def get_async_sessionmaker():
+    return async_sessionmaker(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
+
 Base = sqlalchemy.orm.declarative_base()
 
 class User(Base):
@@ -26,6 +89,7 @@ class User(Base):
 
     models = relationship('MLModel', back_populates='user', cascade='all, delete-orphan')
     datasets = relationship('Dataset', back_populates='user', cascade='all, delete-orphan')
+    training_jobs = relationship('TrainingJob', back_populates='user', cascade='all, delete-orphan')
 
 class MLModel(Base):
     __tablename__ = 'ml_models'
@@ -37,7 +101,10 @@ class MLModel(Base):
     model_type = Column(String(50), nullable=False)
     feature_columns = Column(JSON, nullable=False)
     target_column = Column(String(50), nullable=False)
-    model_data = Column(LargeBinary, nullable=False)
+    # Content hash of the joblib artifact in the model artifact store (see artifacts.py)
+    artifact_key = Column(String(64), index=True)
+    # Pickled estimator of models trained before the artifact store; deferred so metadata queries never pull it
+    model_data = deferred(Column(LargeBinary))
     config_data = Column(JSON, nullable=False)
     metrics = Column(JSON)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -49,6 +116,44 @@ class MLModel(Base):
     dataset = relationship('Dataset', back_populates='models')
     predictions = relationship('Prediction', back_populates='model', cascade='all, delete-orphan')
 
+class TrainingJob(Base):
+    __tablename__ = 'training_jobs'
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # 'train' fits a model on the dataset; 'score' runs model_id over it into output_dataset_id
+    kind = Column(String(20), nullable=False, default='train')
+    dataset_id = Column(Integer, ForeignKey('datasets.id', ondelete='SET NULL'))
+    # queued -> running -> succeeded | failed, or cancelling -> cancelled
+    state = Column(String(20), nullable=False, default='queued', index=True)
+    stage = Column(String(20))
+    stage_timings = Column(JSON)
+    params = Column(JSON, nullable=False)
+    model_id = Column(Integer, ForeignKey('ml_models.id', ondelete='SET NULL'))
+    output_dataset_id = Column(Integer, ForeignKey('datasets.id', ondelete='SET NULL'))
+    # Rows processed so far and throughput, for jobs that report them
+    progress = Column(JSON)
+    error = Column(String)
+    # host:pid of the process running the job, and the last time it reported being alive
+    owner = Column(String(255))
+    heartbeat_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    user = relationship('User', back_populates='training_jobs')
+
+class DatasetBlob(Base):
+    __tablename__ = 'dataset_blobs'
+
+    # SHA-256 of the uploaded bytes, which are stored zstd-compressed in the blob store
+    id = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    stored_size = Column(Integer, nullable=False)
+    # Datasets referring to the blob; it is removed once this drops to zero
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Dataset(Base):
     __tablename__ = 'datasets'
 
@@ -56,14 +161,31 @@ class Dataset(Base):
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     name = Column(String(100), nullable=False)
     description = Column(String)
-    file_data = Column(LargeBinary)
+    file_data = deferred(Column(LargeBinary))
+    # Content hash of the uploaded CSV in the blob store
+    blob_id = Column(String(64), ForeignKey('dataset_blobs.id'), index=True)
+    # Older uploads keep a raw file in the dataset file store, or their bytes in file_data
+    storage_key = Column(String(255))
     columns = Column(JSON, nullable=False)
     row_count = Column(Integer)
+    # Per-column statistics computed once at upload (see profiling.py)
+    profile = Column(JSON)
+    # Cleaned versions point at the dataset they were derived from and record the
+    # cleaning pipeline that produced them (see cleaning.py)
+    parent_id = Column(Integer, ForeignKey('datasets.id', ondelete='CASCADE'), index=True)
+    pipeline = Column(JSON)
+    pipeline_hash = Column(String(64))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user = relationship('User', back_populates='datasets')
     models = relationship('MLModel', back_populates='dataset')
+    blob = relationship('DatasetBlob')
+    versions = relationship('Dataset', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        UniqueConstraint('parent_id', 'pipeline_hash', name='uq_datasets_parent_pipeline'),
+    )
 
 class Prediction(Base):
     __tablename__ = 'predictions'
@@ -77,6 +199,25 @@ class Prediction(Base):
 
     model = relationship('MLModel', back_populates='predictions')
 
+    # Serves history pages and keyset cursors ordered by (created_at, id) within a model
+    __table_args__ = (
+        Index('ix_predictions_model_id_created_at_id', 'model_id', 'created_at', 'id'),
+    )
+
+# Side effects outside the database (files, in-process caches) that must only happen
+# once the transaction that caused them has committed, and never if it rolls back
+def on_commit(session, callback):
+    session.info.setdefault("on_commit", []).append(callback)
+
+@event.listens_for(Session, "after_commit")
+def _run_commit_callbacks(session):
+    for callback in session.info.pop("on_commit", []):
+        callback()
+
+@event.listens_for(Session, "after_rollback")
+def _drop_commit_callbacks(session):
+    session.info.pop("on_commit", None)
+
 # Database Dependency
 def get_db():
     db = SessionLocal()
@@ -85,9 +226,112 @@ def get_db():
     finally:
         db.close()
 
-# Create all tables in the database
-def init_db():
+# Async Database Dependency, for endpoints that run on the event loop
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+async def dispose_async_engine():
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+
+def _column_sql(column, dialect):
+    """Column definition for ALTER TABLE ... ADD COLUMN."""
+    sql = f"{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+    for foreign_key in column.foreign_keys:
+        sql += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+        if foreign_key.ondelete:
+            sql += f" ON DELETE {foreign_key.ondelete}"
+    if not column.nullable:
+        # Existing rows need a value; only columns with a scalar default can be added as NOT NULL
+        default = literal(column.default.arg, column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+        sql += f" NOT NULL DEFAULT {default}"
+    return sql
+
+
+def _rebuild_sqlite_table(conn, table):
+    # SQLite cannot relax a NOT NULL constraint in place: copy the rows into a table
+    # created from the current model, then swap it in and recreate its indexes
+    temp_name = f"{table.name}_upgrade"
+    create = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.execute(text(create.replace(f"CREATE TABLE {table.name} (", f"CREATE TABLE {temp_name} (", 1)))
+    columns = ", ".join(column['name'] for column in inspect(conn).get_columns(table.name))
+    conn.execute(text(f"INSERT INTO {temp_name} ({columns}) SELECT {columns} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {temp_name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn)
+
+
+def _statement(sql):
+    return lambda conn: conn.execute(text(sql))
+
+
+def _upgrade_steps(conn):
+    """(description, action) for every difference between the existing tables and the models."""
+    inspector = inspect(conn)
+    steps = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name']: column for column in inspector.get_columns(table.name)}
+        rebuilt = False
+        for column in table.columns:
+            if column.name not in existing:
+                steps.append((f"add {table.name}.{column.name}", _statement(
+                    f"ALTER TABLE {table.name} ADD COLUMN {_column_sql(column, conn.dialect)}"
+                )))
+            elif column.nullable and not existing[column.name]['nullable'] and not column.primary_key:
+                if conn.dialect.name == 'sqlite':
+                    steps.append((f"rebuild {table.name}", lambda conn, table=table: _rebuild_sqlite_table(conn, table)))
+                    rebuilt = True
+                    break
+                steps.append((f"drop NOT NULL on {table.name}.{column.name}", _statement(
+                    f"ALTER TABLE {table.name} ALTER COLUMN {column.name} DROP NOT NULL"
+                )))
+
+        if rebuilt:
+            # The rebuilt table comes with every index of the model
+            continue
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        indexes |= {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                steps.append((f"create index {index.name}", index.create))
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint) and constraint.name and constraint.name not in indexes:
+                # A unique index enforces the same rule and, unlike a constraint, SQLite can add one
+                columns = ", ".join(column.name for column in constraint.columns)
+                steps.append((f"create unique index {constraint.name}", _statement(
+                    f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({columns})"
+                )))
+    return steps
+
+
+def upgrade_schema():
+    """Bring tables created by earlier versions up to the current models; returns what was changed.
+
+    create_all only creates missing tables, so columns, indexes and relaxed NOT NULL
+    constraints added to existing tables since are applied here. Every step is
+    idempotent: a worker that loses a race to apply the same step carries on.
+    """
     Base.metadata.create_all(bind=engine)
+    applied = []
+    with engine.connect() as conn:
+        steps = _upgrade_steps(conn)
+    for description, action in steps:
+        try:
+            with engine.begin() as conn:
+                action(conn)
+        except DBAPIError:
+            with engine.connect() as conn:
+                if description in {pending for pending, _ in _upgrade_steps(conn)}:
+                    raise
+        else:
+            applied.append(description)
+    return applied
+
+# Create all tables in the database, upgrading those created by earlier versions
+def init_db():
+    return upgrade_schema()
 
 if __name__ == "__main__":
     init_db()
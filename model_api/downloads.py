@@ -0,0 +1,154 @@
+import os
+import re
+import uuid
+import zlib
+from io import BytesIO
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
+
+from columnar import dataset_dir, ensure_columnar, iter_chunks
+from config import Config
+from storage import blob_store, file_store
+
+DOWNLOAD_FORMATS = ('csv', 'parquet')
+MEDIA_TYPES = {'csv': 'text/csv; charset=utf-8', 'parquet': 'application/vnd.apache.parquet'}
+# Preferred first when the client accepts several equally
+CONTENT_ENCODINGS = ('zstd', 'gzip')
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single-range ``Range`` header, or None to serve the whole file.
+
+    Multiple ranges and malformed headers are ignored, as RFC 9110 allows.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def negotiate_encoding(header):
+    """The CONTENT_ENCODINGS entry the ``Accept-Encoding`` header ranks highest, or None for identity."""
+    if not header:
+        return None
+    weights = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                weight = float(match.group(1))
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = weight
+
+    def quality(encoding):
+        return weights.get(encoding, weights.get("*", 0.0))
+
+    # max() keeps the first of equally weighted encodings
+    best = max(CONTENT_ENCODINGS, key=quality)
+    return best if quality(best) > 0 else None
+
+
+def iter_file(f, start, length, chunk_size):
+    """Yield ``length`` bytes of ``f`` from ``start`` in chunks, closing it at the end."""
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def iter_encoded(chunks, encoding):
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    else:
+        compressor = zstandard.ZstdCompressor().compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_path(dataset_id, download_format):
+    return os.path.join(dataset_dir(dataset_id), f"export.{download_format}")
+
+
+def _write_export(dataset, path, download_format):
+    meta = ensure_columnar(dataset)
+    temp_path = os.path.join(os.path.dirname(path), f".{uuid.uuid4().hex}.part")
+    try:
+        if download_format == 'parquet':
+            # The schema comes from the stored column types, not from whichever values the first chunk holds
+            schema = pa.schema([
+                (column["name"], pa.string() if column["kind"] == "category" else pa.from_numpy_dtype(column["dtype"]))
+                for column in meta["columns"]
+            ])
+            with pq.ParquetWriter(temp_path, schema) as writer:
+                for chunk in iter_chunks(dataset.id, meta, Config.DOWNLOAD_EXPORT_CHUNK_ROWS):
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        else:
+            with open(temp_path, "w", newline="", encoding="utf-8") as f:
+                for i, chunk in enumerate(iter_chunks(dataset.id, meta, Config.DOWNLOAD_EXPORT_CHUNK_ROWS)):
+                    chunk.to_csv(f, index=False, header=i == 0)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def open_download(dataset, download_format):
+    """(binary file object, size) of ``dataset`` in ``download_format``.
+
+    Uploaded CSVs are served as stored. Parquet exports, and CSVs of cleaned
+    versions that only exist in columnar form, are written once next to the
+    columnar data and reused by later downloads.
+    """
+    if download_format == 'csv' and dataset.parent_id is None:
+        if dataset.blob_id:
+            return blob_store.open(dataset.blob_id), dataset.blob.size
+        if dataset.storage_key:
+            return file_store.open(dataset.storage_key), file_store.size(dataset.storage_key)
+        if dataset.file_data is not None:
+            return BytesIO(dataset.file_data), len(dataset.file_data)
+
+    path = export_path(dataset.id, download_format)
+    if not os.path.exists(path):
+        _write_export(dataset, path, download_format)
+    return open(path, "rb"), os.path.getsize(path)
+
+
+def open_stored_encoded(dataset, download_format, encoding):
+    """(binary file object, size) of the stored bytes when they already are ``dataset`` in ``encoding``, else None."""
+    if encoding == 'zstd' and download_format == 'csv' and dataset.blob_id:
+        return blob_store.open_compressed(dataset.blob_id), dataset.blob.stored_size
+    return None
@@ -0,0 +1,199 @@
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+from joblib import Parallel, delayed
+from joblib.externals.loky import ProcessPoolExecutor
+
+EVALUATIONS = ('holdout', 'kfold', 'none')
+SEARCH_MODES = ('none', 'grid', 'random')
+
+# Hyperparameters explored by search for each ml_model_type
+SEARCH_SPACES = {
+    'linear_regression': {'fit_intercept': [True, False]},
+    'logistic_regression': {'C': [0.01, 0.1, 1.0, 10.0, 100.0], 'max_iter': [1000]},
+    'svm': {'C': [0.1, 1.0, 10.0], 'kernel': ['rbf', 'linear'], 'gamma': ['scale', 'auto']},
+    'decision_tree': {'max_depth': [None, 5, 10, 20], 'min_samples_leaf': [1, 5, 20]},
+    'random_forest': {
+        'n_estimators': [100, 300],
+        'max_depth': [None, 10, 20],
+        'min_samples_leaf': [1, 5],
+        'max_features': ['sqrt', 1.0]
+    },
+    'sgd': {'model__alpha': [1e-5, 1e-4, 1e-3, 1e-2], 'model__penalty': ['l2', 'l1', 'elasticnet']},
+    'naive_bayes': {'var_smoothing': [1e-11, 1e-9, 1e-7, 1e-5]}
+}
+
+HALVING_FACTOR = 3
+SEARCH_FOLDS = 3
+# Smallest subsample a first halving round is scored on
+SEARCH_MIN_ROWS = 100
+# How often a search waiting on its candidates checks whether its job was cancelled
+SEARCH_CANCEL_CHECK_SECONDS = 1.0
+
+
+def set_n_jobs(estimator, n_jobs):
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=n_jobs)
+    return estimator
+
+
+# sklearn is imported inside the functions below: they only run in training
+# workers, and the serving process imports this module for its constants
+
+def score_predictions(estimator, y_true, y_pred):
+    from sklearn.base import is_classifier
+    from sklearn.metrics import accuracy_score, f1_score, mean_absolute_error, mean_squared_error, r2_score
+
+    if is_classifier(estimator):
+        return {
+            "accuracy": float(accuracy_score(y_true, y_pred)),
+            "f1_macro": float(f1_score(y_true, y_pred, average='macro'))
+        }
+    return {
+        "r2": float(r2_score(y_true, y_pred)),
+        "mae": float(mean_absolute_error(y_true, y_pred)),
+        "rmse": float(math.sqrt(mean_squared_error(y_true, y_pred)))
+    }
+
+
+def make_cv(estimator, y, folds):
+    from sklearn.base import is_classifier
+    from sklearn.model_selection import KFold, StratifiedKFold
+
+    if is_classifier(estimator):
+        # Every fold needs each class at least once
+        smallest_class = int(np.unique(y, return_counts=True)[1].min())
+        if smallest_class >= 2:
+            return StratifiedKFold(n_splits=min(folds, smallest_class), shuffle=True, random_state=42)
+    return KFold(n_splits=folds, shuffle=True, random_state=42)
+
+
+def _fit_and_score(estimator, X, y, train, test):
+    estimator.fit(X[train], y[train])
+    return score_predictions(estimator, y[test], estimator.predict(X[test]))
+
+
+def evaluate_model(estimator, X, y, method, n_jobs, test_size=0.2, folds=5):
+    """Metrics for an unfitted copy of ``estimator``, from a held-out split or k-fold cross-validation."""
+    from sklearn.base import clone, is_classifier
+    from sklearn.model_selection import train_test_split
+
+    if method == 'holdout':
+        stratify = y if is_classifier(estimator) and y.value_counts().min() >= 2 else None
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=42, stratify=stratify)
+        fitted = set_n_jobs(clone(estimator), n_jobs).fit(X_train, y_train)
+        return {"evaluation": "holdout", "test_rows": len(y_test), **score_predictions(estimator, y_test, fitted.predict(X_test))}
+
+    # Folds run in parallel, so each fold's estimator stays single-threaded
+    X, y = X.to_numpy(), y.to_numpy()
+    cv = make_cv(estimator, y, folds)
+    fold_scores = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_and_score)(set_n_jobs(clone(estimator), 1), X, y, train, test)
+        for train, test in cv.split(X, y)
+    )
+    metrics = {"evaluation": "kfold", "folds": len(fold_scores)}
+    for name in fold_scores[0]:
+        values = [scores[name] for scores in fold_scores]
+        metrics[name] = float(np.mean(values))
+        metrics[f"{name}_std"] = float(np.std(values))
+    return metrics
+
+
+def _score_candidate(index, estimator, X, y, cv):
+    from sklearn.model_selection import cross_val_score
+
+    scores = cross_val_score(estimator, X, y, cv=cv, error_score=np.nan)
+    score = float(np.mean(scores))
+    # Candidates that fail to fit rank last
+    return index, score if not math.isnan(score) else -math.inf
+
+
+def _finite(score):
+    # Stored as JSON, which has no infinities
+    return score if math.isfinite(score) else None
+
+
+def search_hyperparameters(ml_model_type, estimator, X, y, mode, n_jobs, budget_seconds, n_candidates=20, check_cancelled=None):
+    """Successive-halving search over SEARCH_SPACES[ml_model_type] within a wall-clock budget.
+
+    Every candidate is cross-validated on a small subsample first; each round keeps
+    the best 1/HALVING_FACTOR of them and scores those on HALVING_FACTOR times the
+    rows, so clearly losing candidates never see the full dataset. Candidates run
+    in parallel across ``n_jobs`` worker processes. Once the budget is spent, or
+    ``check_cancelled`` raises, the search stops waiting and kills the candidates
+    still running. Returns the best parameters found along with a summary of the search.
+    """
+    from sklearn.base import clone, is_classifier
+    from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+    started = time.monotonic()
+    deadline = started + budget_seconds
+    space = SEARCH_SPACES[ml_model_type]
+    if mode == 'grid':
+        candidates = list(ParameterGrid(space))
+    else:
+        candidates = list(ParameterSampler(space, n_iter=min(n_candidates, len(ParameterGrid(space))), random_state=42))
+
+    X, y = X.to_numpy(), y.to_numpy()
+    n_rows = len(y)
+    rounds = math.ceil(math.log(len(candidates), HALVING_FACTOR)) if len(candidates) > 1 else 0
+    min_rows = min(n_rows, max(SEARCH_MIN_ROWS, n_rows // HALVING_FACTOR ** rounds))
+    order = np.random.default_rng(42).permutation(n_rows)
+
+    best = None
+    evaluated = 0
+    timed_out = False
+    remaining = list(range(len(candidates)))
+    history = []
+    # A private pool, so candidates still running when the search stops can be killed
+    executor = ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        for round_number in range(rounds + 1):
+            rows = n_rows if round_number == rounds else min(n_rows, min_rows * HALVING_FACTOR ** round_number)
+            subset = order[:rows]
+            X_round, y_round = X[subset], y[subset]
+            cv = make_cv(estimator, y_round, SEARCH_FOLDS)
+
+            pending = {
+                executor.submit(_score_candidate, index, set_n_jobs(clone(estimator).set_params(**candidates[index]), 1), X_round, y_round, cv)
+                for index in remaining
+            }
+            scores = {}
+            checked = time.monotonic()
+            while pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    timed_out = True
+                    break
+                if check_cancelled is not None and now - checked >= SEARCH_CANCEL_CHECK_SECONDS:
+                    check_cancelled()
+                    checked = now
+                done, pending = wait(pending, timeout=min(deadline - now, SEARCH_CANCEL_CHECK_SECONDS), return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, score = future.result()
+                    scores[index] = score
+
+            evaluated += len(scores)
+            if scores:
+                ranked = sorted(scores, key=scores.get, reverse=True)
+                best = {"params": candidates[ranked[0]], "score": _finite(scores[ranked[0]])}
+                history.append({"rows": rows, "candidates": len(remaining), "scored": len(scores), "best_score": best["score"]})
+                remaining = ranked[:max(1, math.ceil(len(remaining) / HALVING_FACTOR))]
+            if timed_out or rows == n_rows or len(remaining) == 1:
+                break
+    finally:
+        executor.shutdown(wait=False, kill_workers=True)
+
+    return {
+        "mode": mode,
+        "scoring": "accuracy" if is_classifier(estimator) else "r2",
+        "candidates": len(candidates),
+        "evaluated": evaluated,
+        "rounds": history,
+        "timed_out": timed_out,
+        "best_params": best["params"] if best else {},
+        "best_score": best["score"] if best else None,
+        "seconds": round(time.monotonic() - started, 3)
+    }
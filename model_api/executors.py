@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+pools = []
+
+
+class TrackedExecutor:
+    """Wraps a concurrent.futures executor so endpoints can await it and monitoring can see its backlog."""
+
+    def __init__(self, name, factory, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._factory = factory
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        pools.append(self)
+
+    @property
+    def executor(self):
+        # Created on first use so importing the app never forks worker processes
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._factory(max_workers=self.max_workers)
+            return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            result = await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        else:
+            with self._lock:
+                self.completed += 1
+            return result
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Fire-and-forget submission for work whose outcome is recorded elsewhere (e.g. training jobs)."""
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - self.max_workers),
+                "completed": self.completed,
+                "failed": self.failed
+            }
+
+
+# Blocking I/O (SQLAlchemy sessions, pickle loads of cached models, inference)
+io_pool = TrackedExecutor("io", ThreadPoolExecutor, Config.IO_POOL_WORKERS)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    return await io_pool.run(fn, *args, **kwargs)
+
+
+def pool_stats():
+    return {pool.name: pool.stats() for pool in pools}
+
+
+def shutdown_pools():
+    for pool in pools:
+        pool.shutdown()
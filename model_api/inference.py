@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+
+def encode_features(df, cached):
+    """Encode a frame of raw feature values for ``cached``'s model in one vectorized pass.
+
+    Returns the encoded feature frame and a dict mapping row position to an error
+    message for rows that could not be encoded.
+    """
+    errors = {}
+    encoded = pd.DataFrame(index=df.index)
+
+    for column in cached.feature_columns:
+        values = df[column]
+        missing = values.isnull()
+        if column in cached.encoders:
+            # Categories were learned from CSV text, so compare on the string form
+            values = values.where(missing, values.astype(str)).map(cached.encoders[column])
+            message = f"Invalid categorical value in column {column}"
+        else:
+            values = pd.to_numeric(values, errors='coerce')
+            message = f"Invalid numeric value in column {column}"
+        for position in np.flatnonzero(values.isnull().to_numpy() & ~missing.to_numpy()):
+            errors.setdefault(int(position), message)
+        for position in np.flatnonzero(missing.to_numpy()):
+            errors.setdefault(int(position), f"Missing value in column {column}")
+        encoded[column] = values
+
+    return encoded, errors
+
+
+def predict_with_confidence(model, X):
+    """Predict labels and confidence scores with a single model call where possible.
+
+    Classifiers exposing ``predict_proba`` derive labels from the probabilities
+    instead of running ``predict`` separately; other models get ``None`` scores.
+    """
+    if hasattr(model, 'predict_proba'):
+        proba = model.predict_proba(X)
+        labels = model.classes_.take(proba.argmax(axis=1))
+        return labels.tolist(), proba.max(axis=1).tolist()
+    return model.predict(X).tolist(), [None] * len(X)
@@ -0,0 +1,122 @@
+import functools
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from config import Config
+from database import SessionLocal, TrainingJob
+from executors import TrackedExecutor
+from metrics import observe_stage
+from scoring import run_scoring_job
+from training import ACTIVE_STATES, init_training_worker, run_training_job
+
+# Bounds how many training and scoring jobs run at once, independently of the general CPU pool
+training_pool = TrackedExecutor(
+    "training",
+    functools.partial(ProcessPoolExecutor, initializer=init_training_worker),
+    Config.TRAINING_MAX_CONCURRENT_JOBS
+)
+
+JOB_RUNNERS = {'train': run_training_job, 'score': run_scoring_job}
+
+_futures = {}
+
+
+def submit_job(job_id, kind='train'):
+    future = training_pool.submit(JOB_RUNNERS[kind], job_id)
+    _futures[job_id] = future
+    future.add_done_callback(lambda _: _futures.pop(job_id, None))
+    future.add_done_callback(functools.partial(_record_stages, kind))
+
+
+def _record_stages(kind, future):
+    # Jobs run in worker processes, so their stage timings come back with the result
+    if future.cancelled() or future.exception() is not None:
+        return
+    for stage, seconds in (future.result() or {}).items():
+        observe_stage(kind, stage, seconds)
+
+
+def cancel_job(db, job):
+    """Cancel a queued job outright, or ask a running job to stop at its next stage boundary."""
+    cancelled = db.query(TrainingJob).filter_by(id=job.id, state='queued') \
+        .update({'state': 'cancelled', 'finished_at': datetime.utcnow()})
+    if cancelled:
+        future = _futures.get(job.id)
+        if future is not None:
+            future.cancel()
+    else:
+        db.query(TrainingJob).filter_by(id=job.id, state='running').update({'state': 'cancelling'})
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def owner_gone(owner):
+    """Whether a job's owning process is known to have exited; only processes on this host can be checked."""
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def is_abandoned(job, now):
+    stale = now - timedelta(seconds=Config.JOB_HEARTBEAT_TIMEOUT_SECONDS)
+    return job.state in ACTIVE_STATES and (
+        owner_gone(job.owner) or job.heartbeat_at is None or job.heartbeat_at < stale
+    )
+
+
+def fail_abandoned_jobs(db, jobs):
+    """Fail those of ``jobs`` whose process died or stopped heartbeating; jobs another worker runs are left alone."""
+    now = datetime.utcnow()
+    failed = 0
+    for job in jobs:
+        if is_abandoned(job, now):
+            # Guarded on the heartbeat read, so a beat that lands in between keeps the job alive
+            failed += db.query(TrainingJob).filter(
+                TrainingJob.id == job.id, TrainingJob.state.in_(ACTIVE_STATES), TrainingJob.heartbeat_at == job.heartbeat_at
+            ).update({'state': 'failed', 'error': 'Interrupted: the process running the job stopped', 'finished_at': now},
+                     synchronize_session=False)
+    if failed:
+        db.commit()
+        for job in jobs:
+            db.refresh(job)
+    return failed
+
+
+def resume_jobs():
+    """Requeue jobs persisted as queued and fail abandoned ones; jobs that were mid-run cannot be resumed."""
+    db = SessionLocal()
+    try:
+        fail_abandoned_jobs(db, db.query(TrainingJob).filter(TrainingJob.state.in_(ACTIVE_STATES)).all())
+        for job_id, kind in db.query(TrainingJob.id, TrainingJob.kind).filter_by(state='queued').order_by(TrainingJob.id):
+            submit_job(job_id, kind)
+    finally:
+        db.close()
+
+
+def serialize_job(job):
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "state": job.state,
+        "stage": job.stage,
+        "stage_timings": job.stage_timings or {},
+        "progress": job.progress,
+        "model_id": job.model_id,
+        "dataset_id": job.dataset_id,
+        "output_dataset_id": job.output_dataset_id,
+        "params": job.params,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
@@ -0,0 +1,218 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from executors import pool_stats
+from model_cache import model_cache
+from prediction_cache import prediction_cache
+from prediction_log import prediction_writer
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864, 268435456)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Request header that asks for a Server-Timing header on the response
+SERVER_TIMING_REQUEST_HEADER = b"x-server-timing"
+
+# Stage timings of the current request, when it asked for a Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per combination of label values."""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (the last one past every bound), then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _sample_lines(name, metric_type, documentation, samples):
+    """Exposition lines for a counter or gauge from (labels dict, value) pairs."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        lines.append(f"{name}{{{label_text}}} {float(value)}")
+    return lines
+
+
+def _stats_lines(prefix, label, stats_by_label, fields):
+    """One counter or gauge per stats field, with a series per ``label`` value."""
+    lines = []
+    for field, metric_type, documentation in fields:
+        name = f"{prefix}_{field}" + ("_total" if metric_type == "counter" else "")
+        lines.extend(_sample_lines(name, metric_type, documentation, [
+            ({label: key}, stats[field]) for key, stats in stats_by_label.items()
+        ]))
+    return lines
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Time from receiving a request to sending its last response byte.",
+    ("method", "route", "status"), LATENCY_BUCKETS
+)
+request_size = Histogram("http_request_size_bytes", "Request body sizes.", ("route",), SIZE_BUCKETS)
+response_size = Histogram("http_response_size_bytes", "Response body sizes, as sent.", ("route",), SIZE_BUCKETS)
+stage_latency = Histogram(
+    "stage_duration_seconds", "Time spent in each stage of predictions, uploads and training or scoring jobs.",
+    ("operation", "stage"), LATENCY_BUCKETS
+)
+
+
+def observe_stage(operation, stage, seconds):
+    stage_latency.observe((operation, stage), seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def stage_timer(operation, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(operation, stage, time.perf_counter() - started)
+
+
+# Cold start of this worker, from importing the app to the end of its startup hooks
+startup = {"seconds": None, "budget_seconds": None}
+
+
+def record_startup(seconds, budget_seconds):
+    startup.update(seconds=seconds, budget_seconds=budget_seconds)
+    if seconds > budget_seconds:
+        print(f"Startup took {seconds:.2f}s, over the {budget_seconds:.2f}s budget")
+
+
+def server_timing_header(timings, total):
+    entries = [f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in timings]
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """Records latency and payload sizes of every request against its route template.
+
+    Requests sending ``X-Server-Timing: 1`` also get their stage timings back in a
+    Server-Timing header. Stages that finish after the response headers went out,
+    such as the body of a streamed download, are only in the histograms.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        opted_in = dict(scope["headers"]).get(SERVER_TIMING_REQUEST_HEADER, b"").strip() in (b"1", b"true")
+        timings = [] if opted_in else None
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        sizes = {"request": 0, "response": 0}
+        status = 500
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def timing_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings is not None:
+                    header = server_timing_header(timings, time.perf_counter() - started)
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, timing_send)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            request_latency.observe((scope["method"], path, str(status)), time.perf_counter() - started)
+            request_size.observe((path,), sizes["request"])
+            response_size.observe((path,), sizes["response"])
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for histogram in (request_latency, request_size, response_size, stage_latency):
+        lines.extend(histogram.render())
+
+    caches = {"model": model_cache.stats(), "prediction": prediction_cache.stats()}
+    lines.extend(_stats_lines("cache", "cache", caches, (
+        ("hits", "counter", "Cache lookups answered from the cache."),
+        ("misses", "counter", "Cache lookups that had to load or compute the value."),
+        ("evictions", "counter", "Entries evicted to stay within the cache's bound."),
+        ("hit_rate", "gauge", "Hits over lookups since startup."),
+        ("entries", "gauge", "Entries held by the cache."),
+    )))
+    lines.extend(_sample_lines("model_cache_bytes", "gauge", "Bytes of models held by the model cache.", [({}, caches["model"]["bytes"])]))
+    shared = caches["model"]["shared"]
+    if shared is not None:
+        lines.extend(_sample_lines("shared_model_store_entries", "gauge", "Serving files in the shared model store.", [({}, shared["entries"])]))
+        lines.extend(_sample_lines("shared_model_store_bytes", "gauge", "Bytes of serving files in the shared model store.", [({}, shared["bytes"])]))
+        lines.extend(_sample_lines("shared_model_store_builds_total", "counter", "Serving files this worker built.", [({}, shared["builds"])]))
+        lines.extend(_sample_lines("shared_model_store_evictions_total", "counter", "Serving files this worker evicted.", [({}, shared["evictions"])]))
+
+    lines.extend(_stats_lines("executor", "pool", pool_stats(), (
+        ("in_flight", "gauge", "Tasks submitted to the pool and not yet finished."),
+        ("queue_depth", "gauge", "Tasks waiting for a free pool worker."),
+        ("max_workers", "gauge", "Workers the pool may run."),
+        ("completed", "counter", "Tasks the pool finished successfully."),
+        ("failed", "counter", "Tasks that raised or were cancelled."),
+    )))
+
+    if startup["seconds"] is not None:
+        lines.extend(_sample_lines("startup_duration_seconds", "gauge", "Time from importing the app to the end of startup.", [({}, startup["seconds"])]))
+        lines.extend(_sample_lines("startup_budget_seconds", "gauge", "Startup time allowed before a warning.", [({}, startup["budget_seconds"])]))
+
+    writer = prediction_writer.stats()
+    lines.extend(_sample_lines("prediction_log_queued", "gauge", "Prediction rows buffered for the next write.", [({}, writer["queued"])]))
+    lines.extend(_sample_lines("prediction_log_written_total", "counter", "Prediction rows written.", [({}, writer["written"])]))
+    lines.extend(_sample_lines("prediction_log_dropped_total", "counter", "Prediction rows dropped on overflow.", [({}, writer["dropped"])]))
+    lines.extend(_sample_lines("prediction_log_rejected_total", "counter", "Prediction rows the database refused or that ran out of retries.", [({}, writer["rejected"])]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,41 @@
+"""Move pickled models out of ml_models.model_data into the model artifact store.
+
+Run once per deployment after upgrading: ``python migrate_artifacts.py``.
+It first brings the schema up to date (see database.upgrade_schema), which adds
+the artifact_key column and drops the NOT NULL constraint on model_data, then
+rewrites each legacy model as a joblib artifact and clears its blob, one row per
+commit so it can be interrupted and re-run. Models that are not migrated keep
+working from their blob in the meantime.
+"""
+import pickle
+
+from artifacts import artifact_store, keep_artifact
+from database import SessionLocal, MLModel, upgrade_schema
+
+
+def migrate_models():
+    db = SessionLocal()
+    migrated = 0
+    try:
+        pending = [row.id for row in db.query(MLModel.id).filter(
+            MLModel.artifact_key.is_(None), MLModel.model_data.isnot(None)
+        )]
+        for model_id in pending:
+            ml_model = db.get(MLModel, model_id)
+            model = pickle.loads(ml_model.model_data)
+            ml_model.artifact_key = artifact_store.save(model)
+            ml_model.model_data = None
+            db.commit()
+            keep_artifact(ml_model.artifact_key, model)
+            # Drop the unpickled blob before loading the next one
+            db.expunge(ml_model)
+            del model
+            migrated += 1
+    finally:
+        db.close()
+    return migrated
+
+
+if __name__ == "__main__":
+    upgrade_schema()
+    print(f"Migrated {migrate_models()} model(s) to the artifact store")
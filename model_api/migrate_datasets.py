@@ -0,0 +1,63 @@
+"""Move uploaded datasets into the content-addressed, compressed blob store.
+
+Run once per deployment after upgrading: ``python migrate_datasets.py``.
+It first brings the schema up to date (see database.upgrade_schema), which
+creates the dataset_blobs table and every datasets column added since the first
+release, then recompresses each dataset still kept raw in
+datasets.file_data or in the dataset file store, one row per commit so it can
+be interrupted and re-run. Identical datasets end up sharing one blob.
+"""
+from blobs import acquire_blob
+from database import SessionLocal, Dataset, upgrade_schema
+from storage import blob_store, file_store, open_dataset_file
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+def migrate_datasets():
+    db = SessionLocal()
+    migrated = 0
+    try:
+        pending = [row.id for row in db.query(Dataset.id).filter(
+            Dataset.blob_id.is_(None), Dataset.parent_id.is_(None)
+        )]
+        for dataset_id in pending:
+            dataset = db.get(Dataset, dataset_id)
+            sink = blob_store.new_upload()
+            try:
+                with open_dataset_file(dataset) as f:
+                    for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b""):
+                        sink.write(block)
+                blob_id = sink.finish()
+                with blob_store.locked(blob_id):
+                    try:
+                        if acquire_blob(db, blob_id, sink.size, sink.stored_size):
+                            sink.abort()
+                        else:
+                            sink.commit()
+                        storage_key = dataset.storage_key
+                        dataset.blob_id = blob_id
+                        dataset.storage_key = None
+                        dataset.file_data = None
+                        db.commit()
+                    except BaseException:
+                        # Before the lock is released, so nobody waits on a row this holds
+                        db.rollback()
+                        raise
+            except BaseException:
+                db.rollback()
+                sink.abort()
+                raise
+            if storage_key:
+                file_store.delete(storage_key)
+            # Drop the raw bytes before loading the next dataset
+            db.expunge(dataset)
+            migrated += 1
+    finally:
+        db.close()
+    return migrated
+
+
+if __name__ == "__main__":
+    upgrade_schema()
+    print(f"Migrated {migrate_datasets()} dataset(s) to the blob store")
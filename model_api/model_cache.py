@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from artifacts import artifact_store, load_model
+from compiled_trees import compile_trees
+from config import Config
+from database import MLModel
+from shared_models import shared_model_store
+
+
+class CachedModel:
+    def __init__(self, model_id, updated_at, model, config, size, compiled=None, artifact_key=None):
+        self.model_id = model_id
+        self.updated_at = updated_at
+        # None until first needed when the shared store handed over only the compiled trees
+        self._model = model
+        self.artifact_key = artifact_key
+        self._model_lock = threading.Lock()
+        self.config = config
+        self.feature_columns = config['feature_columns']
+        # Flattened trees for models trained or switched to the compiled predictor
+        if compiled is None and model is not None and config.get('predictor') == 'compiled':
+            compiled = compile_trees(model)
+        self.compiled = compiled
+        # Repeated inputs are answered from prediction_cache when the model opted in
+        self.memoize = config.get('memoize', False)
+        self.size = size
+        # Label-encoder lookups, built once per load instead of once per request
+        self.encoders = {
+            column: {val: idx for idx, val in enumerate(unique_values)}
+            for column, unique_values in config.get('preprocessing', {}).get('label_encoders', {}).items()
+        }
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = artifact_store.load(self.artifact_key)
+        return self._model
+
+    def predictor_for(self, n_rows):
+        # The compiled engine wins on small batches; sklearn's Cython loops win on large ones
+        if self.compiled is not None and n_rows <= Config.COMPILED_PREDICTOR_MAX_ROWS:
+            return self.compiled
+        return self.model
+
+
+class ModelCache:
+    """LRU cache of deserialized models keyed on (model_id, updated_at), bounded by a byte budget.
+
+    With the shared model store, entries map its serving files; an entry whose file
+    another worker removed is reloaded instead of served.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, ml_model):
+        key = (ml_model.id, ml_model.updated_at)
+        use_store = shared_model_store is not None and shared_model_store.shares(ml_model)
+        shared = not use_store or shared_model_store.touch(*key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and shared:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._discard_model(ml_model.id)
+            self.misses += 1
+
+        # Load outside the lock
+        if use_store:
+            model, compiled, size = shared_model_store.load(ml_model)
+            entry = CachedModel(
+                ml_model.id, ml_model.updated_at, model, ml_model.config_data, size, compiled, ml_model.artifact_key
+            )
+        else:
+            model, size = load_model(ml_model)
+            entry = CachedModel(ml_model.id, ml_model.updated_at, model, ml_model.config_data, size)
+        self.put(entry)
+        return entry
+
+    def put(self, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard_model(entry.model_id)
+            self._entries[(entry.model_id, entry.updated_at)] = entry
+            self.current_bytes += entry.size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
+
+    def invalidate(self, model_id):
+        with self._lock:
+            self._discard_model(model_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _discard_model(self, model_id):
+        for key in [key for key in self._entries if key[0] == model_id]:
+            self.current_bytes -= self._entries.pop(key).size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "shared": shared_model_store.stats() if shared_model_store is not None else None
+            }
+
+
+model_cache = ModelCache(Config.MODEL_CACHE_MAX_BYTES)
+
+
+@event.listens_for(MLModel, 'after_update')
+@event.listens_for(MLModel, 'after_delete')
+def _invalidate_model(mapper, connection, target):
+    model_cache.invalidate(target.id)
@@ -0,0 +1,86 @@
+import importlib
+from functools import lru_cache
+
+from database import SessionLocal, MLModel
+
+PIPELINE_CLASS = 'sklearn.pipeline.Pipeline'
+SCALER_CLASS = 'sklearn.preprocessing.StandardScaler'
+
+
+class ModelType:
+    """How one ml_model_type is built, with its estimator classes named by dotted path until first use.
+
+    A type with only one of classifier/regressor uses it for every target, as the
+    original training code did; ``categorical_target`` rejects numeric targets instead.
+    """
+
+    def __init__(self, classifier=None, regressor=None, params=None, parallel=False, scaled=False, categorical_target=False):
+        self.classifier = classifier
+        self.regressor = regressor
+        self.params = params or {}
+        # Accepts n_jobs for fitting on several cores
+        self.parallel = parallel
+        # Trains behind a StandardScaler in a Pipeline
+        self.scaled = scaled
+        self.categorical_target = categorical_target
+
+    def class_paths(self):
+        paths = [path for path in (self.classifier, self.regressor) if path]
+        if self.scaled:
+            paths += [PIPELINE_CLASS, SCALER_CLASS]
+        return paths
+
+
+REGISTRY = {
+    'linear_regression': ModelType(regressor='sklearn.linear_model.LinearRegression'),
+    'logistic_regression': ModelType(classifier='sklearn.linear_model.LogisticRegression', params={'random_state': 42}),
+    'svm': ModelType(classifier='sklearn.svm.SVC', params={'random_state': 42}),
+    'decision_tree': ModelType(
+        'sklearn.tree.DecisionTreeClassifier', 'sklearn.tree.DecisionTreeRegressor', params={'random_state': 42}
+    ),
+    'random_forest': ModelType(
+        'sklearn.ensemble.RandomForestClassifier', 'sklearn.ensemble.RandomForestRegressor',
+        params={'n_estimators': 100, 'random_state': 42}, parallel=True
+    ),
+    # SGD is sensitive to feature scale, so it always trains behind a scaler
+    'sgd': ModelType(
+        'sklearn.linear_model.SGDClassifier', 'sklearn.linear_model.SGDRegressor', params={'random_state': 42}, scaled=True
+    ),
+    'naive_bayes': ModelType(classifier='sklearn.naive_bayes.GaussianNB', categorical_target=True),
+}
+
+MODEL_TYPES = tuple(REGISTRY)
+
+
+@lru_cache(maxsize=None)
+def load_class(path):
+    module_name, _, class_name = path.rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def estimator_class(ml_model_type, categorical_target):
+    model_type = REGISTRY[ml_model_type]
+    if categorical_target and model_type.classifier:
+        return load_class(model_type.classifier)
+    return load_class(model_type.regressor or model_type.classifier)
+
+
+def preload(ml_model_type):
+    for path in REGISTRY[ml_model_type].class_paths():
+        load_class(path)
+
+
+def warm_up():
+    """Import the estimator modules of every model type stored in ml_models; returns those types.
+
+    Unpickling a model imports its estimator module anyway, so this only moves that
+    cost from the first prediction of each type to a moment of the caller's choosing.
+    """
+    db = SessionLocal()
+    try:
+        present = [row.model_type for row in db.query(MLModel.model_type).distinct() if row.model_type in REGISTRY]
+    finally:
+        db.close()
+    for ml_model_type in present:
+        preload(ml_model_type)
+    return present
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+
+import numpy as np
+from sqlalchemy import event
+
+from caching import TTLCache
+from config import Config
+from database import MLModel
+from inference import predict_with_confidence
+
+
+class PredictionCache:
+    """(prediction, confidence) results of models that opt in, keyed by a hash of each encoded feature vector."""
+
+    def __init__(self, maxsize, ttl):
+        self.results = TTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        # model_id -> [hits, misses]
+        self._model_counts = {}
+
+    @staticmethod
+    def row_keys(cached, X):
+        # Encoded rows as float64, with -0.0 folded into 0.0 so equal vectors hash alike;
+        # updated_at in the key keeps results of a changed model from being served
+        values = np.ascontiguousarray(X.to_numpy(dtype=np.float64) + 0.0)
+        return [
+            (cached.model_id, cached.updated_at, hashlib.blake2b(row.tobytes(), digest_size=16).digest())
+            for row in values
+        ]
+
+    def lookup(self, model_id, keys):
+        found = [self.results.get(key) for key in keys]
+        hits = sum(result is not None for result in found)
+        with self._lock:
+            counts = self._model_counts.setdefault(model_id, [0, 0])
+            counts[0] += hits
+            counts[1] += len(found) - hits
+        return found
+
+    def store(self, keys, results):
+        for key, result in zip(keys, results):
+            self.results.set(key, result)
+
+    def invalidate(self, model_id):
+        self.results.discard_where(lambda key: key[0] == model_id)
+
+    def model_stats(self, model_id):
+        with self._lock:
+            hits, misses = self._model_counts.get(model_id, (0, 0))
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
+
+    def stats(self):
+        return self.results.stats()
+
+
+prediction_cache = PredictionCache(Config.PREDICTION_CACHE_SIZE, Config.PREDICTION_CACHE_TTL_SECONDS)
+
+
+def predict_memoized(cached, X):
+    """predict_with_confidence for ``cached``'s model, answering repeated rows from the cache if the model opted in."""
+    if not cached.memoize:
+        return predict_with_confidence(cached.predictor_for(len(X)), X)
+
+    keys = prediction_cache.row_keys(cached, X)
+    results = prediction_cache.lookup(cached.model_id, keys)
+    misses = [position for position, result in enumerate(results) if result is None]
+    if misses:
+        X_missed = X if len(misses) == len(X) else X.iloc[misses]
+        predictions, confidence_scores = predict_with_confidence(cached.predictor_for(len(misses)), X_missed)
+        for position, prediction, confidence_score in zip(misses, predictions, confidence_scores):
+            results[position] = (prediction, confidence_score)
+        prediction_cache.store([keys[position] for position in misses], [results[position] for position in misses])
+    return [result[0] for result in results], [result[1] for result in results]
+
+
+@event.listens_for(MLModel, 'after_update')
+@event.listens_for(MLModel, 'after_delete')
+def _invalidate_predictions(mapper, connection, target):
+    prediction_cache.invalidate(target.id)
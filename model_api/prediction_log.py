@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+
+from config import Config
+from database import SessionLocal, Prediction
+from executors import run_blocking
+
+OVERFLOW_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+def _row_error(error):
+    """Whether ``error`` comes from the rows written rather than from the database being unavailable."""
+    return isinstance(error, (IntegrityError, DataError)) or not isinstance(error, DBAPIError)
+
+
+class PredictionWriter:
+    """Write-behind buffer that bulk-inserts Prediction rows every ``batch_size`` rows or ``flush_interval`` seconds.
+
+    When the database falls behind and the buffer reaches ``max_queue`` rows, the
+    overflow policy decides what happens: 'block' makes producers wait up to
+    ``block_timeout`` seconds for space, 'drop_newest' rejects the incoming rows
+    and 'drop_oldest' discards the oldest buffered rows.
+
+    A batch the database refuses is retried up to ``max_retries`` times, then
+    written row by row so that rows it still refuses are rejected on their own
+    instead of holding up everything queued behind them.
+    """
+
+    def __init__(self, batch_size, flush_interval, max_queue, overflow_policy, block_timeout, max_retries):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+        self._rows = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._writing = 0
+        self._thread = None
+        self._stopping = False
+        self._flush_requested = False
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failed_batches = 0
+        self.last_flush_seconds = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="prediction-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, rows):
+        """Buffer rows for insertion; returns how many were accepted."""
+        self.start()
+        with self._lock:
+            overflow = len(self._rows) + len(rows) - self.max_queue
+            if overflow > 0 and self.overflow_policy == 'block':
+                deadline = time.monotonic() + self.block_timeout
+                while len(self._rows) + len(rows) > self.max_queue:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._not_full.wait(remaining):
+                        break
+                overflow = len(self._rows) + len(rows) - self.max_queue
+
+            if overflow > 0 and self.overflow_policy == 'drop_oldest':
+                evicted = min(overflow, len(self._rows))
+                for _ in range(evicted):
+                    self._rows.popleft()
+                self.dropped += evicted
+                overflow -= evicted
+
+            accepted = rows if overflow <= 0 else rows[:max(0, len(rows) - overflow)]
+            self.dropped += len(rows) - len(accepted)
+            self._rows.extend(accepted)
+            if len(self._rows) >= self.batch_size:
+                self._not_empty.notify()
+            return len(accepted)
+
+    def try_submit(self, rows):
+        """Buffer rows only if they fit right now; never waits and never drops."""
+        self.start()
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_queue:
+                return False
+            self._rows.extend(rows)
+            if len(self._rows) >= self.batch_size:
+                self._not_empty.notify()
+            return True
+
+    def _take_batch(self):
+        batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+        self._writing += len(batch)
+        self._not_full.notify_all()
+        return batch
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._rows) < self.batch_size and not (self._stopping or self._flush_requested):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+                if self._stopping and not self._rows:
+                    return
+                batch = self._take_batch()
+                if not self._rows:
+                    self._flush_requested = False
+
+            if batch:
+                self._write(batch)
+
+            with self._lock:
+                self._writing -= len(batch)
+                self._idle.notify_all()
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    db.execute(insert(Prediction), batch)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    with self._lock:
+                        self.failed_batches += 1
+                    # Retrying cannot help a batch holding a row the database refuses
+                    if _row_error(e) or attempt == self.max_retries:
+                        break
+                    time.sleep(min(self.flush_interval * 2 ** attempt, 1.0))
+                else:
+                    with self._lock:
+                        self.written += len(batch)
+                    return
+            self._write_rows(db, batch)
+        finally:
+            db.close()
+            self.last_flush_seconds = time.perf_counter() - started
+
+    def _write_rows(self, db, batch):
+        written = 0
+        for i, row in enumerate(batch):
+            try:
+                db.execute(insert(Prediction), [row])
+                db.commit()
+                written += 1
+            except Exception as e:
+                db.rollback()
+                if _row_error(e):
+                    self._reject(1, e)
+                    continue
+                # The database itself is failing and the batch has used up its retries
+                self._reject(len(batch) - i, e)
+                break
+        with self._lock:
+            self.written += written
+
+    def _reject(self, count, error):
+        with self._lock:
+            self.rejected += count
+        print(f"Prediction log rejected {count} row(s): {type(error).__name__}: {str(error).splitlines()[0]}")
+
+    def flush(self, timeout=None):
+        """Block until everything buffered so far has been written (or dropped)."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._flush_requested = True
+            self._not_empty.notify()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._rows or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+
+    def stop(self, timeout=None):
+        with self._lock:
+            thread = self._thread
+            self._stopping = True
+            self._not_empty.notify()
+        if thread is not None:
+            thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": len(self._rows),
+                "writing": self._writing,
+                "written": self.written,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "failed_batches": self.failed_batches,
+                "last_flush_seconds": self.last_flush_seconds,
+                "overflow_policy": self.overflow_policy
+            }
+
+
+prediction_writer = PredictionWriter(
+    batch_size=Config.PREDICTION_LOG_BATCH_SIZE,
+    flush_interval=Config.PREDICTION_LOG_FLUSH_MS / 1000,
+    max_queue=Config.PREDICTION_LOG_MAX_QUEUE,
+    overflow_policy=Config.PREDICTION_LOG_OVERFLOW_POLICY,
+    block_timeout=Config.PREDICTION_LOG_BLOCK_TIMEOUT_MS / 1000,
+    max_retries=Config.PREDICTION_LOG_MAX_RETRIES
+)
+
+
+
+def write_predictions(db, rows):
+    db.execute(insert(Prediction), rows)
+    db.commit()
+
+
+async def log_predictions(db, rows, durable=False):
+    """Record Prediction rows, either buffered (default) or committed before returning when ``durable``."""
+    if durable:
+        await run_blocking(write_predictions, db, rows)
+    elif prediction_writer.overflow_policy == 'block':
+        # Waiting for buffer space must not stall the event loop, so only a full buffer costs a thread hop
+        if not prediction_writer.try_submit(rows):
+            await run_blocking(prediction_writer.submit, rows)
+    else:
+        prediction_writer.submit(rows)
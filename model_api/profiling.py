@@ -0,0 +1,182 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+HLL_PRECISION = 12
+QUANTILE_SAMPLE_SIZE = 2048
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+TOP_K = 10
+TOP_K_CAPACITY = 1000
+
+
+class HyperLogLog:
+    """Distinct-count estimator over 64-bit hashes (2**precision one-byte registers)."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        if len(hashes) == 0:
+            return
+        p = self.precision
+        index = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        # Bit length of the remaining bits, taken from 32-bit halves so the float conversion is exact
+        high = (rest >> np.uint64(32)).astype(np.float64)
+        low = (rest & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        bit_length = np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1])
+        rank = ((64 - p) - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class ColumnProfiler:
+    def __init__(self, name, seed):
+        self.name = name
+        self.dtype = None
+        self.count = 0
+        self.null_count = 0
+        self.hll = HyperLogLog()
+        self._rng = np.random.default_rng(seed)
+        # Running moments, merged per chunk with Chan et al.'s parallel update
+        self.numeric_count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        # Bottom-k by random key is a uniform sample of everything seen so far
+        self._sample_keys = np.empty(0)
+        self._sample_values = np.empty(0)
+        self.counts = {}
+
+    def update(self, series):
+        self.count += len(series)
+        missing = series.isnull()
+        self.null_count += int(missing.sum())
+        values = series[~missing]
+        is_numeric = pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+        if self.dtype is None or self.dtype == str(series.dtype):
+            self.dtype = str(series.dtype)
+        elif self.dtype != 'object' and is_numeric and self._is_numeric_dtype(self.dtype):
+            self.dtype = str(np.result_type(np.dtype(self.dtype), series.dtype))
+        else:
+            self.dtype = 'object'
+
+        if is_numeric:
+            numbers = values.to_numpy(dtype=np.float64)
+            self.hll.add_hashes(pd.util.hash_array(numbers))
+            self._update_moments(numbers)
+            self._update_sample(numbers)
+        else:
+            text = values.astype(str)
+            self.hll.add_hashes(pd.util.hash_array(text.to_numpy(dtype=object)))
+            self._update_counts(text)
+
+    @staticmethod
+    def _is_numeric_dtype(dtype):
+        return dtype != 'bool' and np.dtype(dtype).kind in 'iuf'
+
+    def _update_moments(self, numbers):
+        n = len(numbers)
+        if n == 0:
+            return
+        chunk_mean = float(numbers.mean())
+        chunk_m2 = float(((numbers - chunk_mean) ** 2).sum())
+        total = self.numeric_count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta * delta * self.numeric_count * n / total
+        self.numeric_count = total
+        chunk_min, chunk_max = float(numbers.min()), float(numbers.max())
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+
+    def _update_sample(self, numbers):
+        keys = np.concatenate([self._sample_keys, self._rng.random(len(numbers))])
+        values = np.concatenate([self._sample_values, numbers])
+        if len(keys) > QUANTILE_SAMPLE_SIZE:
+            keep = np.argpartition(keys, QUANTILE_SAMPLE_SIZE)[:QUANTILE_SAMPLE_SIZE]
+            keys, values = keys[keep], values[keep]
+        self._sample_keys, self._sample_values = keys, values
+
+    def _update_counts(self, text):
+        for value, count in text.value_counts().head(TOP_K_CAPACITY).items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        if len(self.counts) > TOP_K_CAPACITY:
+            # Keep the heaviest candidates; counts become approximate for very high-cardinality columns
+            kept = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:TOP_K_CAPACITY]
+            self.counts = dict(kept)
+
+    def result(self):
+        profile = {
+            "name": self.name,
+            "dtype": self.dtype or 'object',
+            "count": self.count,
+            "null_count": self.null_count,
+            "distinct_estimate": self.hll.estimate()
+        }
+        if self.numeric_count:
+            profile.update({
+                "min": self.min,
+                "max": self.max,
+                "mean": self.mean,
+                "std": math.sqrt(self.m2 / (self.numeric_count - 1)) if self.numeric_count > 1 else None,
+                "quantiles": {
+                    str(q): float(v) for q, v in zip(QUANTILES, np.quantile(self._sample_values, QUANTILES))
+                }
+            })
+        if self.counts:
+            top = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:TOP_K]
+            profile["top_k"] = [{"value": value, "count": count} for value, count in top]
+        return profile
+
+
+class DatasetProfiler:
+    """Single-pass, chunk-at-a-time profile of a dataset."""
+
+    def __init__(self):
+        self.columns = None
+        self.row_count = 0
+
+    def update(self, df):
+        if self.columns is None:
+            self.columns = [ColumnProfiler(str(name), seed=i) for i, name in enumerate(df.columns)]
+        for profiler, (_, series) in zip(self.columns, df.items()):
+            profiler.update(series)
+        self.row_count += len(df)
+
+    def result(self):
+        columns = [profiler.result() for profiler in self.columns or []]
+        return {
+            "row_count": self.row_count,
+            "column_count": len(columns),
+            "columns": columns
+        }
+
+
+def profile_chunks(chunks):
+    profiler = DatasetProfiler()
+    for chunk in chunks:
+        profiler.update(chunk)
+    return profiler.result()
+
+
+def profile_summary(profile):
+    """The shape/columns/missing_values/dtypes view that visualize_dataset has always returned."""
+    return {
+        "shape": [profile["row_count"], profile["column_count"]],
+        "columns": [column["name"] for column in profile["columns"]],
+        "missing_values": {column["name"]: column["null_count"] for column in profile["columns"]},
+        "dtypes": {column["name"]: column["dtype"] for column in profile["columns"]}
+    }
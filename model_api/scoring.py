@@ -0,0 +1,291 @@
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.exc import IntegrityError
+
+from artifacts import load_model
+from cleaning import find_version, pipeline_hash
+from columnar import ColumnarWriter, column_array, ensure_columnar, read_columns, remove_columnar
+from config import Config
+from database import SessionLocal, Dataset, MLModel
+from downloads import export_path
+from inference import predict_with_confidence
+from model_cache import CachedModel
+from profiling import DatasetProfiler
+from training import JobCancelled, JobRunner, TrainingError, claim_job, init_training_worker
+
+# Appended to every scored row; renamed with a numeric suffix if the dataset already uses the name
+OUTPUT_COLUMNS = ('prediction', 'confidence_score', 'scoring_error')
+# Chunks each scoring process may have queued ahead of the chunk being written
+CHUNKS_AHEAD_PER_WORKER = 2
+
+
+class FeatureEncoder:
+    """Encodes row ranges of a columnar dataset for one model, straight from the stored values.
+
+    Categorical columns are stored as codes, so each gets a lookup array from code
+    to the model's label-encoder index (or to its numeric value, for columns the
+    model saw as numbers) and a chunk is encoded by indexing, never as strings.
+    Rows come out with the same error messages encode_features gives.
+    """
+
+    def __init__(self, dataset_id, meta, cached):
+        self.dataset_id = dataset_id
+        self.meta = meta
+        self.cached = cached
+        self.lookups = {}
+        for name in cached.feature_columns:
+            column, _ = column_array(dataset_id, meta, name)
+            if column["kind"] == "category":
+                categories = pd.Series(column["categories"], dtype=object)
+                if name in cached.encoders:
+                    lookup = categories.map(cached.encoders[name])
+                else:
+                    lookup = pd.to_numeric(categories, errors='coerce')
+                self.lookups[name] = lookup.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    def encode(self, start, stop):
+        """(X, errors, failed) for rows [start, stop); errors holds each failed row's message."""
+        n_rows = stop - start
+        errors = np.full(n_rows, None, dtype=object)
+        failed = np.zeros(n_rows, dtype=bool)
+        encoded = {}
+
+        for name in self.cached.feature_columns:
+            _, values = column_array(self.dataset_id, self.meta, name)
+            values = np.asarray(values[start:stop])
+            if name in self.lookups:
+                missing = values < 0
+                result = np.full(n_rows, np.nan)
+                result[~missing] = self.lookups[name][values[~missing]]
+            else:
+                series = pd.Series(values)
+                missing = series.isnull().to_numpy()
+                if name in self.cached.encoders:
+                    # Categories were learned from CSV text, so compare on the string form
+                    series = series.where(series.isnull(), series.astype(str)).map(self.cached.encoders[name])
+                result = series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+            if name in self.cached.encoders:
+                invalid_message = f"Invalid categorical value in column {name}"
+            else:
+                invalid_message = f"Invalid numeric value in column {name}"
+            for mask, message in ((np.isnan(result) & ~missing, invalid_message), (missing, f"Missing value in column {name}")):
+                mask = mask & ~failed
+                errors[mask] = message
+                failed |= mask
+            encoded[name] = result
+
+        return pd.DataFrame(encoded, columns=self.cached.feature_columns), errors, failed
+
+
+def load_encoder(model_id, dataset_id, meta):
+    db = SessionLocal()
+    try:
+        ml_model = db.get(MLModel, model_id)
+        model, size = load_model(ml_model)
+        cached = CachedModel(ml_model.id, ml_model.updated_at, model, ml_model.config_data, size)
+    finally:
+        db.close()
+    return FeatureEncoder(dataset_id, meta, cached)
+
+
+def score_chunk(encoder, start, stop):
+    """(predictions, confidence scores, errors) for rows [start, stop); rows that fail to encode get no prediction."""
+    X, errors, failed = encoder.encode(start, stop)
+    predictions = np.full(stop - start, None, dtype=object)
+    confidence_scores = np.full(stop - start, np.nan)
+    valid = np.flatnonzero(~failed)
+    if len(valid):
+        labels, scores = predict_with_confidence(encoder.cached.predictor_for(len(valid)), X.iloc[valid])
+        predictions[valid] = labels
+        if scores[0] is not None:
+            confidence_scores[valid] = scores
+    return predictions, confidence_scores, errors
+
+
+_worker_encoder = None
+
+
+def init_scoring_worker(model_id, dataset_id, meta):
+    global _worker_encoder
+    init_training_worker()
+    _worker_encoder = load_encoder(model_id, dataset_id, meta)
+
+
+def _score_in_worker(start, stop):
+    return score_chunk(_worker_encoder, start, stop)
+
+
+def _score_in_order(pool, bounds, window):
+    """Results of every chunk in order, with at most ``window`` chunks submitted ahead."""
+    remaining = iter(bounds)
+    pending = deque(pool.submit(_score_in_worker, start, stop) for start, stop in islice(remaining, window))
+    while pending:
+        result = pending.popleft().result()
+        for start, stop in islice(remaining, 1):
+            pending.append(pool.submit(_score_in_worker, start, stop))
+        yield result
+
+
+def output_names(columns):
+    taken = set(columns)
+    names = []
+    for name in OUTPUT_COLUMNS:
+        candidate, suffix = name, 1
+        while candidate in taken:
+            suffix += 1
+            candidate = f"{name}_{suffix}"
+        taken.add(candidate)
+        names.append(candidate)
+    return names
+
+
+def score_dataset(runner, dataset, meta, model_id):
+    """Score every row of ``dataset`` into a ColumnarWriter, a profiler and a temporary CSV file.
+
+    Chunks fan out over up to TRAINING_CORES_PER_JOB processes and are written
+    back in row order as they complete. Returns (writer, profile, csv_path); on
+    failure nothing is left on disk.
+    """
+    rows_total = meta["row_count"]
+    bounds = [
+        (start, min(start + Config.SCORING_CHUNK_ROWS, rows_total))
+        for start in range(0, rows_total, Config.SCORING_CHUNK_ROWS)
+    ]
+    workers = min(Config.TRAINING_CORES_PER_JOB, len(bounds))
+    names = output_names([column["name"] for column in meta["columns"]])
+
+    writer = ColumnarWriter()
+    profiler = DatasetProfiler()
+    csv_path = os.path.join(Config.COLUMNAR_STORE_DIR, f".tmp-{uuid.uuid4().hex}.csv")
+    pool = None
+    try:
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_scoring_worker, initargs=(model_id, dataset.id, meta))
+            results = _score_in_order(pool, bounds, workers * CHUNKS_AHEAD_PER_WORKER)
+        else:
+            encoder = load_encoder(model_id, dataset.id, meta)
+            results = (score_chunk(encoder, start, stop) for start, stop in bounds)
+
+        started = time.perf_counter()
+        with open(csv_path, "w", newline="", encoding="utf-8") as csv_file:
+            for (start, stop), (predictions, confidence_scores, errors) in zip(bounds, results):
+                chunk = read_columns(dataset.id, meta, None, start, stop)
+                chunk[names[0]] = pd.Series(predictions).infer_objects()
+                chunk[names[1]] = confidence_scores
+                chunk[names[2]] = errors
+                writer.append(chunk)
+                profiler.update(chunk)
+                chunk.to_csv(csv_file, index=False, header=start == 0)
+                runner.report_progress(stop, rows_total, time.perf_counter() - started)
+    except BaseException:
+        writer.abort()
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return writer, profiler.result(), csv_path
+
+
+def run_scoring_job(job_id):
+    db = SessionLocal()
+    try:
+        job = claim_job(db, job_id)
+        if job is None:
+            return
+
+        runner = JobRunner(db, job)
+        writer = None
+        csv_path = None
+        written_id = None
+        try:
+            with runner.stage('load'):
+                dataset = db.query(Dataset).filter_by(id=job.dataset_id, user_id=job.user_id).first()
+                if not dataset:
+                    raise TrainingError(404, "Dataset not found")
+                ml_model = db.query(MLModel).filter_by(id=job.model_id, user_id=job.user_id).first()
+                if not ml_model:
+                    raise TrainingError(404, "Model not found")
+                try:
+                    meta = ensure_columnar(dataset)
+                except Exception as e:
+                    raise TrainingError(500, f"Error reading dataset: {str(e)}")
+                column_names = {column["name"] for column in meta["columns"]}
+                missing = [col for col in ml_model.feature_columns if col not in column_names]
+                if missing:
+                    raise TrainingError(400, f"Dataset is missing feature columns: {', '.join(missing)}")
+                if not meta["row_count"]:
+                    raise TrainingError(400, "Dataset has no rows to score")
+
+                # A model's updated_at changes whenever it is retrained or reconfigured, so
+                # a scored version with the same hash holds exactly what this job would write
+                pipeline = {"name": "score", "model_id": ml_model.id, "model_updated_at": ml_model.updated_at.isoformat()}
+                digest = pipeline_hash(pipeline)
+                output = find_version(db, dataset.id, digest)
+
+            if output is None:
+                with runner.stage('score'):
+                    writer, profile, csv_path = score_dataset(runner, dataset, meta, ml_model.id)
+
+                with runner.stage('persist'):
+                    output = Dataset(
+                        user_id=dataset.user_id,
+                        name=f"{dataset.name} (scored by {ml_model.name})",
+                        description=dataset.description,
+                        columns=[column["name"] for column in profile["columns"]],
+                        row_count=profile["row_count"],
+                        profile=profile,
+                        parent_id=dataset.id,
+                        pipeline={**pipeline, "model_name": ml_model.name},
+                        pipeline_hash=digest
+                    )
+                    try:
+                        db.add(output)
+                        db.flush()
+                    except IntegrityError:
+                        # Another job scored the same dataset with the same model first
+                        db.rollback()
+                        output = find_version(db, job.dataset_id, digest)
+                    else:
+                        written_id = output.id
+                        writer.close(output.id)
+                        writer = None
+                        os.replace(csv_path, export_path(output.id, 'csv'))
+                        csv_path = None
+            else:
+                job.progress = {"rows_done": output.row_count, "rows_total": output.row_count, "rows_per_second": None, "reused": True}
+            job.output_dataset_id = output.id
+        except JobCancelled:
+            db.rollback()
+            runner.finish('cancelled')
+        except TrainingError as e:
+            db.rollback()
+            runner.finish('failed', e.detail)
+        except Exception as e:
+            db.rollback()
+            runner.finish('failed', str(e))
+        else:
+            runner.finish('succeeded')
+        if job.state != 'succeeded':
+            if written_id is not None:
+                remove_columnar(written_id)
+            if writer is not None:
+                writer.abort()
+            if csv_path is not None and os.path.exists(csv_path):
+                os.remove(csv_path)
+        elif writer is not None:
+            # Lost the race to an identical version
+            writer.abort()
+            os.remove(csv_path)
+        return runner.timings
+    finally:
+        db.close()
@@ -0,0 +1,191 @@
+import fcntl
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import joblib
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from artifacts import artifact_store, load_model
+from compiled_trees import compile_trees
+from config import Config
+from database import MLModel, on_commit
+
+SERVING_SUFFIX = ".joblib"
+LOCK_SUFFIX = ".lock"
+# Lock file serializing eviction and invalidation across worker processes
+STORE_LOCK = ".store.lock"
+# A served entry's mtime is its last use; refreshing it at most this often keeps hits to one stat
+TOUCH_INTERVAL_SECONDS = 60
+
+
+class SharedModelStore:
+    """Serving copies of models in a local directory that every worker process maps read-only.
+
+    Each (model_id, updated_at) gets one uncompressed joblib file holding what a
+    worker would otherwise build privately: the compiled trees, and the estimator
+    itself for models that predate the artifact store. The first worker to need
+    it builds it under a per-entry file lock; the others just map it, so its
+    arrays live once in the page cache however many workers serve the model.
+    Artifact-backed models served by sklearn have neither to share, since
+    workers already map their artifact files, so they are not stored.
+
+    The directory is the coordination point. Files are evicted least recently
+    used first to keep the directory under ``max_bytes``, and removed when their
+    model is retrained, reconfigured or deleted; workers check that the file of
+    an entry still exists before serving it, so a removal by any process retires
+    the entry everywhere.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.evictions = 0
+
+    def _name(self, model_id, updated_at):
+        return f"{model_id}-{updated_at:%Y%m%dT%H%M%S%f}"
+
+    def path(self, model_id, updated_at):
+        return os.path.join(self.root, self._name(model_id, updated_at) + SERVING_SUFFIX)
+
+    @contextmanager
+    def _locked(self, lock_path):
+        os.makedirs(self.root, exist_ok=True)
+        with open(lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def shares(self, ml_model):
+        """Whether ``ml_model`` has anything for a serving file to hold."""
+        return not ml_model.artifact_key or ml_model.config_data.get('predictor') == 'compiled'
+
+    def touch(self, model_id, updated_at):
+        """Whether the serving file still exists, marking it used."""
+        path = self.path(model_id, updated_at)
+        try:
+            if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL_SECONDS:
+                os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def load(self, ml_model):
+        """(estimator, compiled trees, size) of ``ml_model`` from its serving file, building the file if needed.
+
+        The estimator is None when the compiled trees stand in for it; it is then
+        loaded from the artifact store only if a batch too large for them arrives.
+        """
+        path = self.path(ml_model.id, ml_model.updated_at)
+        while True:
+            if not os.path.exists(path):
+                with self._locked(path[:-len(SERVING_SUFFIX)] + LOCK_SUFFIX):
+                    if not os.path.exists(path):
+                        self._build(ml_model, path)
+            try:
+                serving = joblib.load(path, mmap_mode="r")
+                os.utime(path)
+                break
+            except FileNotFoundError:
+                # Evicted between building and mapping; build it again
+                continue
+
+        model, compiled = serving["model"], serving["compiled"]
+        if ml_model.artifact_key:
+            if compiled is None:
+                model = artifact_store.load(ml_model.artifact_key)
+            return model, compiled, artifact_store.size(ml_model.artifact_key)
+        return model, compiled, os.path.getsize(path)
+
+    def _build(self, ml_model, path):
+        model, _ = load_model(ml_model)
+        compiled = compile_trees(model) if ml_model.config_data.get('predictor') == 'compiled' else None
+        # Artifact files are mapped by every worker already; only pickled rows need a mappable copy
+        serving = {"model": None if ml_model.artifact_key else model, "compiled": compiled}
+        temp_path = os.path.join(self.root, f".{uuid.uuid4().hex}.part")
+        try:
+            joblib.dump(serving, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self.builds += 1
+        self._evict(keep=path)
+
+    def _entries(self):
+        """(mtime, size, path) of every serving file."""
+        entries = []
+        try:
+            scanned = os.scandir(self.root)
+        except FileNotFoundError:
+            return entries
+        with scanned:
+            for item in scanned:
+                if item.name.endswith(SERVING_SUFFIX):
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+        return entries
+
+    def _remove(self, path):
+        for removed in (path, path[:-len(SERVING_SUFFIX)] + LOCK_SUFFIX):
+            try:
+                os.remove(removed)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, keep):
+        with self._locked(os.path.join(self.root, STORE_LOCK)):
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                # Workers still mapping the file keep a valid mapping until they notice it is gone
+                self._remove(path)
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+
+    def invalidate(self, model_id):
+        prefix = f"{model_id}-"
+        with self._locked(os.path.join(self.root, STORE_LOCK)):
+            for _, _, path in self._entries():
+                if os.path.basename(path).startswith(prefix):
+                    self._remove(path)
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+                "builds": self.builds,
+                "evictions": self.evictions
+            }
+
+
+shared_model_store = SharedModelStore(Config.SHARED_MODEL_DIR, Config.SHARED_MODEL_MAX_BYTES) if Config.SHARED_MODEL_STORE else None
+
+
+# Serving files of retrained, reconfigured or deleted models go after the commit;
+# a rolled-back change leaves them in place
+@event.listens_for(MLModel, 'after_update')
+@event.listens_for(MLModel, 'after_delete')
+def _invalidate_changed_model(mapper, connection, target):
+    if shared_model_store is not None:
+        on_commit(object_session(target), lambda model_id=target.id: shared_model_store.invalidate(model_id))
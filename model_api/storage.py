@@ -0,0 +1,191 @@
+import fcntl
+import hashlib
+import io
+import os
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+
+import zstandard
+
+from config import Config
+
+# Lock files shared by blobs whose keys start with the same two hex digits
+LOCK_DIR = ".locks"
+
+
+class UploadSink:
+    """Receives uploaded bytes in a temporary file next to their final location."""
+
+    def __init__(self, root):
+        self.root = root
+        self.key = f"{uuid.uuid4().hex}.csv"
+        self.temp_path = os.path.join(root, f".{self.key}.part")
+        self._file = open(self.temp_path, "wb")
+        self.size = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.temp_path, os.path.join(self.root, self.key))
+        return self.key
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class DatasetFileStore:
+    """Raw uploaded files on local disk, addressed by an opaque key stored on the Dataset row."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def new_upload(self):
+        os.makedirs(self.root, exist_ok=True)
+        return UploadSink(self.root)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def open(self, key):
+        return open(self.path(key), "rb")
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+file_store = DatasetFileStore(Config.DATASET_STORAGE_DIR)
+
+
+class BlobSink:
+    """Hashes uploaded bytes and zstd-compresses them into a temporary file as they arrive."""
+
+    def __init__(self, store):
+        self.store = store
+        self.temp_path = os.path.join(store.root, f".{uuid.uuid4().hex}.part")
+        self._file = open(self.temp_path, "wb")
+        self._writer = zstandard.ZstdCompressor(level=store.level).stream_writer(self._file, closefd=False)
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.stored_size = None
+        self.key = None
+
+    def write(self, data):
+        self._digest.update(data)
+        self._writer.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        """Complete the compressed file and return the content hash, which is its key."""
+        self._writer.close()
+        self._file.close()
+        self.stored_size = os.path.getsize(self.temp_path)
+        self.key = self._digest.hexdigest()
+        return self.key
+
+    def commit(self):
+        os.replace(self.temp_path, self.store.path(self.key))
+
+    def abort(self):
+        if not self._writer.closed:
+            self._writer.close()
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class BlobStore:
+    """Uploaded files stored once per SHA-256 of their contents, zstd-compressed on local disk."""
+
+    def __init__(self, root, level):
+        self.root = root
+        self.level = level
+
+    def new_upload(self):
+        os.makedirs(self.root, exist_ok=True)
+        return BlobSink(self)
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.csv.zst")
+
+    @contextmanager
+    def locked(self, key):
+        """Exclusive lock, across processes, on a blob's row and file.
+
+        Held from reading or changing the row until its file is in place or
+        deleted, so an identical upload cannot slip between the two.
+        """
+        lock_dir = os.path.join(self.root, LOCK_DIR)
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"{key[:2]}.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def open(self, key):
+        """Decompressing reader over the original bytes; it can only seek forwards."""
+        return zstandard.ZstdDecompressor().stream_reader(open(self.path(key), "rb"), closefd=True)
+
+    def open_compressed(self, key):
+        return open(self.path(key), "rb")
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+blob_store = BlobStore(Config.DATASET_STORAGE_DIR, Config.DATASET_BLOB_ZSTD_LEVEL)
+
+
+def open_dataset_file(dataset):
+    """Binary file object over a dataset's original CSV, wherever it is stored."""
+    if dataset.blob_id:
+        return blob_store.open(dataset.blob_id)
+    # Uploads from before the blob store keep a raw file, or older still, their bytes in the row
+    if dataset.storage_key:
+        return file_store.open(dataset.storage_key)
+    return BytesIO(dataset.file_data)
+
+
+class TeeReader(io.RawIOBase):
+    """Readable stream that copies everything read from ``source`` into ``sink``."""
+
+    def __init__(self, source, sink, on_read=None):
+        super().__init__()
+        self.source = source
+        self.sink = sink
+        self.on_read = on_read
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.source.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        if n:
+            self.sink.write(data)
+            self.bytes_read += n
+            if self.on_read is not None:
+                self.on_read(self.bytes_read)
+        return n
+
+    def drain(self, block_size=1024 * 1024):
+        while self.read(block_size):
+            pass
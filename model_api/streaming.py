@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+from columnar import column_array
+from evaluation import score_predictions
+
+TRAINING_MODES = ('memory', 'streaming', 'sample')
+# Model types that learn incrementally with partial_fit
+STREAMING_MODEL_TYPES = ('sgd', 'naive_bayes')
+# Every HOLDOUT_EVERY-th row is held out for evaluation in streaming mode
+HOLDOUT_EVERY = 5
+
+
+class ChunkEncoder:
+    """Turns row ranges of a columnar dataset into model-ready arrays without materializing the dataset.
+
+    Categorical columns are encoded straight from their stored codes, using the
+    category sets recorded at upload, sorted so the encodings match what
+    LabelEncoder produces for an in-memory fit.
+    """
+
+    def __init__(self, dataset_id, meta, feature_columns, target_column):
+        self.dataset_id = dataset_id
+        self.meta = meta
+        self.feature_columns = feature_columns
+        self.target_column = target_column
+        self.label_encoders = {}
+        self._remaps = {}
+        for name in feature_columns + [target_column]:
+            column, _ = column_array(dataset_id, meta, name)
+            if column["kind"] == "category":
+                categories = column["categories"]
+                order = sorted(range(len(categories)), key=categories.__getitem__)
+                remap = np.empty(len(categories), dtype=np.float64)
+                remap[order] = np.arange(len(categories))
+                self._remaps[name] = remap
+                if name != target_column:
+                    self.label_encoders[name] = [categories[i] for i in order]
+        target, _ = column_array(dataset_id, meta, target_column)
+        # A categorical target makes this a classification problem, as y.dtype == 'object' does in memory
+        self.classes = np.array(sorted(target["categories"]), dtype=object) if target["kind"] == "category" else None
+
+    def _values(self, name, start, stop):
+        column, values = column_array(self.dataset_id, self.meta, name)
+        values = values[start:stop]
+        if name in self._remaps:
+            codes = np.asarray(values)
+            remap = self._remaps[name]
+            if not len(remap):
+                return np.full(len(codes), np.nan)
+            return np.where(codes >= 0, remap[np.maximum(codes, 0)], np.nan)
+        return np.asarray(values, dtype=np.float64)
+
+    def encode(self, start, stop):
+        """Encoded (X, y, row numbers) for rows [start, stop), skipping rows with a missing value."""
+        X = np.column_stack([self._values(name, start, stop) for name in self.feature_columns])
+        y = self._values(self.target_column, start, stop)
+        complete = ~(np.isnan(X).any(axis=1) | np.isnan(y))
+        rows = np.arange(start, start + len(y))[complete]
+        X, y = X[complete], y[complete]
+        if self.classes is not None:
+            y = self.classes.take(y.astype(np.intp))
+        return pd.DataFrame(X, columns=self.feature_columns), y, rows
+
+
+class HoldoutSample:
+    """Uniform sample of at most ``size`` held-out rows, kept as bottom-k of random keys."""
+
+    def __init__(self, size, seed=42):
+        self.size = size
+        self._rng = np.random.default_rng(seed)
+        self._keys = np.empty(0)
+        self.X = None
+        self.y = None
+
+    def add(self, X, y):
+        keys = np.concatenate([self._keys, self._rng.random(len(y))])
+        X = X if self.X is None else pd.concat([self.X, X], ignore_index=True)
+        y = y if self.y is None else np.concatenate([self.y, y])
+        if len(keys) > self.size:
+            keep = np.argpartition(keys, self.size)[:self.size]
+            keys, X, y = keys[keep], X.iloc[keep].reset_index(drop=True), y[keep]
+        self._keys, self.X, self.y = keys, X, y
+
+
+def fit_streaming(model, encoder, chunk_rows, epochs, evaluate, eval_rows, check_cancelled):
+    """Fit ``model`` chunk by chunk with partial_fit, holding out every HOLDOUT_EVERY-th row when ``evaluate``.
+
+    ``model`` is a partial_fit-capable estimator, or a Pipeline of a StandardScaler
+    and one, in which case the scaler takes a first pass over the data on its own.
+    Memory stays bounded by ``chunk_rows`` plus the ``eval_rows`` holdout sample.
+    Returns the fitted model and its metrics.
+    """
+    n_rows = encoder.meta["row_count"]
+    rng = np.random.default_rng(42)
+    holdout = HoldoutSample(eval_rows) if evaluate else None
+    stats = {"rows_trained": 0, "rows_skipped": 0}
+
+    def chunks(collect_stats=False):
+        for start in range(0, n_rows, chunk_rows):
+            check_cancelled()
+            stop = min(start + chunk_rows, n_rows)
+            X, y, rows = encoder.encode(start, stop)
+            held_out = rows % HOLDOUT_EVERY == 0 if evaluate else np.zeros(len(rows), dtype=bool)
+            if collect_stats:
+                stats["rows_skipped"] += (stop - start) - len(rows)
+                stats["rows_trained"] += int((~held_out).sum())
+                if evaluate and held_out.any():
+                    holdout.add(X[held_out].reset_index(drop=True), y[held_out])
+            # Shuffle within the chunk so stored row order does not bias the updates
+            order = rng.permutation(np.flatnonzero(~held_out))
+            yield X.iloc[order], y[order]
+
+    # A scaled model is the two-step Pipeline built by training.build_model
+    if hasattr(model, 'named_steps'):
+        scaler, estimator = model.named_steps['scale'], model.named_steps['model']
+        for X, _ in chunks(collect_stats=True):
+            if len(X):
+                scaler.partial_fit(X)
+        transform = scaler.transform
+    else:
+        scaler, estimator, transform = None, model, None
+        epochs = 1
+
+    fit_kwargs = {"classes": encoder.classes} if encoder.classes is not None else {}
+    for epoch in range(epochs):
+        for X, y in chunks(collect_stats=scaler is None and epoch == 0):
+            if len(X):
+                estimator.partial_fit(transform(X) if transform else X, y, **fit_kwargs)
+
+    metrics = {"mode": "streaming", "epochs": epochs, **stats}
+    if evaluate and holdout.y is not None and len(holdout.y):
+        metrics.update({
+            "evaluation": "holdout",
+            "test_rows": len(holdout.y),
+            **score_predictions(model, holdout.y, model.predict(holdout.X))
+        })
+    return model, metrics
+
+
+def stratified_sample_rows(dataset_id, meta, target_column, sample_rows, chunk_rows, seed=42):
+    """Sorted row numbers of a sample of at most ``sample_rows`` rows, stratified on the target.
+
+    Each class (a single stratum for a numeric target) keeps the rows with the
+    smallest random keys seen so far, so one pass over the target column yields a
+    uniform sample per class; classes then get shares proportional to their counts.
+    Rows with a missing target are never sampled.
+    """
+    column, target = column_array(dataset_id, meta, target_column)
+    rng = np.random.default_rng(seed)
+    strata = {}
+    counts = {}
+    for start in range(0, meta["row_count"], chunk_rows):
+        values = np.asarray(target[start:start + chunk_rows])
+        if column["kind"] == "category":
+            valid = values >= 0
+            labels = values
+        else:
+            valid = ~np.isnan(values.astype(np.float64))
+            labels = np.zeros(len(values), dtype=np.int32)
+        rows = np.arange(start, start + len(values))[valid]
+        labels = labels[valid]
+        keys = rng.random(len(rows))
+        for label in np.unique(labels):
+            selected = labels == label
+            counts[label] = counts.get(label, 0) + int(selected.sum())
+            old_keys, old_rows = strata.get(label, (np.empty(0), np.empty(0, dtype=np.int64)))
+            merged_keys = np.concatenate([old_keys, keys[selected]])
+            merged_rows = np.concatenate([old_rows, rows[selected]])
+            if len(merged_keys) > sample_rows:
+                keep = np.argpartition(merged_keys, sample_rows)[:sample_rows]
+                merged_keys, merged_rows = merged_keys[keep], merged_rows[keep]
+            strata[label] = (merged_keys, merged_rows)
+
+    total = sum(counts.values())
+    sampled = []
+    for label, (keys, rows) in strata.items():
+        share = len(rows) if total <= sample_rows else max(1, int(sample_rows * counts[label] / total))
+        sampled.append(rows[np.argsort(keys)[:share]])
+    return np.sort(np.concatenate(sampled)) if sampled else np.empty(0, dtype=np.int64)
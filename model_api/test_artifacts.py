@@ -0,0 +1,39 @@
+import threading
+
+from artifacts import artifact_store, keep_artifact, release_artifact
+from database import MLModel
+
+ARTIFACT = {"weights": [4, 5, 6]}
+
+
+def add_model(db, user, key):
+    db.add(MLModel(
+        user_id=user.id, name="m", model_type="random_forest", feature_columns=["a"], target_column="b",
+        artifact_key=key, config_data={}
+    ))
+    db.commit()
+
+
+def test_release_waits_for_the_artifact_lock(db, user):
+    key = artifact_store.save(ARTIFACT)
+    with artifact_store.locked(key):
+        releasing = threading.Thread(target=release_artifact, args=(key,))
+        releasing.start()
+        releasing.join(0.2)
+        assert releasing.is_alive()
+        # A model saved with the same content is committed while the release waits
+        add_model(db, user, key)
+    releasing.join()
+    assert artifact_store.exists(key)
+
+
+def test_an_artifact_released_before_its_model_was_committed_is_saved_again(db, user):
+    key = artifact_store.save(ARTIFACT)
+    # Another model with the same content was deleted between the save and the commit
+    release_artifact(key)
+    add_model(db, user, key)
+    assert not artifact_store.exists(key)
+
+    keep_artifact(key, ARTIFACT)
+    assert artifact_store.exists(key)
+    assert artifact_store.load(key) == ARTIFACT
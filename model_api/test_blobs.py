@@ -0,0 +1,63 @@
+import os
+import threading
+
+from sqlalchemy.orm import Query
+
+import database
+from blobs import acquire_blob, release_blob
+from database import DatasetBlob
+from storage import blob_store
+
+KEY = "ab" * 32
+
+
+def store_blob(ref_count):
+    os.makedirs(blob_store.root, exist_ok=True)
+    with open(blob_store.path(KEY), "wb") as f:
+        f.write(b"blob")
+    db = database.SessionLocal()
+    try:
+        db.add(DatasetBlob(id=KEY, size=4, stored_size=4, ref_count=ref_count))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_an_identical_first_upload_that_loses_the_insert_counts_its_reference(db, monkeypatch):
+    store_blob(ref_count=1)
+    # The other upload's row appears only after this one found none to update
+    original = Query.update
+    calls = []
+
+    def update_after_the_other_insert(self, *args, **kwargs):
+        calls.append(1)
+        return 0 if len(calls) == 1 else original(self, *args, **kwargs)
+
+    monkeypatch.setattr(Query, "update", update_after_the_other_insert)
+    assert acquire_blob(db, KEY, 4, 4) is True
+    db.commit()
+    assert db.get(DatasetBlob, KEY).ref_count == 2
+
+
+def test_release_waits_for_an_upload_holding_the_blob_lock(db):
+    store_blob(ref_count=0)
+    with blob_store.locked(KEY):
+        releasing = threading.Thread(target=release_blob, args=(KEY,))
+        releasing.start()
+        releasing.join(0.2)
+        assert releasing.is_alive()
+        # An identical upload takes the row while the release is still waiting
+        assert acquire_blob(db, KEY, 4, 4) is True
+        db.commit()
+    releasing.join()
+
+    db.expire_all()
+    assert db.get(DatasetBlob, KEY).ref_count == 1
+    assert os.path.exists(blob_store.path(KEY))
+
+
+def test_release_deletes_an_unreferenced_blob(db):
+    store_blob(ref_count=0)
+    release_blob(KEY)
+    assert db.get(DatasetBlob, KEY) is None
+    assert not os.path.exists(blob_store.path(KEY))
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeRegressor
+
+from artifacts import artifact_store
+from columnar import write_frame
+from compiled_trees import compile_trees, verify_compiled
+from database import Dataset, MLModel
+from training import TrainingError, verify_compiled_predictor
+
+
+def make_frame(rows=300):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "x": rng.normal(size=rows),
+        "color": rng.choice(["red", "green", "blue"], size=rows),
+        "label": rng.choice(["a", "b"], size=rows)
+    })
+
+
+def encoded(df):
+    return pd.DataFrame({"x": df["x"], "color": df["color"].map({"blue": 0, "green": 1, "red": 2})})
+
+
+@pytest.mark.parametrize("estimator", [
+    RandomForestClassifier(n_estimators=5, random_state=0), DecisionTreeRegressor(random_state=0)
+])
+def test_compiled_trees_match_sklearn(estimator):
+    df = make_frame()
+    X = encoded(df)
+    y = df["label"] if isinstance(estimator, RandomForestClassifier) else df["x"] * 2
+    model = estimator.fit(X, y)
+    compiled = compile_trees(model)
+    assert verify_compiled(model, compiled, X)
+    assert np.array_equal(compiled.predict(X), model.predict(X))
+
+
+def test_a_compiled_engine_that_differs_fails_verification():
+    df = make_frame()
+    X = encoded(df)
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, df["label"])
+    compiled = compile_trees(model)
+    compiled.threshold = compiled.threshold + 1.0
+    assert not verify_compiled(model, compiled, X)
+
+
+def stored_model(db, user, model, with_dataset=True):
+    dataset = None
+    if with_dataset:
+        dataset = Dataset(user_id=user.id, name="training", columns=["x", "color", "label"])
+        db.add(dataset)
+        db.commit()
+        write_frame(dataset.id, make_frame())
+    ml_model = MLModel(
+        user_id=user.id, name="forest", model_type="random_forest", feature_columns=["x", "color"],
+        target_column="label", artifact_key=artifact_store.save(model), dataset_id=dataset.id if dataset else None,
+        config_data={
+            "feature_columns": ["x", "color"], "predictor": "sklearn",
+            "preprocessing": {"label_encoders": {"color": ["blue", "green", "red"]}}
+        }
+    )
+    db.add(ml_model)
+    db.commit()
+    return ml_model
+
+
+def test_switching_to_compiled_is_verified_on_the_stored_dataset(db, user, monkeypatch):
+    df = make_frame()
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(encoded(df), df["label"])
+    ml_model = stored_model(db, user, model)
+    verify_compiled_predictor(ml_model, ml_model.dataset)
+
+    # An engine that disagrees with sklearn on those rows is refused
+    import training
+    monkeypatch.setattr(training, "verify_compiled", lambda model, compiled, X: False)
+    with pytest.raises(TrainingError) as refused:
+        verify_compiled_predictor(ml_model, ml_model.dataset)
+    assert refused.value.status_code == 400
+
+
+def test_switching_to_compiled_needs_a_dataset(db, user):
+    df = make_frame()
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(encoded(df), df["label"])
+    ml_model = stored_model(db, user, model, with_dataset=False)
+    with pytest.raises(TrainingError) as refused:
+        verify_compiled_predictor(ml_model, ml_model.dataset)
+    assert refused.value.status_code == 400
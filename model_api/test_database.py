@@ -0,0 +1,132 @@
+from sqlalchemy import inspect, text
+
+import database
+from database import Base, Dataset, MLModel, engine, upgrade_schema
+
+# Tables as the first release created them, before any of the columns and indexes added since
+LEGACY_SCHEMA = (
+    """CREATE TABLE users (
+        id INTEGER PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, password VARCHAR(255) NOT NULL,
+        email VARCHAR(120) UNIQUE, created_at DATETIME, last_login DATETIME, is_active BOOLEAN
+    )""",
+    """CREATE TABLE datasets (
+        id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        name VARCHAR(100) NOT NULL, description VARCHAR, file_data BLOB, columns JSON NOT NULL,
+        row_count INTEGER, created_at DATETIME, updated_at DATETIME
+    )""",
+    """CREATE TABLE ml_models (
+        id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        name VARCHAR(100) NOT NULL, description VARCHAR, model_type VARCHAR(50) NOT NULL,
+        feature_columns JSON NOT NULL, target_column VARCHAR(50) NOT NULL, model_data BLOB NOT NULL,
+        config_data JSON NOT NULL, metrics JSON, created_at DATETIME, updated_at DATETIME, is_active BOOLEAN,
+        dataset_id INTEGER REFERENCES datasets (id)
+    )""",
+    """CREATE TABLE predictions (
+        id INTEGER PRIMARY KEY, model_id INTEGER NOT NULL REFERENCES ml_models (id) ON DELETE CASCADE,
+        input_data JSON NOT NULL, prediction_result JSON NOT NULL, confidence_score FLOAT, created_at DATETIME
+    )""",
+    # As the job queue first created it, before scoring jobs
+    """CREATE TABLE training_jobs (
+        id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        dataset_id INTEGER REFERENCES datasets (id) ON DELETE SET NULL, state VARCHAR(20) NOT NULL,
+        stage VARCHAR(20), stage_timings JSON, params JSON NOT NULL,
+        model_id INTEGER REFERENCES ml_models (id) ON DELETE SET NULL, error VARCHAR,
+        created_at DATETIME, started_at DATETIME, finished_at DATETIME
+    )""",
+)
+
+
+def create_legacy_database():
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO users (id, username, password) VALUES (1, 'old', 'x')"))
+        conn.execute(text("INSERT INTO datasets (id, user_id, name, columns, file_data) VALUES (1, 1, 'd', '[\"a\", \"b\"]', X'610A')"))
+        conn.execute(text(
+            "INSERT INTO ml_models (id, user_id, name, model_type, feature_columns, target_column, model_data, config_data)"
+            " VALUES (1, 1, 'm', 'svm', '[\"a\"]', 'b', X'00', '{}')"
+        ))
+        conn.execute(text("INSERT INTO training_jobs (id, user_id, state, params) VALUES (1, 1, 'succeeded', '{}')"))
+
+
+def test_upgrade_brings_legacy_tables_up_to_the_models():
+    create_legacy_database()
+    applied = upgrade_schema()
+    assert "add datasets.parent_id" in applied
+    assert "add training_jobs.kind" in applied
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        assert columns == {column.name for column in table.columns}, table.name
+    indexes = {index['name'] for index in inspector.get_indexes('predictions')}
+    assert 'ix_predictions_model_id_created_at_id' in indexes
+
+
+def test_upgrade_keeps_rows_and_is_idempotent():
+    create_legacy_database()
+    upgrade_schema()
+    assert upgrade_schema() == []
+
+    db = database.SessionLocal()
+    try:
+        dataset = db.query(Dataset).one()
+        assert (dataset.name, dataset.parent_id, dataset.blob_id) == ('d', None, None)
+        assert db.query(MLModel.name).scalar() == 'm'
+        assert db.execute(text("SELECT kind FROM training_jobs")).scalar() == 'train'
+    finally:
+        db.close()
+
+
+def test_upgrade_relaxes_model_data_not_null():
+    create_legacy_database()
+    upgrade_schema()
+    db = database.SessionLocal()
+    try:
+        db.add(MLModel(
+            user_id=1, name='new', model_type='svm', feature_columns=['a'], target_column='b',
+            artifact_key='0' * 64, config_data={}
+        ))
+        db.commit()
+        assert db.query(MLModel).count() == 2
+    finally:
+        db.close()
+
+
+def test_on_commit_callbacks_run_after_commit_and_are_dropped_on_rollback(db):
+    calls = []
+    db.execute(text("SELECT 1"))
+    database.on_commit(db, lambda: calls.append("rolled back"))
+    db.rollback()
+    db.execute(text("SELECT 1"))
+    database.on_commit(db, lambda: calls.append("committed"))
+    assert calls == []
+    db.commit()
+    assert calls == ["committed"]
+
+
+def test_deleted_model_releases_its_artifact_only_on_commit(db, user):
+    from artifacts import artifact_store
+    key = artifact_store.save({"weights": [1, 2, 3]})
+    ml_model = MLModel(
+        user_id=user.id, name='m', model_type='svm', feature_columns=['a'], target_column='b',
+        artifact_key=key, config_data={}
+    )
+    db.add(ml_model)
+    db.commit()
+
+    db.delete(ml_model)
+    db.flush()
+    db.rollback()
+    assert artifact_store.exists(key)
+    db.delete(db.get(MLModel, ml_model.id))
+    db.commit()
+    assert not artifact_store.exists(key)
+
+
+def test_async_url_translates_libpq_parameters_for_asyncpg():
+    url = database.to_async_url("postgresql://u:p@db.example/app?sslmode=require&connect_timeout=5")
+    assert url.drivername == "postgresql+asyncpg"
+    assert dict(url.query) == {"ssl": "require"}
+    assert database.to_async_url("sqlite:///app.db").drivername == "sqlite+aiosqlite"
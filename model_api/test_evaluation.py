@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import BaseEstimator, RegressorMixin
+
+import evaluation
+from evaluation import search_hyperparameters
+
+
+class SlowRegressor(RegressorMixin, BaseEstimator):
+    """Predicts the mean, after sleeping ``delay`` seconds in fit."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def fit(self, X, y):
+        time.sleep(self.delay)
+        self.mean_ = float(np.mean(y))
+        return self
+
+    def predict(self, X):
+        return np.full(len(X), self.mean_)
+
+
+@pytest.fixture
+def data(monkeypatch):
+    monkeypatch.setitem(evaluation.SEARCH_SPACES, 'slow', {'delay': [0.0, 60.0]})
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({"x": rng.normal(size=200)}), pd.Series(rng.normal(size=200))
+
+
+def test_search_stops_waiting_once_the_budget_is_spent(data):
+    X, y = data
+    started = time.monotonic()
+    # Enough budget for the pool's workers to start and score the fast candidate
+    search = search_hyperparameters('slow', SlowRegressor(), X, y, 'grid', 2, budget_seconds=10)
+    assert time.monotonic() - started < 30
+    assert search["timed_out"]
+    assert search["best_params"] == {"delay": 0.0}
+
+
+def test_search_stops_when_its_job_is_cancelled(data, monkeypatch):
+    monkeypatch.setattr(evaluation, "SEARCH_CANCEL_CHECK_SECONDS", 0.1)
+
+    class Cancelled(Exception):
+        pass
+
+    def check_cancelled():
+        raise Cancelled()
+
+    X, y = data
+    started = time.monotonic()
+    with pytest.raises(Cancelled):
+        search_hyperparameters('slow', SlowRegressor(), X, y, 'grid', 2, 300, check_cancelled=check_cancelled)
+    assert time.monotonic() - started < 30
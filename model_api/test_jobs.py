@@ -0,0 +1,92 @@
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from config import Config
+from database import TrainingJob
+from jobs import fail_abandoned_jobs, resume_jobs
+from training import JobRunner, claim_job, job_owner
+
+
+@pytest.fixture
+def make_job(db, user):
+    def make_job(state='queued', owner=None, heartbeat_at=None):
+        job = TrainingJob(user_id=user.id, state=state, params={}, owner=owner, heartbeat_at=heartbeat_at)
+        db.add(job)
+        db.commit()
+        return job
+    return make_job
+
+
+def exited_process_owner():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return f"{job_owner().rpartition(':')[0]}:{process.pid}"
+
+
+def test_claim_runs_a_queued_job_once(db, make_job):
+    job = make_job()
+    claimed = claim_job(db, job.id)
+    assert claimed.state == 'running'
+    assert claimed.owner == job_owner() and claimed.heartbeat_at is not None
+    assert claim_job(db, job.id) is None
+
+
+def test_cancelled_job_is_not_claimed(db, make_job):
+    assert claim_job(db, make_job(state='cancelled').id) is None
+
+
+def test_only_abandoned_jobs_are_failed(db, make_job):
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=Config.JOB_HEARTBEAT_TIMEOUT_SECONDS + 1)
+    alive_here = make_job('running', job_owner(), now)
+    alive_elsewhere = make_job('cancelling', 'other-host:1', now)
+    dead_here = make_job('running', exited_process_owner(), now)
+    silent_elsewhere = make_job('running', 'other-host:1', stale)
+
+    assert fail_abandoned_jobs(db, [alive_here, alive_elsewhere, dead_here, silent_elsewhere]) == 2
+    assert [job.state for job in (alive_here, alive_elsewhere, dead_here, silent_elsewhere)] == \
+        ['running', 'cancelling', 'failed', 'failed']
+
+
+def test_resume_requeues_queued_jobs_and_leaves_live_ones_running(db, make_job, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(jobs, "submit_job", lambda job_id, kind='train': submitted.append((job_id, kind)))
+    queued = make_job()
+    running = make_job('running', 'other-host:1', datetime.utcnow())
+
+    resume_jobs()
+    db.refresh(running)
+    assert submitted == [(queued.id, 'train')]
+    assert running.state == 'running'
+
+
+def test_finishing_a_job_failed_as_abandoned_keeps_it_failed(db, make_job):
+    job = claim_job(db, make_job().id)
+    runner = JobRunner(db, job)
+    db.query(TrainingJob).filter_by(id=job.id).update({'state': 'failed'})
+    db.commit()
+
+    job.stage = 'persist'
+    runner.finish('succeeded')
+    assert job.state == 'failed'
+    # Changes the job would have committed with its result are discarded
+    assert job.stage is None
+
+
+def test_running_job_keeps_its_heartbeat_fresh(db, make_job, monkeypatch):
+    monkeypatch.setattr(Config, "JOB_HEARTBEAT_SECONDS", 0.05)
+    job = claim_job(db, make_job().id)
+    claimed_at = job.heartbeat_at
+    runner = JobRunner(db, job)
+    try:
+        time.sleep(0.3)
+        db.refresh(job)
+        assert job.heartbeat_at > claimed_at
+    finally:
+        runner.finish('succeeded')
+    assert job.state == 'succeeded'
@@ -0,0 +1,27 @@
+import pickle
+
+from sqlalchemy import text
+
+import database
+from artifacts import artifact_store
+from database import MLModel
+from migrate_artifacts import migrate_models, upgrade_schema
+from test_database import create_legacy_database
+
+
+def test_pickled_models_move_to_the_artifact_store():
+    create_legacy_database()
+    estimator = {"coef": [1.0, 2.0]}
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE ml_models SET model_data = :data"), {"data": pickle.dumps(estimator)})
+    upgrade_schema()
+
+    assert migrate_models() == 1
+    db = database.SessionLocal()
+    try:
+        ml_model = db.query(MLModel).one()
+        assert ml_model.model_data is None
+        assert artifact_store.load(ml_model.artifact_key) == estimator
+    finally:
+        db.close()
+    assert migrate_models() == 0
@@ -0,0 +1,52 @@
+import os
+
+from sqlalchemy import text
+
+import database
+from database import Dataset, DatasetBlob
+from migrate_datasets import migrate_datasets, upgrade_schema
+from storage import blob_store, file_store
+from test_database import create_legacy_database
+
+CSV = b"a,b\n1,2\n3,4\n"
+
+
+def test_legacy_database_migrates_into_shared_blobs():
+    create_legacy_database()
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE datasets SET file_data = :data"), {"data": CSV})
+        conn.execute(text(
+            "INSERT INTO datasets (id, user_id, name, columns, file_data) VALUES (2, 1, 'copy', '[\"a\", \"b\"]', :data)"
+        ), {"data": CSV})
+    upgrade_schema()
+
+    assert migrate_datasets() == 2
+    db = database.SessionLocal()
+    try:
+        datasets = db.query(Dataset).order_by(Dataset.id).all()
+        assert datasets[0].blob_id == datasets[1].blob_id
+        assert all(dataset.file_data is None for dataset in datasets)
+        blob = db.get(DatasetBlob, datasets[0].blob_id)
+        assert (blob.ref_count, blob.size) == (2, len(CSV))
+        with blob_store.open(blob.id) as f:
+            assert f.read() == CSV
+    finally:
+        db.close()
+    # Interrupted or repeated runs pick up only what is left
+    assert migrate_datasets() == 0
+
+
+def test_file_store_uploads_are_moved_and_their_file_deleted(db, user):
+    sink = file_store.new_upload()
+    sink.write(CSV)
+    key = sink.commit()
+    db.add(Dataset(user_id=user.id, name="stored", columns=["a", "b"], storage_key=key))
+    db.commit()
+
+    assert migrate_datasets() == 1
+    dataset = db.query(Dataset).one()
+    db.refresh(dataset)
+    assert dataset.storage_key is None and dataset.blob_id
+    assert not os.path.exists(file_store.path(key))
+    with blob_store.open(dataset.blob_id) as f:
+        assert f.read() == CSV
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import prediction_log
+from database import MLModel, Prediction
+from prediction_log import PredictionWriter
+
+
+@pytest.fixture
+def model_id(db, user):
+    ml_model = MLModel(
+        user_id=user.id, name='m', model_type='svm', feature_columns=['a'], target_column='b',
+        artifact_key='0' * 64, config_data={}
+    )
+    db.add(ml_model)
+    db.commit()
+    return ml_model.id
+
+
+@pytest.fixture
+def writer():
+    writer = PredictionWriter(
+        batch_size=100, flush_interval=0.01, max_queue=1000, overflow_policy='block', block_timeout=0.1, max_retries=2
+    )
+    yield writer
+    writer.stop(timeout=5)
+
+
+def rows(model_id, count):
+    return [
+        {"model_id": model_id, "input_data": {"a": i}, "prediction_result": [i], "confidence_score": None}
+        for i in range(count)
+    ]
+
+
+def test_batches_are_written(db, model_id, writer):
+    assert writer.submit(rows(model_id, 250)) == 250
+    writer.flush(timeout=5)
+    assert db.query(Prediction).count() == 250
+    assert writer.stats()["written"] == 250
+
+
+def test_poison_row_is_rejected_without_holding_up_the_rest(db, model_id, writer):
+    batch = rows(model_id, 5)
+    # model_id is NOT NULL
+    batch[2] = {**batch[2], "model_id": None}
+    writer.submit(batch)
+    writer.flush(timeout=5)
+    writer.submit(rows(model_id, 3))
+    writer.flush(timeout=5)
+
+    stats = writer.stats()
+    assert (stats["written"], stats["rejected"], stats["queued"]) == (7, 1, 0)
+    assert db.query(Prediction).count() == 7
+
+
+def test_poison_row_does_not_hang_shutdown(model_id, writer):
+    writer.submit([{**rows(model_id, 1)[0], "model_id": None}])
+    started = time.monotonic()
+    writer.stop(timeout=5)
+    assert time.monotonic() - started < 2
+    assert writer.stats()["rejected"] == 1
+
+
+def test_unavailable_database_is_retried_a_bounded_number_of_times(model_id, writer, monkeypatch):
+    class FailingSession:
+        def execute(self, *args, **kwargs):
+            raise OperationalError("INSERT", {}, Exception("database is down"))
+
+        def commit(self):
+            pass
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(prediction_log, "SessionLocal", FailingSession)
+    writer.submit(rows(model_id, 10))
+    writer.flush(timeout=5)
+
+    stats = writer.stats()
+    assert (stats["queued"], stats["written"], stats["rejected"]) == (0, 0, 10)
+    # The first attempt and max_retries retries, then a single row-by-row pass that stops at the first failure
+    assert stats["failed_batches"] == 3
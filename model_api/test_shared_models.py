@@ -0,0 +1,49 @@
+import os
+
+import pytest
+from sklearn.tree import DecisionTreeClassifier
+
+from artifacts import artifact_store
+from database import MLModel
+from model_cache import model_cache
+from shared_models import shared_model_store
+
+
+@pytest.fixture
+def stored_model(db, user):
+    def store(predictor):
+        model = DecisionTreeClassifier(random_state=0).fit([[0], [1], [2], [3]], ["a", "b", "a", "b"])
+        ml_model = MLModel(
+            user_id=user.id, name=predictor, model_type="decision_tree", feature_columns=["x"], target_column="y",
+            artifact_key=artifact_store.save(model), config_data={"feature_columns": ["x"], "predictor": predictor}
+        )
+        db.add(ml_model)
+        db.commit()
+        return ml_model
+
+    model_cache.clear()
+    yield store
+    model_cache.clear()
+
+
+def test_models_served_by_sklearn_skip_the_store(stored_model):
+    ml_model = stored_model("sklearn")
+    builds = shared_model_store.builds
+
+    entry = model_cache.get(ml_model)
+    assert entry.model is not None and entry.compiled is None
+    assert shared_model_store.builds == builds
+    assert not os.path.exists(shared_model_store.path(ml_model.id, ml_model.updated_at))
+    # Without a serving file the entry is still a cache hit
+    assert model_cache.get(ml_model) is entry
+
+
+def test_compiled_models_are_served_from_the_store(stored_model):
+    ml_model = stored_model("compiled")
+
+    entry = model_cache.get(ml_model)
+    assert os.path.exists(shared_model_store.path(ml_model.id, ml_model.updated_at))
+    assert entry.compiled is not None
+    # The estimator is only loaded once a batch too large for the compiled trees needs it
+    assert entry._model is None
+    assert model_cache.get(ml_model) is entry
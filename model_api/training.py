@@ -0,0 +1,368 @@
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from artifacts import artifact_store, keep_artifact, load_model, release_artifact
+from compiled_trees import VERIFY_ROWS, compile_trees, verify_compiled
+from columnar import ensure_columnar, read_columns, read_rows
+from config import Config
+from database import SessionLocal, engine, Dataset, MLModel, TrainingJob
+from evaluation import evaluate_model, search_hyperparameters, set_n_jobs
+from inference import encode_features
+from model_cache import CachedModel
+from model_types import MODEL_TYPES, PIPELINE_CLASS, REGISTRY, SCALER_CLASS, estimator_class, load_class
+from streaming import ChunkEncoder, fit_streaming, stratified_sample_rows
+
+
+class TrainingError(Exception):
+    """A training failure that maps onto an HTTP error response."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# States of a job some process is working on
+ACTIVE_STATES = ('running', 'cancelling')
+
+
+def job_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def build_model(ml_model_type, y, n_jobs=None):
+    model_type = REGISTRY.get(ml_model_type)
+    if model_type is None:
+        raise TrainingError(400, "Invalid model type")
+    categorical_target = y.dtype == 'object'
+    if model_type.categorical_target and not categorical_target:
+        raise TrainingError(400, f"{ml_model_type} needs a categorical target column")
+
+    params = dict(model_type.params)
+    if model_type.parallel:
+        params['n_jobs'] = n_jobs
+    model = estimator_class(ml_model_type, categorical_target)(**params)
+    if model_type.scaled:
+        return load_class(PIPELINE_CLASS)([('scale', load_class(SCALER_CLASS)()), ('model', model)])
+    return model
+
+
+def validate_columns(column_names, target_column, drop_columns):
+    # Check target column
+    if target_column not in column_names:
+        raise TrainingError(400, "Target column not found in dataset")
+
+    # Check columns to drop
+    for col in drop_columns:
+        if col not in column_names or col == target_column:
+            raise TrainingError(400, f"Column '{col}' cannot be dropped")
+
+
+def validate_against_profile(profile, target_column, drop_columns):
+    """Reject a training request using only the stored dataset profile."""
+    columns = {column["name"]: column for column in profile["columns"]}
+    validate_columns(list(columns), target_column, drop_columns)
+    target = columns[target_column]
+    if target["null_count"] >= target["count"]:
+        raise TrainingError(400, "Target column has no values")
+    if target["distinct_estimate"] < 2:
+        raise TrainingError(400, "Target column needs at least two distinct values")
+    if len(columns) - len(drop_columns) < 2:
+        raise TrainingError(400, "No feature columns left to train on")
+
+
+def load_meta(dataset, target_column, drop_columns):
+    """Validate the requested columns against the dataset; returns its columnar metadata and the columns training needs."""
+    try:
+        meta = ensure_columnar(dataset)
+    except Exception as e:
+        raise TrainingError(500, f"Error reading dataset: {str(e)}")
+    column_names = [column["name"] for column in meta["columns"]]
+    validate_columns(column_names, target_column, drop_columns)
+    return meta, [col for col in column_names if col not in drop_columns]
+
+
+def load_frame(dataset, target_column, drop_columns, sample_rows=None):
+    """Load only the columns training needs; with ``sample_rows``, only a stratified sample of the rows."""
+    meta, columns = load_meta(dataset, target_column, drop_columns)
+    if sample_rows is None:
+        return read_columns(dataset.id, meta, columns)
+    rows = stratified_sample_rows(dataset.id, meta, target_column, sample_rows, Config.TRAINING_CHUNK_ROWS)
+    return read_rows(dataset.id, meta, columns, rows)
+
+
+def prepare_features(df, target_column):
+    """Label-encode categorical features.
+
+    Returns (X, y, feature_columns, label_encoders).
+    """
+    # Identify feature columns
+    feature_columns = [col for col in df.columns if col != target_column]
+
+    from sklearn.preprocessing import LabelEncoder
+
+    # Encode categorical variables
+    label_encoders = {}
+    for column in df.select_dtypes(include=['object']).columns:
+        if column != target_column:
+            le = LabelEncoder()
+            df[column] = le.fit_transform(df[column])
+            label_encoders[column] = list(le.classes_)
+
+    return df[feature_columns], df[target_column], feature_columns, label_encoders
+
+
+def verify_compiled_predictor(ml_model, dataset):
+    """Reject switching ``ml_model`` to the compiled engine unless it reproduces sklearn exactly.
+
+    Checks up to VERIFY_ROWS rows of the model's stored dataset, encoded the way
+    predictions encode them, as training does before choosing the compiled engine.
+    """
+    if dataset is None:
+        raise TrainingError(400, "The model has no stored dataset to verify the compiled predictor on")
+    try:
+        meta = ensure_columnar(dataset)
+    except Exception as e:
+        raise TrainingError(500, f"Error reading dataset: {str(e)}")
+    missing = set(ml_model.feature_columns) - {column["name"] for column in meta["columns"]}
+    if missing:
+        raise TrainingError(400, f"The model's dataset lacks feature columns: {', '.join(sorted(missing))}")
+
+    model, _ = load_model(ml_model)
+    compiled = compile_trees(model)
+    if compiled is None:
+        raise TrainingError(400, "This model cannot be compiled")
+    cached = CachedModel(ml_model.id, ml_model.updated_at, model, ml_model.config_data, 0, compiled)
+    X, errors = encode_features(read_columns(dataset.id, meta, ml_model.feature_columns, 0, VERIFY_ROWS), cached)
+    X = X.iloc[[position for position in range(len(X)) if position not in errors]]
+    if X.empty:
+        raise TrainingError(400, "The model's dataset has no rows to verify the compiled predictor on")
+    if not verify_compiled(model, compiled, X):
+        raise TrainingError(400, "The compiled predictor does not reproduce this model's predictions")
+
+
+def init_training_worker():
+    # Connections inherited from the forking parent must not be reused by the child
+    engine.dispose(close=False)
+
+
+class JobRunner:
+    """Drives one TrainingJob through its stages inside a worker process.
+
+    A background thread keeps the job's heartbeat fresh until it finishes, so
+    another worker starting up can tell it apart from a job whose process died.
+    """
+
+    def __init__(self, db, job):
+        self.db = db
+        self.job = job
+        self.timings = {}
+        self._finished = threading.Event()
+        threading.Thread(target=self._heartbeat, name=f"job-{job.id}-heartbeat", daemon=True).start()
+
+    def _heartbeat(self):
+        while not self._finished.wait(Config.JOB_HEARTBEAT_SECONDS):
+            db = SessionLocal()
+            try:
+                db.query(TrainingJob).filter(TrainingJob.id == self.job.id, TrainingJob.state.in_(ACTIVE_STATES)) \
+                    .update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            except Exception:
+                # A missed beat only matters if they keep failing until the timeout
+                db.rollback()
+            finally:
+                db.close()
+
+    def check_cancelled(self):
+        self.db.refresh(self.job)
+        # A job failed as abandoned while it was still running here stops as well
+        if self.job.state != 'running':
+            raise JobCancelled()
+
+    @contextmanager
+    def stage(self, name):
+        self.check_cancelled()
+        self.job.stage = name
+        self.db.commit()
+
+        started = time.perf_counter()
+        yield
+        self.timings[name] = round(time.perf_counter() - started, 6)
+        self.job.stage_timings = dict(self.timings)
+        self.db.commit()
+
+    def report_progress(self, rows_done, rows_total, elapsed):
+        # Doubles as a cancellation point for jobs that work through their rows in chunks
+        self.check_cancelled()
+        self.job.progress = {
+            "rows_done": rows_done,
+            "rows_total": rows_total,
+            "rows_per_second": round(rows_done / elapsed, 1) if elapsed > 0 else None
+        }
+        self.db.commit()
+
+    def finish(self, state, error=None):
+        self._finished.set()
+        # Only from an active state: a job already failed as abandoned keeps that outcome,
+        # and whatever it would have committed along with it is discarded
+        finished = self.db.query(TrainingJob).filter(TrainingJob.id == self.job.id, TrainingJob.state.in_(ACTIVE_STATES)) \
+            .update({'state': state, 'error': error, 'finished_at': datetime.utcnow()}, synchronize_session=False)
+        if finished:
+            self.db.commit()
+        else:
+            self.db.rollback()
+        self.db.refresh(self.job)
+
+
+def fit_in_memory(runner, df, params):
+    """Encode, optionally search, fit and evaluate on a fully loaded frame.
+
+    Returns (model, metrics, X, feature_columns, label_encoders).
+    """
+    with runner.stage('encode'):
+        X, y, feature_columns, label_encoders = prepare_features(df, params['target_column'])
+
+    cores = Config.TRAINING_CORES_PER_JOB
+    search = None
+    if params.get('search', 'none') != 'none':
+        with runner.stage('search'):
+            search = search_hyperparameters(
+                params['ml_model_type'], build_model(params['ml_model_type'], y), X, y,
+                params['search'], cores, params['search_budget_seconds'], params['search_candidates'],
+                runner.check_cancelled
+            )
+
+    with runner.stage('fit'):
+        model = build_model(params['ml_model_type'], y, n_jobs=cores)
+        if search is not None:
+            model.set_params(**search['best_params'])
+        model.fit(X, y)
+        # Serving predicts a row or a small batch at a time; threads would only add overhead
+        set_n_jobs(model, None)
+
+    metrics = None
+    if params.get('evaluation', 'holdout') != 'none':
+        with runner.stage('evaluate'):
+            metrics = evaluate_model(model, X, y, params.get('evaluation', 'holdout'), cores)
+    if search is not None:
+        metrics = {**(metrics or {}), "search": search}
+    return model, metrics, X, feature_columns, label_encoders
+
+
+def fit_out_of_core(runner, dataset, meta, columns, params):
+    """Fit chunk by chunk from the columnar store, never holding the whole dataset in memory.
+
+    Returns (model, metrics, feature_columns, label_encoders).
+    """
+    target_column = params['target_column']
+    feature_columns = [col for col in columns if col != target_column]
+    encoder = ChunkEncoder(dataset.id, meta, feature_columns, target_column)
+    # build_model only looks at the target dtype to choose between classifier and regressor
+    target = encoder.classes if encoder.classes is not None else np.empty(0)
+    model = build_model(params['ml_model_type'], target)
+    with runner.stage('fit'):
+        model, metrics = fit_streaming(
+            model, encoder, Config.TRAINING_CHUNK_ROWS, Config.STREAMING_EPOCHS,
+            params.get('evaluation', 'holdout') != 'none', Config.STREAMING_EVAL_ROWS, runner.check_cancelled
+        )
+    if not metrics["rows_trained"]:
+        raise TrainingError(400, "No complete rows to train on")
+    return model, metrics, feature_columns, encoder.label_encoders
+
+
+def claim_job(db, job_id):
+    """Move a queued job to running, or return None if it is no longer queued."""
+    # Claim the job atomically so a resubmitted or cancelled job is never run twice
+    now = datetime.utcnow()
+    claimed = db.query(TrainingJob).filter_by(id=job_id, state='queued') \
+        .update({'state': 'running', 'started_at': now, 'owner': job_owner(), 'heartbeat_at': now})
+    db.commit()
+    return db.get(TrainingJob, job_id) if claimed else None
+
+
+def run_training_job(job_id):
+    db = SessionLocal()
+    try:
+        job = claim_job(db, job_id)
+        if job is None:
+            return
+
+        params = job.params
+        runner = JobRunner(db, job)
+        artifact_key = None
+        mode = params.get('mode', 'memory')
+        try:
+            with runner.stage('load'):
+                dataset = db.query(Dataset).filter_by(id=job.dataset_id, user_id=job.user_id).first()
+                if not dataset:
+                    raise TrainingError(404, "Dataset not found")
+                if mode == 'streaming':
+                    meta, columns = load_meta(dataset, params['target_column'], params['drop_columns'])
+                else:
+                    sample_rows = params.get('sample_rows', Config.TRAINING_SAMPLE_ROWS) if mode == 'sample' else None
+                    df = load_frame(dataset, params['target_column'], params['drop_columns'], sample_rows)
+
+            if mode == 'streaming':
+                model, metrics, feature_columns, label_encoders = fit_out_of_core(runner, dataset, meta, columns, params)
+            else:
+                model, metrics, X, feature_columns, label_encoders = fit_in_memory(runner, df, params)
+                if mode == 'sample':
+                    metrics = {**(metrics or {}), "mode": "sample", "rows_sampled": len(df), "rows_total": dataset.row_count}
+
+            predictor = 'sklearn'
+            if params.get('predictor') == 'compiled':
+                with runner.stage('compile'):
+                    # Only switch to the compiled engine if it reproduces sklearn exactly on training rows
+                    compiled = compile_trees(model)
+                    if compiled is not None and verify_compiled(model, compiled, X.head(VERIFY_ROWS)):
+                        predictor = 'compiled'
+
+            with runner.stage('serialize'):
+                artifact_key = artifact_store.save(model)
+
+            with runner.stage('persist'):
+                ml_model = MLModel(
+                    user_id=job.user_id,
+                    dataset_id=job.dataset_id,
+                    name=params['name'],
+                    description=params['description'],
+                    model_type=params['ml_model_type'],
+                    feature_columns=feature_columns,
+                    target_column=params['target_column'],
+                    artifact_key=artifact_key,
+                    metrics=metrics,
+                    config_data={"feature_columns": feature_columns, "target_column": params['target_column'], "preprocessing": {"label_encoders": label_encoders}, "predictor": predictor, "memoize": params.get('memoize', False)}
+                )
+                db.add(ml_model)
+                db.flush()
+                job.model_id = ml_model.id
+        except JobCancelled:
+            db.rollback()
+            runner.finish('cancelled')
+        except TrainingError as e:
+            db.rollback()
+            runner.finish('failed', e.detail)
+        except Exception as e:
+            db.rollback()
+            runner.finish('failed', str(e))
+        else:
+            runner.finish('succeeded')
+        if artifact_key and job.state != 'succeeded':
+            # Saved, but never recorded on a committed model
+            release_artifact(artifact_key)
+        elif artifact_key:
+            # A release of an identical artifact may have deleted the file before the model was committed
+            keep_artifact(artifact_key, model)
+        return runner.timings
+    finally:
+        db.close()